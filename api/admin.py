@@ -1,14 +1,182 @@
 # api/admin.py
 
-from django.contrib import admin
-from .models import User, SocialCard, Season, PlayerSeasonFee, AttendanceLog
-
-# We are registering each of our models here so that they appear
-# in the Django admin interface. This allows us to easily add,
-# view, and edit data in our database tables.
-
-admin.site.register(User)
-admin.site.register(SocialCard)
-admin.site.register(Season)
-admin.site.register(PlayerSeasonFee)
-admin.site.register(AttendanceLog)
\ No newline at end of file
+import uuid
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .fees import roll_out_season_fees
+from .replica import read_from_replica
+from .rollups import delete_attendance_logs
+from .models import User, SocialCard, Season, PlayerSeasonFee, Team, AttendanceLog, MembershipChange
+
+# Every model gets a ModelAdmin that keeps its changelist to a fixed number of
+# cheap queries however big the table gets: related rows are joined in
+# (list_select_related) instead of loaded one per line by __str__, player
+# pickers are raw id inputs instead of a <select> of every member, searches
+# match indexed columns exactly, and the total row count is estimated.
+
+# Below this many rows the estimate isn't worth it (and may be stale), so count
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the Postgres planner's row estimate (pg_class.reltuples) as the
+    count of an unfiltered changelist, instead of a COUNT(*) over the whole
+    table. Filtered lists, other databases and small tables get an exact count.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return row[0]
+        return queryset.count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Don't run a second COUNT(*) of the whole table next to the filtered one
+    show_full_result_count = False
+    list_per_page = 100
+
+    # (lookup, how to turn a search term into its value) pairs, all indexed.
+    # A term is matched exactly, never with a LIKE that can't use an index.
+    indexed_search_fields = ()
+
+    def changelist_view(self, request, extra_context=None):
+        # Browsing the list is read-only; actions are POSTs and stay on the primary
+        if request.method == 'GET':
+            read_from_replica(request.user)
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        matches = queryset.none()
+        for lookup, convert in self.indexed_search_fields:
+            try:
+                value = convert(search_term)
+            except (TypeError, ValueError):
+                continue
+            matches |= queryset.filter(**{lookup: value})
+        return matches, False
+
+
+def member_id(term):
+    return int(term)
+
+
+def email(term):
+    if '@' not in term:
+        raise ValueError(term)
+    # Stored as normalize_email() leaves them: the domain part in lower case
+    return User.objects.normalize_email(term)
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'email', 'first_name', 'last_name', 'membership_type', 'is_active_annual_member',
+                    'annual_membership_expiry_date', 'is_active', 'is_staff')
+    list_filter = ('membership_type', 'is_active_annual_member', 'is_staff')
+    search_fields = ('email',)
+    search_help_text = 'An exact email address or member id.'
+    indexed_search_fields = (('pk', member_id), ('email', email))
+
+
+@admin.register(SocialCard)
+class SocialCardAdmin(LargeTableAdmin):
+    list_display = ('id', 'player', 'card_id_string', 'sessions_remaining', 'sessions_total', 'status')
+    list_select_related = ('player',)
+    list_filter = ('status',)
+    raw_id_fields = ('player',)
+    search_fields = ('card_id_string',)
+    search_help_text = 'A card id, or a member id or exact email address.'
+    indexed_search_fields = (('card_id_string', uuid.UUID), ('player_id', member_id), ('player__email', email))
+
+
+@admin.register(Season)
+class SeasonAdmin(admin.ModelAdmin):
+    list_display = ('name', 'start_date', 'end_date', 'fixture_fee_amount', 'fixture_fee_due_date')
+    date_hierarchy = 'start_date'
+    actions = ['roll_out_fees']
+
+    @admin.action(description='Create fee rows for all active members')
+    def roll_out_fees(self, request, queryset):
+        for season in queryset:
+            created = roll_out_season_fees(season)
+            self.message_user(request, f"Created {created} fee row(s) for {season.name}.", messages.SUCCESS)
+
+
+@admin.register(Team)
+class TeamAdmin(admin.ModelAdmin):
+    list_display = ('name', 'captain')
+    list_select_related = ('captain',)
+    raw_id_fields = ('captain', 'players')
+    search_fields = ('name',)
+
+
+@admin.register(PlayerSeasonFee)
+class PlayerSeasonFeeAdmin(LargeTableAdmin):
+    list_display = ('id', 'player', 'season', 'payment_status', 'stripe_charge_id')
+    list_select_related = ('player', 'season')
+    list_filter = ('season', 'payment_status')
+    raw_id_fields = ('player',)
+    search_fields = ('player__email',)
+    search_help_text = 'A member id or exact email address.'
+    indexed_search_fields = (('player_id', member_id), ('player__email', email))
+
+
+class OpenVisitFilter(admin.SimpleListFilter):
+    # Open visits are served by the partial attendance_open_by_date_idx
+    title = 'visit'
+    parameter_name = 'visit'
+
+    def lookups(self, request, model_admin):
+        return [('open', 'Still checked in'), ('closed', 'Checked out')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'open':
+            return queryset.filter(exit_time__isnull=True)
+        if self.value() == 'closed':
+            return queryset.filter(exit_time__isnull=False)
+        return queryset
+
+
+@admin.register(AttendanceLog)
+class AttendanceLogAdmin(LargeTableAdmin):
+    list_display = ('id', 'player', 'date_of_play', 'entry_time', 'exit_time', 'daily_session_consumed')
+    list_select_related = ('player',)
+    list_filter = (OpenVisitFilter,)
+    date_hierarchy = 'date_of_play'
+    raw_id_fields = ('player',)
+    search_fields = ('player__email',)
+    search_help_text = 'A member id or exact email address.'
+    indexed_search_fields = (('player_id', member_id), ('player__email', email))
+
+    # Deleted visits have to be recounted out of the rollups
+    def delete_model(self, request, obj):
+        delete_attendance_logs(AttendanceLog.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        delete_attendance_logs(queryset)
+
+
+@admin.register(MembershipChange)
+class MembershipChangeAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'reason', 'old_membership_type', 'new_membership_type', 'changed_at')
+    list_select_related = ('user',)
+    list_filter = ('reason',)
+    raw_id_fields = ('user',)
+    search_fields = ('user__email',)
+    search_help_text = 'A member id or exact email address.'
+    indexed_search_fields = (('user_id', member_id), ('user__email', email))
@@ -0,0 +1,277 @@
+# api/archive.py
+
+import gzip
+import json
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.db import transaction
+from django.utils import timezone
+from .models import AttendanceLog
+
+# Closed attendance logs older than ATTENDANCE_ARCHIVE_AFTER_DAYS are moved
+# out of the database by archive_attendance into compressed monthly segment
+# files, so the live table (and its indexes) only holds recent history:
+#
+#   2024-05/seg-00001.jsonl.gz
+#   2024-05/seg-00001.json
+#
+# They're the only copy of those rows, so they live in a durable storage
+# backend (STORAGES['attendance_archive'], see ATTENDANCE_ARCHIVE_STORAGE in
+# settings), and nothing is deleted until a segment has been read back from it.
+#
+# Segments are never changed once written, a later run for the same month
+# just adds another one. The rows in a segment are sorted by player and date,
+# and each player's rows are a gzip member of their own, so the .json index
+# (player -> byte range, day -> row count) lets one player's history be read
+# without decompressing anyone else's. The index is written last, so a
+# segment only exists once it's complete.
+#
+# A row can turn up more than once, e.g. when a run died between writing a
+# segment and deleting the rows it holds. Readers keep the copy with the
+# latest updated_at, and a row still in the database always wins.
+
+ARCHIVE_BATCH_SIZE = 2000
+
+
+class ArchiveError(Exception):
+    """
+    Archived rows didn't read back as written, so nothing more is deleted.
+    """
+
+
+COLUMNS = ('id', 'player_id', 'date_of_play', 'entry_time', 'exit_time', 'daily_session_consumed', 'updated_at')
+
+
+ARCHIVE_STORAGE = 'attendance_archive'
+
+
+def archive_configured():
+    return ARCHIVE_STORAGE in settings.STORAGES
+
+
+def archive_storage():
+    if not archive_configured():
+        raise ArchiveError("No archive storage is configured, set ATTENDANCE_ARCHIVE_STORAGE.")
+    return storages[ARCHIVE_STORAGE]
+
+
+def month_key(day):
+    return f"{day:%Y-%m}"
+
+
+def next_month(month):
+    return (month + timedelta(days=32)).replace(day=1)
+
+
+def month_of(key):
+    return date.fromisoformat(f"{key}-01")
+
+
+def encode(row):
+    return json.dumps({
+        'id': row['id'],
+        'player_id': row['player_id'],
+        'date_of_play': row['date_of_play'].isoformat(),
+        'entry_time': row['entry_time'].isoformat(),
+        'exit_time': row['exit_time'].isoformat() if row['exit_time'] else None,
+        'daily_session_consumed': row['daily_session_consumed'],
+        'updated_at': row['updated_at'].isoformat(),
+    }, separators=(',', ':'))
+
+
+def decode(line):
+    row = json.loads(line)
+    row['date_of_play'] = date.fromisoformat(row['date_of_play'])
+    for field in ('entry_time', 'exit_time', 'updated_at'):
+        if row[field]:
+            row[field] = datetime.fromisoformat(row[field])
+    return row
+
+
+def decode_member(data):
+    return [decode(line) for line in gzip.decompress(data).decode().splitlines()]
+
+
+def archived_months():
+    """
+    The first day of every month that has at least one segment, oldest first.
+    """
+    # Nothing can have been archived without somewhere to archive it to
+    if not archive_configured():
+        return []
+    storage = archive_storage()
+    try:
+        names, _ = storage.listdir('')
+    except FileNotFoundError:
+        return []
+    return sorted(
+        month_of(name) for name in names
+        if any(entry.endswith('.json') for entry in storage.listdir(name)[1])
+    )
+
+
+def segments(month):
+    """
+    (data file name, index) for each complete segment of a month, oldest first.
+    """
+    if not archive_configured():
+        return []
+    storage = archive_storage()
+    try:
+        names = sorted(name for name in storage.listdir(month_key(month))[1] if name.endswith('.json'))
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        with storage.open(f'{month_key(month)}/{name}', 'rb') as f:
+            index = json.load(f)
+        # Segments from before the index recorded its data file's name
+        index.setdefault('data', f"{month_key(month)}/{name.removesuffix('.json')}.jsonl.gz")
+        found.append((index['data'], index))
+    return found
+
+
+def read_month(month, player_id=None):
+    """
+    The archived rows of a month (or of one player in it) as dicts keyed by id.
+    Only the player's own byte range is read when `player_id` is given.
+    """
+    rows = {}
+    for name, index in segments(month):
+        if player_id is None:
+            with archive_storage().open(name, 'rb') as f:
+                found = decode_member(f.read())
+        else:
+            span = index['players'].get(str(player_id))
+            if span is None:
+                continue
+            with archive_storage().open(name, 'rb') as f:
+                f.seek(span[0])
+                found = decode_member(f.read(span[1]))
+        for row in found:
+            if row['id'] not in rows or rows[row['id']]['updated_at'] <= row['updated_at']:
+                rows[row['id']] = row
+    return rows
+
+
+def archived_days(month):
+    days = set()
+    for _, index in segments(month):
+        days.update(date.fromisoformat(day) for day in index['days'])
+    return days
+
+
+def attendance_rows(since=None, until=None, player_id=None):
+    """
+    Attendance between `since` and `until` (inclusive) as COLUMNS dicts, from
+    the database and any archived months alike, ordered by date_of_play and id.
+    """
+    live = AttendanceLog.objects.all()
+    if since:
+        live = live.filter(date_of_play__gte=since)
+    if until:
+        live = live.filter(date_of_play__lte=until)
+    if player_id is not None:
+        live = live.filter(player_id=player_id)
+    rows = {row['id']: row for row in live.values(*COLUMNS)}
+
+    for month in archived_months():
+        if (since and month < since.replace(day=1)) or (until and month > until):
+            continue
+        for pk, row in read_month(month, player_id).items():
+            if pk not in rows and (not since or row['date_of_play'] >= since) and (not until or row['date_of_play'] <= until):
+                rows[pk] = row
+
+    return sorted(rows.values(), key=lambda row: (row['date_of_play'], row['id']))
+
+
+def write_segment(month, rows):
+    """
+    Writes rows (all from one month) as the month's next segment, checking the
+    data reads back from the storage before the index makes it visible.
+    Returns the index.
+    """
+    storage = archive_storage()
+    name = '{}/seg-{:05d}'.format(month_key(month), len(segments(month)) + 1)
+
+    index = {'month': month_key(month), 'rows': len(rows), 'players': {}, 'days': {}}
+    rows = sorted(rows, key=lambda row: (row['player_id'], row['date_of_play'], row['id']))
+    members = []
+    offset = 0
+    start = 0
+    while start < len(rows):
+        player_id = rows[start]['player_id']
+        end = start
+        while end < len(rows) and rows[end]['player_id'] == player_id:
+            day = rows[end]['date_of_play'].isoformat()
+            index['days'][day] = index['days'].get(day, 0) + 1
+            end += 1
+        member = gzip.compress(''.join(encode(row) + '\n' for row in rows[start:end]).encode(), mtime=0)
+        members.append(member)
+        index['players'][str(player_id)] = [offset, len(member), end - start]
+        offset += len(member)
+        start = end
+
+    # The storage may pick another name, e.g. over the data of a run that died
+    # before writing its index, so the index records the one it chose
+    index['data'] = storage.save(f'{name}.jsonl.gz', ContentFile(b''.join(members)))
+    verify_segment(index, [row['id'] for row in rows])
+    storage.save(f'{name}.json', ContentFile(json.dumps(index).encode()))
+    return index
+
+
+def verify_segment(index, ids):
+    """
+    Reads a segment back from the storage and checks it holds exactly `ids`.
+    """
+    with archive_storage().open(index['data'], 'rb') as f:
+        found = [row['id'] for row in decode_member(f.read())]
+    if len(found) != index['rows'] or sorted(found) != sorted(ids):
+        raise ArchiveError(f"{index['data']} holds {len(found)} row(s), expected {len(ids)}.")
+
+
+def month_total(month):
+    """
+    Rows dated in a month, counting the database and the archive together.
+    """
+    return len(attendance_rows(month, next_month(month) - timedelta(days=1)))
+
+
+def archive_month(month, before, batch_size=ARCHIVE_BATCH_SIZE, dry_run=False):
+    """
+    Moves a month's closed logs dated before `before` into a new segment,
+    then deletes them from the database a chunk at a time. Rows already
+    archived unchanged (by a run that stopped part way) are only deleted, so
+    re-running is safe. Returns (rows archived, rows left in the database
+    because they changed while this ran).
+    """
+    logs = AttendanceLog.objects.filter(
+        date_of_play__gte=month, date_of_play__lt=min(before, next_month(month)), exit_time__isnull=False
+    )
+    read_at = timezone.now()
+    rows = list(logs.order_by('pk').values(*COLUMNS))
+    if not rows or dry_run:
+        return len(rows), 0
+
+    total = month_total(month)
+    archived = read_month(month)
+    new = [row for row in rows if row['id'] not in archived or archived[row['id']]['updated_at'] != row['updated_at']]
+    if new:
+        write_segment(month, new)
+
+    # A row changed since it was read has a newer updated_at, and stays put.
+    # These visits still count, from the archive, so unlike other deletes
+    # (see delete_attendance_logs()) their days aren't marked for a recount
+    deleted = 0
+    for start in range(0, len(rows), batch_size):
+        with transaction.atomic():
+            deleted += logs.filter(
+                pk__in=[row['id'] for row in rows[start:start + batch_size]], updated_at__lte=read_at
+            ).delete()[0]
+
+    if month_total(month) != total:
+        raise ArchiveError(f"{month_key(month)} had {total} row(s) before archiving and {month_total(month)} after.")
+    return deleted, len(rows) - deleted
@@ -0,0 +1,215 @@
+# api/attendance.py
+
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Subquery, Value, When
+from django.utils import timezone
+from . import occupancy
+from .models import AttendanceLog, SocialCard, User
+
+CHECK_IN = 'in'
+CHECK_OUT = 'out'
+
+# Scanners often read the same card two or three times in a row. Scans of the
+# same kind for the same player closer together than this count as one.
+DUPLICATE_SCAN_WINDOW = timedelta(seconds=60)
+
+ANNUAL_MEMBERSHIPS = (User.MembershipType.GOLD_ANNUAL, User.MembershipType.SILVER_ANNUAL)
+
+
+def club_date(moment):
+    # The club's calendar day for a timestamp
+    return moment.astimezone(ZoneInfo(settings.CLUB_TIME_ZONE)).date()
+
+
+def needs_card_session(membership_type, is_active_annual_member):
+    # Annual members play as often as they like, everyone else uses up a
+    # social card session on their first visit of the day
+    return not (is_active_annual_member and membership_type in ANNUAL_MEMBERSHIPS)
+
+
+def consume_card_session(player_id, card_pk=None):
+    """
+    Takes one session off the player's card (the given one, or their oldest
+    active card) in a single conditional UPDATE, flipping it to USED_UP when
+    the last session goes. Returns True if a session was taken.
+    """
+    cards = SocialCard.objects.filter(
+        player_id=player_id,
+        status=SocialCard.Status.ACTIVE,
+        sessions_remaining__gt=0
+    )
+    if card_pk is not None:
+        target = cards.filter(pk=card_pk)
+    else:
+        target = cards.filter(pk=Subquery(cards.order_by('pk').values('pk')[:1]))
+
+    # Both SET expressions see the row as it was before the update, so the
+    # status check looks at the old sessions_remaining
+    updated = target.update(
+        sessions_remaining=F('sessions_remaining') - 1,
+        status=Case(
+            When(sessions_remaining__lte=1, then=Value(SocialCard.Status.USED_UP)),
+            default=F('status')
+        )
+    )
+    return updated == 1
+
+
+def collapse_duplicate_scans(events):
+    """
+    Sorts scans into time order and drops repeats of the same scan.
+    Returns (kept_events, number_dropped).
+    """
+    kept = []
+    last_seen = {}
+    dropped = 0
+    for event in sorted(events, key=lambda e: e['timestamp']):
+        key = (event['player_id'], event['kind'])
+        previous = last_seen.get(key)
+        if previous is not None and event['timestamp'] - previous < DUPLICATE_SCAN_WINDOW:
+            dropped += 1
+            continue
+        last_seen[key] = event['timestamp']
+        kept.append(event)
+    return kept, dropped
+
+
+def resolve_card_scans(events):
+    """
+    Fills in player_id (and card_pk) for scans that only carry a card id,
+    using one query for the whole batch. Scans of unknown cards are dropped.
+    Returns (resolved_events, number_of_unknown_cards).
+    """
+    card_ids = {e['card_id'] for e in events if e.get('card_id')}
+    cards = {}
+    if card_ids:
+        for card_id, pk, player_id in SocialCard.objects.filter(card_id_string__in=card_ids).values_list('card_id_string', 'pk', 'player_id'):
+            cards[card_id] = (pk, player_id)
+
+    resolved = []
+    unknown = 0
+    for event in events:
+        event = dict(event)
+        event.setdefault('card_pk', None)
+        if event.get('card_id'):
+            card = cards.get(event['card_id'])
+            if card is None:
+                unknown += 1
+                continue
+            event['card_pk'], event['player_id'] = card
+        resolved.append(event)
+    return resolved, unknown
+
+
+def ingest_scans(events):
+    """
+    Applies a batch of scanner events (dicts with kind, timestamp and either
+    player_id or card_id) in a fixed number of queries plus one UPDATE per
+    social card session used. The single check-in/check-out endpoints go
+    through here too, as a batch of one.
+    """
+    summary = {
+        'checked_in': 0,
+        'checked_out': 0,
+        'duplicates': 0,
+        'unmatched': 0,
+        'unknown_cards': 0,
+        'sessions_consumed': 0,
+    }
+
+    events, summary['unknown_cards'] = resolve_card_scans(events)
+    events, summary['duplicates'] = collapse_duplicate_scans(events)
+    if not events:
+        return summary
+
+    for event in events:
+        event['date_of_play'] = club_date(event['timestamp'])
+    player_ids = {e['player_id'] for e in events}
+    dates = {e['date_of_play'] for e in events}
+
+    with transaction.atomic():
+        # Locking the players' rows serialises concurrent scans for the same
+        # person, so two scanners can't both use up their daily session
+        players = {
+            pk: needs_card_session(membership_type, is_active_annual_member)
+            for pk, membership_type, is_active_annual_member in (
+                User.objects.select_for_update()
+                .filter(pk__in=player_ids)
+                .order_by('pk')
+                .values_list('pk', 'membership_type', 'is_active_annual_member')
+            )
+        }
+
+        # What each player already has on the books for the days involved
+        open_logs = {}
+        consumed_days = set()
+        existing = AttendanceLog.objects.filter(player_id__in=players, date_of_play__in=dates).only(
+            'pk', 'player_id', 'date_of_play', 'entry_time', 'exit_time', 'daily_session_consumed'
+        )
+        for log in existing:
+            day = (log.player_id, log.date_of_play)
+            if log.exit_time is None:
+                open_logs[day] = log
+            if log.daily_session_consumed:
+                consumed_days.add(day)
+
+        to_create = []
+        to_update = {}
+        for event in events:
+            if event['player_id'] not in players:
+                summary['unmatched'] += 1
+                continue
+
+            day = (event['player_id'], event['date_of_play'])
+            open_log = open_logs.get(day)
+
+            if event['kind'] == CHECK_IN:
+                if open_log is not None:
+                    # Already in the hall, this is just another scan
+                    summary['duplicates'] += 1
+                    continue
+
+                log = AttendanceLog(
+                    player_id=event['player_id'],
+                    date_of_play=event['date_of_play'],
+                    entry_time=event['timestamp']
+                )
+                if players[event['player_id']] and day not in consumed_days:
+                    if consume_card_session(event['player_id'], event['card_pk']):
+                        log.daily_session_consumed = True
+                        consumed_days.add(day)
+                        summary['sessions_consumed'] += 1
+
+                to_create.append(log)
+                open_logs[day] = log
+                summary['checked_in'] += 1
+
+            else:
+                if open_log is None:
+                    summary['unmatched'] += 1
+                    continue
+
+                open_log.exit_time = event['timestamp']
+                open_log.updated_at = timezone.now()
+                if open_log.pk is not None:
+                    to_update[open_log.pk] = open_log
+                del open_logs[day]
+                summary['checked_out'] += 1
+
+        AttendanceLog.objects.bulk_create(to_create)
+        AttendanceLog.objects.bulk_update(list(to_update.values()), ['exit_time', 'updated_at'])
+
+        # Visits opened minus visits closed, per day, for the live occupancy count
+        changes = {}
+        for log in to_create:
+            if log.exit_time is None:
+                changes[log.date_of_play] = changes.get(log.date_of_play, 0) + 1
+        for log in to_update.values():
+            changes[log.date_of_play] = changes.get(log.date_of_play, 0) - 1
+        transaction.on_commit(lambda: occupancy.adjust_occupancy(changes))
+
+    return summary
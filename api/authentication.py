@@ -0,0 +1,150 @@
+# api/authentication.py
+
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# The stock JWTAuthentication looks the user up in the database on every
+# request. We keep recently seen users in a small in-process LRU instead.
+#
+# Each cached user is stamped with that user's version token, which lives in
+# the shared Django cache and is replaced whenever the User row is saved (see
+# api/signals.py). A stale entry therefore never matches and gets reloaded,
+# in every worker, as soon as the user changes.
+
+VERSION_KEY = 'api:user-version:{}'
+VERSION_TIMEOUT = 60 * 60 * 24
+
+
+def user_version(user_id):
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def request_user_version(user):
+    """
+    The version CachedJWTAuthentication checked this request's user against,
+    so a view needn't read it again (read fresh for any other kind of login).
+    """
+    version = getattr(user, 'auth_version', None)
+    return version if version is not None else user_version(user.pk)
+
+
+def bump_user_versions(user_ids):
+    """
+    Marks cached copies of these users as stale. Call this after changing
+    users with queryset.update() or bulk_update(), which don't fire post_save.
+    """
+    cache.set_many({VERSION_KEY.format(pk): uuid.uuid4().hex for pk in user_ids}, VERSION_TIMEOUT)
+
+
+def invalidate_user(user_id):
+    # Bump now, and again after commit so a reader that loaded the old row in
+    # between can't keep it
+    bump_user_versions([user_id])
+    transaction.on_commit(lambda: bump_user_versions([user_id]))
+
+
+class UserCache:
+    """
+    A size-bounded, TTL-bounded LRU of user objects, keyed by user id.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, version):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def set(self, user_id, version, user):
+        expires_at = time.monotonic() + settings.AUTH_USER_CACHE_TTL
+        with self._lock:
+            self._entries[user_id] = (version, expires_at, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > settings.AUTH_USER_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that serves the user from `user_cache` when it can,
+    so an authenticated request with a warm cache makes no auth queries.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            return super().get_user(validated_token)
+
+        version = user_version(user_id)
+        user = user_cache.get(user_id, version)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, version, user)
+            return self.request_copy(user, version)
+
+        # The same checks the stock class makes after its database lookup
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return self.request_copy(user, version)
+
+    def request_copy(self, user, version):
+        # Each request gets its own copy, so nothing it sets on the user leaks
+        # into the cache. It carries the version (see request_user_version())
+        user = copy.copy(user)
+        user.auth_version = version
+        return user
+
+
+async def aauthenticate(request):
+    """
+    Authenticates a plain Django request the way the DRF views do, for the
+    async views (DRF views are sync only). Returns the user, or None when the
+    request has no token. Raises AuthenticationFailed for a bad one.
+    """
+    # A user cache miss reads the database, which can't be done on the event loop
+    result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    return result[0] if result else None
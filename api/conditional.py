@@ -0,0 +1,99 @@
+# api/conditional.py
+
+import hashlib
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from django.utils.cache import parse_etags
+from rest_framework.response import Response
+from .authentication import VERSION_KEY, VERSION_TIMEOUT, user_version
+
+# The app polls a member's eligibility and profile far more often than they
+# change, so those responses carry an ETag built from version tokens in the
+# cache every process shares (CACHE_URL in settings):
+#
+#   - the user's version (api/authentication.py), replaced whenever their row changes
+#   - their fee version, replaced whenever one of their fee rows changes
+#   - the season index version (api/seasons.py), replaced whenever a season changes
+#
+# A request whose If-None-Match still matches gets a 304 without touching the
+# database, and a full body is served from a per-user copy in the cache until
+# one of the versions moves on.
+
+FEE_VERSION_KEY = 'api:fee-version:{}'
+RESPONSE_KEY = 'api:response:{}:{}'
+RESPONSE_TIMEOUT = 60 * 60
+
+
+def fee_version(user_id):
+    key = FEE_VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_fee_versions(user_ids):
+    """
+    Marks responses that depend on these users' fees as stale. Call this
+    after changing fees with queryset.update(), which doesn't fire post_save.
+    """
+    cache.set_many({FEE_VERSION_KEY.format(pk): uuid.uuid4().hex for pk in user_ids}, VERSION_TIMEOUT)
+
+
+def invalidate_fees(user_id):
+    # Now, and again after commit, as with invalidate_user()
+    bump_fee_versions([user_id])
+    transaction.on_commit(lambda: bump_fee_versions([user_id]))
+
+
+def member_versions(user_id, known_user_version=None):
+    """
+    (user version, fee version) for a member, in one cache round trip when
+    both are set. Pass the user version when it's already been read (see
+    request_user_version()) and only the fee version is looked up.
+    """
+    if known_user_version is not None:
+        return [known_user_version, fee_version(user_id)]
+    keys = {VERSION_KEY.format(user_id): user_version, FEE_VERSION_KEY.format(user_id): fee_version}
+    found = cache.get_many(keys)
+    return [found.get(key) or load(user_id) for key, load in keys.items()]
+
+
+def make_etag(name, versions):
+    return '"{}"'.format(hashlib.md5(':'.join(map(str, (name, *versions))).encode()).hexdigest())
+
+
+def etag_matches(request, etag):
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in etags or etag in (tag.removeprefix('W/') for tag in etags)
+
+
+def versioned_response(request, name, versions, build):
+    """
+    The response for `name` for the current user: a 304 if the client's copy
+    is current, else the body `build()` returns, served from the cache while
+    `versions` are unchanged. `versions` must cover everything the body
+    depends on.
+    """
+    etag = make_etag(name, versions)
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        key = RESPONSE_KEY.format(name, request.user.pk)
+        cached = cache.get(key)
+        if cached is not None and cached[0] == etag:
+            data = cached[1]
+        else:
+            data = build()
+            cache.set(key, (etag, data), RESPONSE_TIMEOUT)
+        response = Response(data)
+
+    response['ETag'] = etag
+    # Clients may keep it, but must check it's still current before using it
+    response['Cache-Control'] = 'private, no-cache'
+    return response
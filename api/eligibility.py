@@ -0,0 +1,84 @@
+# api/eligibility.py
+
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, OuterRef
+from .models import PlayerSeasonFee, Team, User
+
+# How many players the bulk endpoint pulls from the database at a time
+ROSTER_CHUNK_SIZE = 200
+
+
+def fixture_eligibility_payload(membership_type, is_paid, season):
+    """
+    Builds the response body for one player, so the single and bulk
+    eligibility endpoints always agree.
+    """
+    if membership_type == User.MembershipType.GOLD_ANNUAL:
+        return {"is_fee_owed": False, "reason": "Gold Annual Members have fees included."}
+
+    if is_paid:
+        return {"is_fee_owed": False, "season_name": season.name}
+
+    return {
+        "is_fee_owed": True,
+        "amount_owed": str(season.fixture_fee_amount),
+        "season_name": season.name,
+        "due_date": season.fixture_fee_due_date
+    }
+
+
+def roster_eligibility_rows(season, player_ids=None, roster_season=None, captain=None):
+    """
+    Returns (id, email, first_name, last_name, membership_type, is_paid) rows
+    for a whole roster in a single query. The paid check is an EXISTS
+    subquery, so there is no per-player query. With `captain`, only players
+    on that member's teams are included.
+    """
+    paid_fees = PlayerSeasonFee.objects.filter(
+        player=OuterRef('pk'),
+        season=season,
+        payment_status=PlayerSeasonFee.PaymentStatus.PAID
+    )
+
+    players = User.objects.all()
+    if player_ids is not None:
+        players = players.filter(pk__in=player_ids)
+    if captain is not None:
+        players = players.filter(pk__in=Team.objects.filter(captain=captain).values('players'))
+    if roster_season is not None:
+        players = players.filter(
+            Exists(PlayerSeasonFee.objects.filter(player=OuterRef('pk'), season=roster_season))
+        )
+
+    return (
+        players
+        .annotate(is_paid=Exists(paid_fees))
+        .order_by('pk')
+        .values_list('pk', 'email', 'first_name', 'last_name', 'membership_type', 'is_paid')
+    )
+
+
+def stream_roster_eligibility(season, rows):
+    """
+    Yields the bulk response as JSON chunks, one player at a time, so a
+    500 player roster never has to be built up in memory.
+    """
+    encoder = DjangoJSONEncoder()
+    yield '{"season_name": %s, "players": [' % encoder.encode(season.name)
+
+    separator = ''
+    for pk, email, first_name, last_name, membership_type, is_paid in rows.iterator(chunk_size=ROSTER_CHUNK_SIZE):
+        player = {
+            "player_id": pk,
+            "email": email,
+            "first_name": first_name,
+            "last_name": last_name,
+            "membership_type": membership_type,
+        }
+        player.update(fixture_eligibility_payload(membership_type, is_paid, season))
+        yield separator + json.dumps(player, cls=DjangoJSONEncoder)
+        separator = ', '
+
+    yield ']}'
@@ -0,0 +1,164 @@
+# api/exports.py
+
+import csv
+import zlib
+from datetime import timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from .archive import archived_months, next_month, read_month
+from .models import AttendanceLog, PlayerSeasonFee, User
+
+# Rows are fetched from the database this many at a time (a server-side
+# cursor on Postgres), and written out this many at a time. Memory use depends
+# on these numbers, never on the size of the table. Archived attendance is
+# the exception: it's read back one month's segments at a time.
+EXPORT_CHUNK_SIZE = 2000
+ROWS_PER_WRITE = 500
+
+# What each export contains. Only plain values are read (values_list), never
+# model instances, so there's no per-row object or __str__ lookup.
+EXPORTS = {
+    'attendance': {
+        'model': AttendanceLog,
+        'columns': ['id', 'player_id', 'player__email', 'date_of_play', 'entry_time', 'exit_time', 'daily_session_consumed'],
+        'date_field': 'date_of_play',
+    },
+    'fees': {
+        'model': PlayerSeasonFee,
+        'columns': ['id', 'player_id', 'player__email', 'season_id', 'season__name', 'payment_status', 'stripe_charge_id'],
+        'date_field': None,
+    },
+    'members': {
+        'model': User,
+        'columns': ['id', 'email', 'first_name', 'last_name', 'phone', 'dob', 'membership_type',
+                    'is_active_annual_member', 'annual_membership_expiry_date', 'is_active'],
+        'date_field': None,
+    },
+}
+
+FORMATS = ('csv', 'jsonl')
+
+
+def export_queryset(dataset, since=None, until=None, season=None):
+    """
+    The values_list queryset for an export, with the optional filters applied.
+    `since`/`until` limit attendance by date_of_play. `season` limits fees to
+    that season, attendance to the season's dates, and members to players with
+    a fee row for it.
+    """
+    spec = EXPORTS[dataset]
+    rows = spec['model'].objects.all()
+
+    if spec['date_field']:
+        if since:
+            rows = rows.filter(**{f"{spec['date_field']}__gte": since})
+        if until:
+            rows = rows.filter(**{f"{spec['date_field']}__lte": until})
+
+    if season is not None:
+        if dataset == 'attendance':
+            rows = rows.filter(date_of_play__gte=season.start_date, date_of_play__lte=season.end_date)
+        elif dataset == 'fees':
+            rows = rows.filter(season=season)
+        elif dataset == 'members':
+            rows = rows.filter(pk__in=PlayerSeasonFee.objects.filter(season=season).values('player'))
+
+    return rows.order_by('pk').values_list(*spec['columns'])
+
+
+def archived_attendance(since=None, until=None, season=None):
+    """
+    Attendance rows archive_attendance has moved out of the database (see
+    api/archive.py), as tuples of the export's columns, a month at a time and
+    in id order within each month. Rows still in the database are left to the
+    queryset, and the visits of deleted members are left out, as their live
+    logs would be.
+    """
+    if season is not None:
+        since = max(since, season.start_date) if since else season.start_date
+        until = min(until, season.end_date) if until else season.end_date
+    columns = EXPORTS['attendance']['columns']
+
+    for month in archived_months():
+        if (since and month < since.replace(day=1)) or (until and month > until):
+            continue
+        last = next_month(month) - timedelta(days=1)
+        live = set(AttendanceLog.objects.filter(date_of_play__gte=month, date_of_play__lte=last).values_list('pk', flat=True))
+        rows = [
+            row for pk, row in sorted(read_month(month).items())
+            if pk not in live and (not since or row['date_of_play'] >= since) and (not until or row['date_of_play'] <= until)
+        ]
+        emails = dict(User.objects.filter(pk__in={row['player_id'] for row in rows}).values_list('pk', 'email'))
+        for row in rows:
+            if row['player_id'] in emails:
+                row['player__email'] = emails[row['player_id']]
+                yield tuple(row[column] for column in columns)
+
+
+def export_rows(dataset, **filters):
+    """
+    Every row of an export as a tuple of its columns. Attendance starts with
+    any archived months in range, then the database's rows in id order.
+    """
+    if dataset == 'attendance':
+        yield from archived_attendance(**filters)
+    yield from export_queryset(dataset, **filters).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class _LineBuffer:
+    # csv.writer wants a file. This one just hands back what was written.
+    def write(self, value):
+        return value
+
+
+def csv_chunks(columns, rows):
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(columns)
+
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow(row))
+        if len(batch) >= ROWS_PER_WRITE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def jsonl_chunks(columns, rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+    batch = []
+    for row in rows:
+        batch.append(encoder.encode(dict(zip(columns, row))) + '\n')
+        if len(batch) >= ROWS_PER_WRITE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def gzip_chunks(chunks):
+    """
+    Compresses a stream of text chunks into a gzip stream as it goes.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(dataset, export_format='csv', gzip=False, **filters):
+    """
+    Yields the whole export as a series of chunks (str, or bytes when gzipped).
+    """
+    columns = EXPORTS[dataset]['columns']
+    rows = export_rows(dataset, **filters)
+    chunks = csv_chunks(columns, rows) if export_format == 'csv' else jsonl_chunks(columns, rows)
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+def export_filename(dataset, export_format, gzip=False):
+    return f"gctta-{dataset}.{export_format}" + ('.gz' if gzip else '')
@@ -0,0 +1,56 @@
+# api/fees.py
+
+from django.db.models import Count
+from .models import PlayerSeasonFee, User
+
+# Members are read and their fee rows inserted this many at a time
+ROLL_OUT_BATCH_SIZE = 5000
+
+
+def eligible_members():
+    """
+    Everyone who owes (or is excused) a fixture fee: active members, but not
+    staff accounts such as the door scanners.
+    """
+    return User.objects.filter(is_active=True, is_staff=False)
+
+
+def roll_out_season_fees(season, batch_size=ROLL_OUT_BATCH_SIZE):
+    """
+    Gives every eligible member a fee row for `season`: WAIVED_GOLD for Gold
+    Annual members and PENDING for everyone else. Members who already have a
+    row (paid, or from an earlier roll-out) are left as they are, thanks to
+    the unique (player, season) constraint, so it's safe to run again, e.g.
+    after new members sign up. Returns the number of rows created.
+    """
+    before = PlayerSeasonFee.objects.filter(season=season).count()
+
+    members = eligible_members().order_by('pk').values_list('pk', 'membership_type')
+    batch = []
+    for player_id, membership_type in members.iterator(chunk_size=batch_size):
+        batch.append(PlayerSeasonFee(
+            player_id=player_id,
+            season=season,
+            payment_status=(
+                PlayerSeasonFee.PaymentStatus.WAIVED_GOLD
+                if membership_type == User.MembershipType.GOLD_ANNUAL
+                else PlayerSeasonFee.PaymentStatus.PENDING
+            )
+        ))
+        if len(batch) >= batch_size:
+            PlayerSeasonFee.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        PlayerSeasonFee.objects.bulk_create(batch, ignore_conflicts=True)
+
+    return PlayerSeasonFee.objects.filter(season=season).count() - before
+
+
+def season_fee_counts(season):
+    """
+    Number of fee rows per payment status for a season.
+    """
+    counts = {status: 0 for status in PlayerSeasonFee.PaymentStatus.values}
+    for row in PlayerSeasonFee.objects.filter(season=season).values('payment_status').annotate(total=Count('pk')):
+        counts[row['payment_status']] = row['total']
+    return counts
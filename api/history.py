@@ -0,0 +1,119 @@
+# api/history.py
+
+import base64
+import json
+from datetime import date
+
+from django.db.models import Q
+from .archive import archived_months, read_month
+from .models import AttendanceLog, PlayerSeasonFee, SocialCard
+
+# A member's own history for the "my account" screen. Attendance is paged
+# newest first with a keyset cursor on (date_of_play, id): each page asks for
+# the rows before the last one it sent, which the (player, date_of_play)
+# index finds directly, so page 50 costs the same as page 1 (an OFFSET would
+# read and throw away every earlier row). Rows are read with values(), never
+# as model instances, so nothing is looked up per row.
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+ATTENDANCE_FIELDS = ('id', 'date_of_play', 'entry_time', 'exit_time', 'daily_session_consumed')
+
+
+def encode_cursor(row):
+    position = [row['date_of_play'].isoformat(), row['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    (date_of_play, id) from a cursor. Raises ValueError for anything that
+    isn't one of ours.
+    """
+    try:
+        day, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return date.fromisoformat(day), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+
+def before(position, row):
+    # Whether a row comes after `position` in newest-first order
+    return position is None or (row['date_of_play'], row['id']) < position
+
+
+def archived_page(player_id, position, limit, oldest):
+    """
+    Up to `limit` of the player's archived visits before `position`, newest
+    first, reading months back from the cursor and no further back than
+    `oldest` (when set).
+    """
+    rows = []
+    for month in reversed(archived_months()):
+        if position and month > position[0]:
+            continue
+        if (oldest and month < oldest.replace(day=1)) or len(rows) >= limit:
+            break
+        found = sorted(
+            (row for row in read_month(month, player_id).values() if before(position, row)),
+            key=lambda row: (row['date_of_play'], row['id']), reverse=True,
+        )
+        rows.extend({field: row[field] for field in ATTENDANCE_FIELDS} for row in found)
+    return rows
+
+
+def attendance_page(player_id, position=None, limit=HISTORY_PAGE_SIZE):
+    """
+    One page of a player's visits, newest first, after the (date_of_play, id)
+    `position`. One query, plus reads of any archived months (see
+    api/archive.py) the page reaches into. Returns (rows, next cursor or None).
+    """
+    logs = AttendanceLog.objects.filter(player_id=player_id)
+    if position:
+        day, pk = position
+        logs = logs.filter(Q(date_of_play__lt=day) | Q(date_of_play=day, id__lt=pk))
+    rows = list(logs.order_by('-date_of_play', '-id').values(*ATTENDANCE_FIELDS)[:limit + 1])
+
+    # Archived visits are older than nearly everything live, but not always
+    # (e.g. a visit that was still open when its month was archived), so
+    # merge the two wherever they overlap
+    oldest = rows[-1]['date_of_play'] if len(rows) > limit else None
+    archived = archived_page(player_id, position, limit + 1, oldest)
+    if archived:
+        seen = {row['id'] for row in rows}
+        rows.extend(row for row in archived if row['id'] not in seen)
+        rows.sort(key=lambda row: (row['date_of_play'], row['id']), reverse=True)
+
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def player_cards(player_id):
+    return list(
+        SocialCard.objects.filter(player_id=player_id)
+        .order_by('-pk')
+        .values('id', 'card_id_string', 'sessions_total', 'sessions_remaining', 'status')
+    )
+
+
+def player_fees(player_id):
+    # The season's fields come from a join in the same query
+    fees = (
+        PlayerSeasonFee.objects.filter(player_id=player_id)
+        .order_by('-season__start_date')
+        .values('season_id', 'season__name', 'season__start_date', 'season__end_date',
+                'season__fixture_fee_amount', 'season__fixture_fee_due_date', 'payment_status')
+    )
+    return [
+        {
+            'season_id': fee['season_id'],
+            'season_name': fee['season__name'],
+            'start_date': fee['season__start_date'],
+            'end_date': fee['season__end_date'],
+            'amount': str(fee['season__fixture_fee_amount']),
+            'due_date': fee['season__fixture_fee_due_date'],
+            'payment_status': fee['payment_status'],
+        }
+        for fee in fees
+    ]
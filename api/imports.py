@@ -0,0 +1,169 @@
+# api/imports.py
+
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from .authentication import bump_user_versions
+from .models import User
+from .serializers import MemberImportSerializer
+
+# Members are validated, hashed and written this many at a time. While one
+# batch is being written, the next one's passwords are already being hashed
+# in the process pool.
+IMPORT_BATCH_SIZE = 500
+
+# What an import changes on members who already exist. Their password is
+# left alone, so re-running an import never locks anyone out.
+UPDATE_FIELDS = ['first_name', 'last_name', 'phone', 'dob']
+
+
+def read_rows(f, file_format):
+    """
+    Yields (line_number, row) for each record of a CSV or JSON lines file, one
+    at a time. Rows that can't be parsed come back as None.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            # Blank cells count as missing, so optional columns like dob can be left empty
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+    else:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+
+
+def _init_worker():
+    # Workers started with "spawn" (macOS, Windows) don't inherit Django's setup
+    if not apps.ready:
+        django.setup()
+
+
+class MemberImport:
+    """
+    Creates new members and updates existing ones (matched by email) from a
+    stream of rows. Each row is checked with MemberImportSerializer; rows that
+    fail are passed to `on_error(line_number, row, errors)` and skipped.
+
+    With `invite=True` nobody gets a usable password (they'll set one from an
+    invite). Otherwise new members' passwords are hashed across `workers`
+    processes.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE, workers=None, invite=False, dry_run=False, on_error=None):
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count() or 1
+        self.invite = invite
+        self.dry_run = dry_run
+        self.on_error = on_error or (lambda line_number, row, errors: None)
+        self.summary = {'created': 0, 'updated': 0, 'invalid': 0}
+
+    def run(self, rows):
+        pool = None
+        if self.workers > 1 and not self.invite and not self.dry_run:
+            pool = ProcessPoolExecutor(self.workers, initializer=_init_worker)
+        try:
+            previous = None
+            for batch in self.valid_batches(rows):
+                current = self.start_batch(batch, pool)
+                if previous is not None:
+                    self.write_batch(*previous)
+                previous = current
+            if previous is not None:
+                self.write_batch(*previous)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return self.summary
+
+    def valid_batches(self, rows):
+        context = {'require_password': not self.invite}
+        seen = set()
+        batch = []
+        for line_number, row in rows:
+            if row is None:
+                self.invalid(line_number, row, {'non_field_errors': ['This line could not be read.']})
+                continue
+
+            serializer = MemberImportSerializer(data=row, context=context)
+            if not serializer.is_valid():
+                self.invalid(line_number, row, serializer.errors)
+                continue
+
+            data = serializer.validated_data
+            data['email'] = User.objects.normalize_email(data['email'])
+            if data['email'] in seen:
+                self.invalid(line_number, row, {'email': ['This email appears earlier in the file.']})
+                continue
+            seen.add(data['email'])
+
+            batch.append(data)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def invalid(self, line_number, row, errors):
+        self.summary['invalid'] += 1
+        self.on_error(line_number, row, errors)
+
+    def start_batch(self, batch, pool):
+        """
+        Looks up which of the batch's emails already exist and starts hashing
+        the passwords of the new members. Returns what write_batch needs.
+        """
+        existing = dict(User.objects.filter(email__in=[d['email'] for d in batch]).values_list('email', 'pk'))
+        new = [d for d in batch if d['email'] not in existing]
+
+        if self.dry_run:
+            passwords = []
+        elif self.invite:
+            # make_password(None) gives an unusable password, and costs nothing
+            passwords = [make_password(None) for _ in new]
+        elif pool is None:
+            passwords = [make_password(d['password']) for d in new]
+        else:
+            chunksize = max(1, len(new) // (self.workers * 4))
+            passwords = pool.map(make_password, [d['password'] for d in new], chunksize=chunksize)
+        return batch, existing, new, passwords
+
+    def write_batch(self, batch, existing, new, passwords):
+        updates = [
+            User(pk=existing[d['email']], **{field: d.get(field) for field in UPDATE_FIELDS})
+            for d in batch if d['email'] in existing
+        ]
+        if not self.dry_run:
+            creates = [
+                User(email=d['email'], password=password, **{field: d.get(field) for field in UPDATE_FIELDS})
+                for d, password in zip(new, passwords)
+            ]
+            with transaction.atomic():
+                # update_conflicts covers members who signed up since the lookup
+                User.objects.bulk_create(creates, update_conflicts=True, unique_fields=['email'], update_fields=UPDATE_FIELDS)
+                User.objects.bulk_update(updates, UPDATE_FIELDS)
+                # Those were updated, not created: their rows kept their own
+                # password instead of the one just hashed for them
+                hashed = {user.email: user.password for user in creates}
+                signed_up = [
+                    pk for email, pk, password in User.objects.filter(email__in=hashed).values_list('email', 'pk', 'password')
+                    if password != hashed[email]
+                ]
+            # Neither sends post_save, so drop cached copies here
+            bump_user_versions([user.pk for user in updates] + signed_up)
+        else:
+            signed_up = []
+
+        self.summary['created'] += len(new) - len(signed_up)
+        self.summary['updated'] += len(updates) + len(signed_up)
@@ -0,0 +1,62 @@
+# api/management/commands/archive_attendance.py
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.archive import ARCHIVE_BATCH_SIZE, ArchiveError, archive_configured, archive_month
+from api.attendance import club_date
+from api.models import AttendanceLog
+
+class Command(BaseCommand):
+    help = (
+        'Moves closed attendance logs from months older than the horizon out of the database into '
+        'compressed monthly segment files in the archive storage, checking every row is accounted for before and after. '
+        'Safe to re-run, including after an interruption.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.ATTENDANCE_ARCHIVE_AFTER_DAYS,
+                            help='Archive months that ended at least this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='Rows deleted (and committed) per chunk.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived.')
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 1:
+            raise CommandError("--older-than must be at least 1.")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if not archive_configured() and not options['dry_run']:
+            raise CommandError("Set ATTENDANCE_ARCHIVE_STORAGE to a durable storage backend first, the archive is the only copy of the rows it holds.")
+
+        # Whole months only, so a month is normally archived in one go
+        before = (club_date(timezone.now()) - timedelta(days=options['older_than'])).replace(day=1)
+        old_logs = AttendanceLog.objects.filter(date_of_play__lt=before)
+
+        self.stdout.write(f"Archiving closed attendance logs from before {before}...")
+
+        total = 0
+        for month in old_logs.filter(exit_time__isnull=False).dates('date_of_play', 'month'):
+            try:
+                archived, changed = archive_month(month, before, batch_size=options['batch_size'], dry_run=options['dry_run'])
+            except ArchiveError as e:
+                raise CommandError(f"Stopped at {month:%Y-%m}: {e}")
+            if options['dry_run']:
+                self.stdout.write(f"  {month:%Y-%m}: {archived} log(s) would be archived.")
+            else:
+                self.stdout.write(f"  {month:%Y-%m}: archived {archived} log(s).")
+            if changed:
+                self.stdout.write(f"  {month:%Y-%m}: {changed} log(s) changed while archiving and were kept, they'll go next run.")
+            total += archived
+
+        still_open = old_logs.filter(exit_time__isnull=True).count()
+        if still_open:
+            self.stdout.write(f"{still_open} open log(s) from before {before} were left in place, run cleanup_attendance first.")
+
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {total} attendance log(s) would be archived.")
+        elif total > 0:
+            self.stdout.write(self.style.SUCCESS(f"Archived {total} attendance log(s)."))
+        else:
+            self.stdout.write("No attendance logs needed archiving.")
@@ -1,33 +1,98 @@
 # api/management/commands/cleanup_attendance.py
 
-from django.core.management.base import BaseCommand
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 from django.utils import timezone
-from datetime import timedelta
+from api.attendance import club_date
 from api.models import AttendanceLog
+from api.occupancy import adjust_occupancy
+from api.rollups import refresh_days
 
 class Command(BaseCommand):
-    help = 'Finds attendance logs from the previous day with no exit_time and updates them to 11:59 PM.'
+    help = (
+        'Finds attendance logs with no exit_time from before today and closes each one at '
+        '11:59 PM (club time) on its own date_of_play. Works through the table in small chunks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='Earliest date_of_play to clean up (YYYY-MM-DD). Defaults to the oldest open log.')
+        parser.add_argument('--until', type=date.fromisoformat, help='Latest date_of_play to clean up (YYYY-MM-DD). Defaults to yesterday.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='How many logs to close per UPDATE. Each chunk is committed on its own.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be closed.')
+
+    def end_of_day(self, day):
+        # This represents 11:59:59 PM of that day in the club's time zone
+        return datetime.combine(day, time.max, tzinfo=ZoneInfo(settings.CLUB_TIME_ZONE))
 
     def handle(self, *args, **options):
-        yesterday = timezone.now().date() - timedelta(days=1)
+        club_today = club_date(timezone.now())
+        until = options['until'] or club_today - timedelta(days=1)
+        since = options['since']
+        batch_size = options['batch_size']
+
+        if until >= club_today:
+            raise CommandError("--until must be before today, today's visits may still be open.")
+        if since and since > until:
+            raise CommandError("--since must not be after --until.")
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        # Find all open logs in the window. This is served by the partial
+        # index on date_of_play WHERE exit_time IS NULL.
+        open_logs = AttendanceLog.objects.filter(exit_time__isnull=True, date_of_play__lte=until)
+        if since:
+            open_logs = open_logs.filter(date_of_play__gte=since)
+
+        self.stdout.write(f"Starting cleanup job for dates {since or 'earliest'} to {until}...")
+
+        days = open_logs.values_list('date_of_play', flat=True).distinct().order_by('date_of_play')
+
+        total = 0
+        closed_days = []
+        for day in days:
+            day_logs = open_logs.filter(date_of_play=day)
+
+            if options['dry_run']:
+                count = day_logs.count()
+                self.stdout.write(f"  {day}: {count} log(s) would be closed.")
+                total += count
+                continue
 
-        self.stdout.write(f"Starting cleanup job for date: {yesterday}...")
+            end_of_day = self.end_of_day(day)
+            count = 0
 
-        # This represents 11:59:59 PM of the previous day
-        end_of_yesterday = timezone.make_aware(
-            timezone.datetime.combine(yesterday, timezone.datetime.max.time())
-        )
+            # Close the day's logs batch_size at a time, committing each batch,
+            # so no single statement holds its locks for long. Each batch starts
+            # after the last primary key of the one before (a keyset), so gaps
+            # in the ids never mean empty or oversized batches
+            last_pk = 0
+            while True:
+                with transaction.atomic():
+                    pks = list(day_logs.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+                    count += day_logs.filter(pk__in=pks).update(exit_time=end_of_day, updated_at=timezone.now())
+                # A short batch was the day's last
+                if len(pks) < batch_size:
+                    break
+                last_pk = pks[-1]
 
-        # Find all logs from yesterday where exit_time is NULL
-        logs_to_update = AttendanceLog.objects.filter(
-            date_of_play=yesterday,
-            exit_time__isnull=True
-        )
+            adjust_occupancy({day: -count})
+            self.stdout.write(f"  {day}: closed {count} log(s).")
+            closed_days.append(day)
+            total += count
 
-        # Update the found records with the end-of-day timestamp
-        count = logs_to_update.update(exit_time=end_of_yesterday)
+        # Closing logs changes those days' session lengths, so bring their
+        # rollups (and yesterday's, which is now complete) up to date now
+        # rather than waiting for the next refresh
+        if not options['dry_run']:
+            refresh_days(closed_days + [until])
 
-        if count > 0:
-            self.stdout.write(self.style.SUCCESS(f"Successfully cleaned up {count} attendance log(s)."))
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {total} attendance log(s) would be cleaned up.")
+        elif total > 0:
+            self.stdout.write(self.style.SUCCESS(f"Successfully cleaned up {total} attendance log(s)."))
         else:
-            self.stdout.write("No attendance logs needed cleanup for yesterday.")
\ No newline at end of file
+            self.stdout.write("No attendance logs needed cleanup.")
@@ -0,0 +1,34 @@
+# api/management/commands/expire_memberships.py
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.attendance import club_date
+from api.memberships import EXPIRY_BATCH_SIZE, expire_memberships
+
+class Command(BaseCommand):
+    help = (
+        'Demotes members whose annual membership has expired (to Social Card Holder if they have an active '
+        'card, otherwise Generic User) and records a MembershipChange for each. Safe to run on a schedule, '
+        'to run twice at once, and to re-run after an interruption.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, help='Expire memberships that ended before this date (YYYY-MM-DD). Defaults to today.')
+        parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH_SIZE, help='Members updated (and committed) per chunk.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the members who would be demoted.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        today = options['date'] or club_date(timezone.now())
+        demoted = expire_memberships(today, batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        if options['dry_run']:
+            self.stdout.write(f"Dry run: {demoted} membership(s) would be expired.")
+        elif demoted:
+            self.stdout.write(self.style.SUCCESS(f"Expired {demoted} membership(s)."))
+        else:
+            self.stdout.write("No memberships needed expiring.")
@@ -0,0 +1,52 @@
+# api/management/commands/export_data.py
+
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from api.exports import EXPORTS, FORMATS, stream_export
+from api.models import Season
+from api.replica import reading_from_replica
+
+class Command(BaseCommand):
+    help = 'Streams attendance, fees or members to a CSV or JSON lines file (optionally gzipped) with flat memory use.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='file_format', choices=FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--output', '-o', help='File to write to. Defaults to standard output.')
+        parser.add_argument('--since', type=date.fromisoformat, help='Earliest date_of_play for attendance (YYYY-MM-DD).')
+        parser.add_argument('--until', type=date.fromisoformat, help='Latest date_of_play for attendance (YYYY-MM-DD).')
+        parser.add_argument('--season', type=int, help='Only rows belonging to this season id.')
+
+    def handle(self, *args, **options):
+        # A long read that only reports, so it goes to the replica when there is one
+        with reading_from_replica():
+            self.export(options)
+
+    def export(self, options):
+        season = None
+        if options['season'] is not None:
+            try:
+                season = Season.objects.get(pk=options['season'])
+            except Season.DoesNotExist:
+                raise CommandError(f"Season {options['season']} does not exist.")
+
+        chunks = stream_export(
+            options['dataset'], options['file_format'], options['gzip'],
+            since=options['since'], until=options['until'], season=season
+        )
+
+        if options['output']:
+            mode = 'wb' if options['gzip'] else 'w'
+            with open(options['output'], mode, **({} if options['gzip'] else {'encoding': 'utf-8', 'newline': ''})) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        elif options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
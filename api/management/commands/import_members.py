@@ -0,0 +1,81 @@
+# api/management/commands/import_members.py
+
+import csv
+import json
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from api.imports import IMPORT_BATCH_SIZE, MemberImport, read_rows
+
+class Command(BaseCommand):
+    help = (
+        'Creates members (and updates existing ones, matched by email) from a CSV or JSON lines file, '
+        'checking each row like the signup form. Rows that fail are written to an error report.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for standard input.")
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'jsonl'], help='Defaults to the file extension (csv unless it ends in .jsonl).')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Members hashed and written per batch.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes used to hash passwords. Defaults to one per core.')
+        parser.add_argument('--invite', action='store_true', help='Ignore any passwords and give new members an unusable one, for an invite flow.')
+        parser.add_argument('--errors', help='Where to write the error report (CSV). Defaults to <path>.errors.csv.')
+        parser.add_argument('--dry-run', action='store_true', help='Only check the rows.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        file_format = options['file_format'] or ('jsonl' if path.endswith('.jsonl') else 'csv')
+        errors_path = options['errors'] or ('import-errors.csv' if path == '-' else f'{path}.errors.csv')
+
+        error_file = None
+        error_writer = None
+
+        def on_error(line_number, row, errors):
+            # The report is only created once there's something to put in it
+            nonlocal error_file, error_writer
+            if error_writer is None:
+                error_file = open(errors_path, 'w', encoding='utf-8', newline='')
+                error_writer = csv.writer(error_file)
+                error_writer.writerow(['line', 'email', 'errors'])
+            email = row.get('email', '') if isinstance(row, dict) else ''
+            error_writer.writerow([line_number, email, json.dumps(errors)])
+
+        importer = MemberImport(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            invite=options['invite'],
+            dry_run=options['dry_run'],
+            on_error=on_error
+        )
+
+        started = time.perf_counter()
+        try:
+            if path == '-':
+                summary = importer.run(read_rows(sys.stdin, file_format))
+            else:
+                try:
+                    f = open(path, encoding='utf-8-sig', newline='')
+                except OSError as e:
+                    raise CommandError(f"Can't read {path}: {e}")
+                with f:
+                    summary = importer.run(read_rows(f, file_format))
+        finally:
+            if error_file is not None:
+                error_file.close()
+        elapsed = time.perf_counter() - started
+
+        members = summary['created'] + summary['updated']
+        verb = 'Would import' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {members} member(s): {summary['created']} new, {summary['updated']} updated "
+            f"({members / elapsed if elapsed else 0:.0f} members/s)."
+        ))
+        if summary['invalid']:
+            self.stdout.write(self.style.WARNING(f"{summary['invalid']} row(s) skipped, see {errors_path}."))
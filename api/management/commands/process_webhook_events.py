@@ -0,0 +1,45 @@
+# api/management/commands/process_webhook_events.py
+
+import time
+
+from django.core.management.base import BaseCommand
+from api.webhooks import DEFAULT_MAX_ATTEMPTS, inbox_metrics, process_pending_events
+
+class Command(BaseCommand):
+    help = 'Processes pending Stripe webhook events from the inbox in batches. Safe to run several at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='How many events to claim per batch.')
+        parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help='Give up on an event after this many failures.')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new events instead of exiting when the inbox is empty.')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Seconds to wait between polls when running with --loop.')
+
+    def handle(self, *args, **options):
+        totals = {'processed': 0, 'retried': 0, 'failed': 0}
+
+        while True:
+            results = process_pending_events(options['batch_size'], options['max_attempts'])
+            for key, value in results.items():
+                totals[key] += value
+
+            claimed = sum(results.values())
+            if claimed:
+                self.stdout.write(
+                    f"Batch done: {results['processed']} processed, {results['retried']} retried, {results['failed']} failed."
+                )
+
+            # A full batch means there is probably more waiting, so go again straight away
+            if claimed >= options['batch_size']:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['sleep'])
+
+        metrics = inbox_metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f"Finished: {totals['processed']} processed, {totals['retried']} retried, {totals['failed']} failed."
+        ))
+        self.stdout.write(
+            f"Inbox backlog: {metrics['counts']['PENDING']} pending ({metrics['due']} due), "
+            f"{metrics['counts']['FAILED']} failed, oldest pending {metrics['oldest_pending_age_seconds']:.0f}s old."
+        )
@@ -0,0 +1,15 @@
+# api/management/commands/reconcile_occupancy.py
+
+from django.core.management.base import BaseCommand
+from api.occupancy import reconcile
+
+class Command(BaseCommand):
+    help = (
+        "Recounts today's occupancy from the database and stores it in the cache. Readers "
+        'already do this every OCCUPANCY_RECONCILE_SECONDS; run it from cron after bulk '
+        'changes to attendance logs to correct the count straight away.'
+    )
+
+    def handle(self, *args, **options):
+        count = reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Occupancy reconciled: {count} player(s) in the hall."))
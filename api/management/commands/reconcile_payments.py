@@ -0,0 +1,54 @@
+# api/management/commands/reconcile_payments.py
+
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.reconciliation import RECONCILE_PAGE_SIZE, RECONCILE_WORKERS, reconcile_payments
+
+
+def start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class Command(BaseCommand):
+    help = (
+        'Marks fees paid and issues social cards for succeeded Stripe payments that never got applied '
+        '(e.g. because their webhook was lost), and reports payments it cannot match to a member. '
+        'Each run carries on from the last one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='Check payments created from this date (YYYY-MM-DD) instead of since the last run.')
+        parser.add_argument('--until', type=date.fromisoformat, help='Check payments created before this date. Defaults to now.')
+        parser.add_argument('--workers', type=int, default=RECONCILE_WORKERS, help='Stripe list calls in flight at once.')
+        parser.add_argument('--page-size', type=int, default=RECONCILE_PAGE_SIZE, help='PaymentIntents per Stripe list call (at most 100).')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1.")
+        if not 1 <= options['page_size'] <= 100:
+            raise CommandError("--page-size must be between 1 and 100.")
+        if options['until'] and not options['since']:
+            raise CommandError("--until only makes sense together with --since.")
+
+        since = start_of(options['since']) if options['since'] else None
+        until = start_of(options['until']) if options['until'] else None
+        if since and until and since >= until:
+            raise CommandError("--since must be before --until.")
+
+        def on_mismatch(intent_id, reason):
+            self.stderr.write(f"{intent_id}: {reason}")
+
+        results = reconcile_payments(
+            since=since,
+            until=until,
+            workers=options['workers'],
+            page_size=options['page_size'],
+            on_mismatch=on_mismatch
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {results['succeeded']} succeeded payment(s): marked {results['fees_paid']} fee(s) paid, "
+            f"issued {results['cards_issued']} card(s), {results['mismatches']} could not be matched."
+        ))
@@ -0,0 +1,29 @@
+# api/management/commands/refresh_attendance_rollups.py
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.attendance import club_date
+from api.rollups import refresh_dirty_days, refresh_range
+
+class Command(BaseCommand):
+    help = 'Updates the daily and monthly attendance rollups for days whose logs changed since the last run.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='Rebuild every day from this date (YYYY-MM-DD), whether or not it changed.')
+        parser.add_argument('--until', type=date.fromisoformat, help="Last day to rebuild when using --since. Defaults to today, the club's day.")
+
+    def handle(self, *args, **options):
+        if options['until'] and not options['since']:
+            raise CommandError("--until only makes sense together with --since.")
+
+        if options['since']:
+            until = options['until'] or club_date(timezone.now())
+            if options['since'] > until:
+                raise CommandError("--since must not be after --until.")
+            count = refresh_range(options['since'], until)
+        else:
+            count = refresh_dirty_days()
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed attendance rollups for {count} day(s)."))
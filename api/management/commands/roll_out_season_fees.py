@@ -0,0 +1,36 @@
+# api/management/commands/roll_out_season_fees.py
+
+from django.core.management.base import BaseCommand, CommandError
+from api.fees import ROLL_OUT_BATCH_SIZE, roll_out_season_fees, season_fee_counts
+from api.models import Season
+from api.seasons import get_current_season
+
+class Command(BaseCommand):
+    help = (
+        'Creates a fixture fee row for every active member for a season (WAIVED_GOLD for Gold Annual '
+        'members, PENDING for everyone else). Members who already have one are left alone, so it can be re-run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('season', nargs='?', type=int, help='Season id. Defaults to the current season.')
+        parser.add_argument('--batch-size', type=int, default=ROLL_OUT_BATCH_SIZE, help='Fee rows inserted per statement.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        if options['season'] is not None:
+            try:
+                season = Season.objects.get(pk=options['season'])
+            except Season.DoesNotExist:
+                raise CommandError(f"Season {options['season']} does not exist.")
+        else:
+            season = get_current_season()
+            if season is None:
+                raise CommandError("There's no current season, pass a season id.")
+
+        created = roll_out_season_fees(season, batch_size=options['batch_size'])
+        counts = season_fee_counts(season)
+
+        self.stdout.write(self.style.SUCCESS(f"Created {created} fee row(s) for {season.name}."))
+        self.stdout.write(', '.join(f"{status}: {count}" for status, count in counts.items()))
@@ -0,0 +1,88 @@
+# api/memberships.py
+
+from django.db import transaction
+from django.db.models import Case, Exists, OuterRef, Q, Value, When
+from .authentication import bump_user_versions
+from .models import MembershipChange, SocialCard, User
+
+EXPIRY_BATCH_SIZE = 1000
+
+ANNUAL_TYPES = (User.MembershipType.GOLD_ANNUAL, User.MembershipType.SILVER_ANNUAL)
+
+
+def expired_members(today):
+    """
+    Members whose annual membership ran out before `today` but who are still
+    flagged or typed as annual members. Served by the expiry date index.
+    Members with no expiry date are never touched.
+    """
+    return User.objects.filter(
+        Q(is_active_annual_member=True) | Q(membership_type__in=ANNUAL_TYPES),
+        annual_membership_expiry_date__lt=today,
+    )
+
+
+def demoted_type():
+    # A lapsed annual member who still has an active social card becomes a
+    # card holder, anyone else a generic user
+    active_card = SocialCard.objects.filter(player=OuterRef('pk'), status=SocialCard.Status.ACTIVE)
+    return Case(
+        When(Exists(active_card), membership_type__in=ANNUAL_TYPES, then=Value(User.MembershipType.SOCIAL_CARD_HOLDER)),
+        When(membership_type__in=ANNUAL_TYPES, then=Value(User.MembershipType.GENERIC_USER)),
+        default='membership_type',
+    )
+
+
+def expire_memberships(today, batch_size=EXPIRY_BATCH_SIZE, dry_run=False):
+    """
+    Demotes every expired member, a chunk of primary keys at a time, writing
+    a MembershipChange row for each one in the same transaction.
+
+    Each chunk locks its rows (skipping any another run has locked) and only
+    updates rows that are still expired, so two runs at once never demote or
+    audit anyone twice, and a run that was interrupted simply carries on
+    where it stopped when started again. Returns the number demoted.
+    """
+    demoted = 0
+    last_pk = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(
+                expired_members(today)
+                .filter(pk__gt=last_pk)
+                .select_for_update(skip_locked=True)
+                .annotate(new_type=demoted_type())
+                .order_by('pk')
+                .values_list('pk', 'membership_type', 'new_type', 'is_active_annual_member',
+                             'annual_membership_expiry_date')[:batch_size]
+            )
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            if dry_run:
+                demoted += len(rows)
+                continue
+
+            pks = [row[0] for row in rows]
+            expired_members(today).filter(pk__in=pks).update(
+                is_active_annual_member=False,
+                membership_type=demoted_type(),
+            )
+            MembershipChange.objects.bulk_create([
+                MembershipChange(
+                    user_id=pk,
+                    reason=MembershipChange.Reason.EXPIRED,
+                    old_membership_type=old_type,
+                    new_membership_type=new_type,
+                    was_active_annual_member=was_active,
+                    annual_membership_expiry_date=expiry,
+                )
+                for pk, old_type, new_type, was_active, expiry in rows
+            ])
+            # update() doesn't send post_save, so drop cached copies of these
+            # users once the chunk is committed
+            transaction.on_commit(lambda pks=pks: bump_user_versions(pks))
+        demoted += len(rows)
+
+    return demoted
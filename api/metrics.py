@@ -0,0 +1,263 @@
+# api/metrics.py
+
+import bisect
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# In-process request metrics, exposed at /metrics in the Prometheus text
+# format. Each worker process keeps its own histograms. With
+# METRICS_MULTIPROC_DIR set, every worker also writes a snapshot of them to
+# <dir>/<pid>.json (at most once per METRICS_FLUSH_INTERVAL), and /metrics
+# adds up all the snapshots, so whichever worker gets scraped reports for the
+# whole server.
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+HISTOGRAMS = {
+    'gctta_request_duration_seconds': ('Wall time spent handling the request.', SECONDS_BUCKETS),
+    'gctta_request_db_queries': ('Database queries made by the request.', QUERY_BUCKETS),
+    'gctta_request_db_duration_seconds': ('Time the request spent in database queries.', SECONDS_BUCKETS),
+    'gctta_request_stripe_duration_seconds': ('Time the request spent waiting on Stripe.', SECONDS_BUCKETS),
+}
+COUNTERS = {
+    'gctta_requests_total': 'Requests handled, by view, method and status code.',
+}
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Counts are per bucket here, and only made cumulative when rendered.
+        # Anything past the last bound only shows up in +Inf (the count).
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """
+    Histograms and counters keyed by (metric name, label values).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self._last_flush = 0.0
+
+    def observe(self, name, labels, value):
+        self.observe_many(labels, {name: value})
+
+    def observe_many(self, labels, values):
+        # Several histograms with the same labels, under one lock
+        with self._lock:
+            for name, value in values.items():
+                key = (name, labels)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+                histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': [
+                    [name, list(labels), histogram.counts[:], histogram.sum, histogram.count]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+            }
+
+    def flush(self, directory, force=False):
+        """
+        Writes this process's snapshot into the shared directory. Written to
+        a temporary file and renamed, so readers never see half a file.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_flush < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        data = json.dumps(self.snapshot())
+        fd, path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(path, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+registry = Registry()
+
+
+def merged_snapshot():
+    """
+    This process's metrics, or every worker's added together in
+    multiprocess mode.
+    """
+    directory = settings.METRICS_MULTIPROC_DIR
+    if not directory:
+        return registry.snapshot()
+
+    registry.flush(directory, force=True)
+    histograms = {}
+    counters = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # A worker that's gone, or a file we can't read; skip it
+            continue
+        for name, labels, counts, total, count in data['histograms']:
+            key = (name, tuple(labels))
+            merged = histograms.setdefault(key, [[0] * len(counts), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+        for name, labels, value in data['counters']:
+            key = (name, tuple(labels))
+            counters[key] = counters.get(key, 0) + value
+
+    return {
+        'histograms': [[name, list(labels), *values] for (name, labels), values in histograms.items()],
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+    }
+
+
+LABEL_NAMES = ('view', 'method')
+COUNTER_LABEL_NAMES = ('view', 'method', 'status')
+INF_LABEL = 'le="+Inf"'
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshot, gauges=()):
+    """
+    The Prometheus text exposition format (version 0.0.4) of a snapshot,
+    plus any extra (name, help, [(labels dict, value)]) gauges.
+    """
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        series = sorted((s for s in snapshot['histograms'] if s[0] == name), key=lambda s: s[1])
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for _, labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f'{name}_bucket{_labels(LABEL_NAMES, labels, le)} {cumulative}')
+            lines.append(f'{name}_bucket{_labels(LABEL_NAMES, labels, INF_LABEL)} {count}')
+            lines.append(f'{name}_sum{_labels(LABEL_NAMES, labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(LABEL_NAMES, labels)} {count}')
+
+    for name, help_text in COUNTERS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for _, labels, value in sorted((s for s in snapshot['counters'] if s[0] == name), key=lambda s: s[1]):
+            lines.append(f'{name}{_labels(COUNTER_LABEL_NAMES, labels)} {value}')
+
+    for name, help_text, samples in gauges:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            label_text = _labels(labels.keys(), labels.values()) if labels else ''
+            lines.append(f'{name}{label_text} {_number(value)}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class RequestSample:
+    """
+    What one request has spent so far. The middleware creates one per
+    request and records it into the registry when the response is done.
+    """
+    __slots__ = ('started', 'db_queries', 'db_seconds', 'stripe_calls', 'stripe_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.stripe_calls = 0
+        self.stripe_seconds = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.db_queries += 1
+
+
+current_sample = contextvars.ContextVar('gctta_request_sample', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    An execute wrapper installed on every database connection (see
+    api/signals.py), which counts the query against the current request's
+    sample. The sample is found through a context variable, so queries an
+    async view runs on another thread (through sync_to_async, which copies
+    the context) are counted too.
+    """
+    sample = current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample.record_query(execute, sql, params, many, context)
+
+
+@contextmanager
+def stripe_timer():
+    """
+    Times a call out to Stripe, and adds it to the current request's sample
+    if there is one.
+    """
+    sample = current_sample.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if sample is not None:
+            sample.stripe_seconds += time.perf_counter() - started
+            sample.stripe_calls += 1
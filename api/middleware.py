@@ -0,0 +1,248 @@
+# api/middleware.py
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.middleware import WhiteNoiseMiddleware
+from .metrics import current_sample, registry, RequestSample
+from .replica import current_scope, pin_to_primary, replica_configured, RoutingScope
+
+# Both middlewares work under WSGI and ASGI. Under ASGI they stay async, so
+# an async view (e.g. the payment intent one) never ties up a thread while it
+# waits on Stripe.
+
+
+async def aiter_content(content):
+    """
+    A streamed body as an async iterator. A sync one (our exports and rosters
+    run queries while they're read) is read a chunk at a time in the request's
+    thread, rather than all at once as Django would otherwise do under ASGI.
+    """
+    if hasattr(content, '__aiter__'):
+        async for chunk in content:
+            yield chunk
+        return
+
+    iterator = iter(content)
+    done = object()
+    while (chunk := await sync_to_async(next)(iterator, done)) is not done:
+        yield chunk
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every request and records, per view: wall time, the number of
+    database queries and the time spent in them, and the time spent waiting
+    on Stripe. The figures go into the in-process histograms behind /metrics,
+    and back to the client in a Server-Timing header.
+
+    Queries are counted by metrics.record_query, which every connection runs
+    and which adds them to the current request's sample.
+
+    Sits first in MIDDLEWARE so the wall time covers the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+
+        if response.streaming:
+            # An async view's stream (e.g. occupancy events) stays async
+            finish = self.afinish_streaming if response.is_async else self.finish_streaming
+            response.streaming_content = finish(response.streaming_content, sample, request, response)
+        else:
+            self.record(sample, request, response)
+        response['Server-Timing'] = self.server_timing(sample)
+        return response
+
+    async def __acall__(self, request):
+        sample = RequestSample()
+        token = current_sample.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_sample.reset(token)
+
+        if response.streaming:
+            response.streaming_content = self.afinish_streaming(response.streaming_content, sample, request, response)
+        else:
+            self.record(sample, request, response)
+        response['Server-Timing'] = self.server_timing(sample)
+        return response
+
+    # The body (and its queries) only runs once the server reads it, so the
+    # sample is current again while it's read, and the request is recorded
+    # when the stream is finished. Restored by value, as the chunks may not
+    # all be read in the same context.
+
+    def finish_streaming(self, content, sample, request, response):
+        previous = current_sample.get()
+        current_sample.set(sample)
+        try:
+            yield from content
+        finally:
+            current_sample.set(previous)
+            self.record(sample, request, response)
+
+    async def afinish_streaming(self, content, sample, request, response):
+        previous = current_sample.get()
+        current_sample.set(sample)
+        try:
+            async for chunk in aiter_content(content):
+                yield chunk
+        finally:
+            current_sample.set(previous)
+            self.record(sample, request, response)
+
+    def record(self, sample, request, response):
+        view = request.resolver_match.view_name if request.resolver_match else '<unmatched>'
+        registry.observe_many((view, request.method), {
+            'gctta_request_duration_seconds': time.perf_counter() - sample.started,
+            'gctta_request_db_queries': sample.db_queries,
+            'gctta_request_db_duration_seconds': sample.db_seconds,
+            'gctta_request_stripe_duration_seconds': sample.stripe_seconds,
+        })
+        registry.increment('gctta_requests_total', (view, request.method, str(response.status_code)))
+        if settings.METRICS_MULTIPROC_DIR:
+            registry.flush(settings.METRICS_MULTIPROC_DIR)
+
+    def server_timing(self, sample):
+        total = (time.perf_counter() - sample.started) * 1000
+        timings = [
+            f'app;dur={total:.1f}',
+            f'db;dur={sample.db_seconds * 1000:.1f};desc="{sample.db_queries} queries"',
+        ]
+        if sample.stripe_calls:
+            timings.append(f'stripe;dur={sample.stripe_seconds * 1000:.1f};desc="{sample.stripe_calls} calls"')
+        return ', '.join(timings)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Gives each request its own RoutingScope (see api/replica.py), so views
+    can send their reads to the replica. If the request wrote anything, its
+    user is pinned to the primary for a few seconds afterwards.
+
+    Not used when there's no replica configured.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        scope = RoutingScope()
+        token = current_scope.set(scope)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_scope.reset(token)
+
+        if response.streaming:
+            stream = self.astream if response.is_async else self.stream
+            response.streaming_content = stream(response.streaming_content, scope, request)
+        else:
+            self.finish(scope, request)
+        return response
+
+    async def __acall__(self, request):
+        scope = RoutingScope()
+        token = current_scope.set(scope)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_scope.reset(token)
+
+        if response.streaming:
+            response.streaming_content = self.astream(response.streaming_content, scope, request)
+        elif scope.wrote:
+            await sync_to_async(self.finish)(scope, request)
+        return response
+
+    # The body is read after the view has returned, so bring the scope back
+    # for it (restored by value, as above)
+
+    def stream(self, content, scope, request):
+        previous = current_scope.get()
+        current_scope.set(scope)
+        try:
+            yield from content
+        finally:
+            current_scope.set(previous)
+            self.finish(scope, request)
+
+    async def astream(self, content, scope, request):
+        previous = current_scope.get()
+        current_scope.set(scope)
+        try:
+            async for chunk in aiter_content(content):
+                yield chunk
+        finally:
+            current_scope.set(previous)
+            if scope.wrote:
+                await sync_to_async(self.finish)(scope, request)
+
+    def finish(self, scope, request):
+        # DRF puts the user it authenticated on the underlying request too
+        user = getattr(request, 'user', None)
+        if scope.wrote and user is not None and user.is_authenticated:
+            pin_to_primary([user.pk])
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, minus the one thing that kept it from running under ASGI:
+    requests for anything other than a static file pass straight through to
+    the (async) rest of the stack. Static files are still served by WhiteNoise,
+    in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings=settings)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
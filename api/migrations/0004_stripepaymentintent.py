@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_stripewebhookevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePaymentIntent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_type', models.CharField(choices=[('fixture_fee', 'Fixture Fee'), ('social_card_purchase', 'Social Card Purchase')], max_length=30)),
+                ('stripe_payment_intent_id', models.CharField(max_length=255, unique=True)),
+                ('idempotency_key', models.CharField(max_length=255, unique=True)),
+                ('client_secret', models.CharField(max_length=255)),
+                ('amount', models.IntegerField()),
+                ('currency', models.CharField(default='aud', max_length=3)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(max_length=40)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('season', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='payment_intents', to='api.season')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_intents', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'payment_type', 'season', 'status'], name='payment_intent_lookup_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_stripepaymentintent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socialcard',
+            name='stripe_payment_intent_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
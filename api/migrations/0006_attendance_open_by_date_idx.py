@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_socialcard_stripe_payment_intent_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(condition=models.Q(('exit_time__isnull', True)), fields=['date_of_play'], name='attendance_open_by_date_idx'),
+        ),
+    ]
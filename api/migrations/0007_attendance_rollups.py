@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:43
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_attendance_open_by_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('membership_type', models.CharField(choices=[('GENERIC_USER', 'Generic User'), ('SOCIAL_CARD_HOLDER', 'Social Card Holder'), ('GOLD_ANNUAL', 'Gold Annual'), ('SILVER_ANNUAL', 'Silver Annual')], max_length=20)),
+                ('visits', models.IntegerField(default=0)),
+                ('unique_players', models.IntegerField(default=0)),
+                ('closed_visits', models.IntegerField(default=0)),
+                ('total_session_seconds', models.BigIntegerField(default=0)),
+                ('sessions_consumed', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlyMemberAttendance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('visits', models.IntegerField(default=0)),
+                ('days_played', models.IntegerField(default=0)),
+                ('total_session_seconds', models.BigIntegerField(default=0)),
+                ('sessions_consumed', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attendancelog',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(fields=['updated_at'], name='attendance_updated_at_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyattendancerollup',
+            constraint=models.UniqueConstraint(fields=('date', 'membership_type'), name='daily_rollup_unique_day_type'),
+        ),
+        migrations.AddField(
+            model_name='monthlymemberattendance',
+            name='player',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_attendance', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlymemberattendance',
+            constraint=models.UniqueConstraint(fields=('month', 'player'), name='monthly_attendance_unique_member'),
+        ),
+    ]
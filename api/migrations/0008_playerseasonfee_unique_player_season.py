@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def remove_duplicate_fees(apps, schema_editor):
+    # Before the constraint, the webhook could leave more than one row for a
+    # player and season. Keep a PAID one if there is one, else the oldest.
+    PlayerSeasonFee = apps.get_model('api', 'PlayerSeasonFee')
+    duplicates = (
+        PlayerSeasonFee.objects.values('player', 'season')
+        .annotate(rows=Count('pk'))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        fees = PlayerSeasonFee.objects.filter(player=duplicate['player'], season=duplicate['season'])
+        paid = fees.filter(payment_status='PAID').order_by('pk').first()
+        keep = paid or fees.order_by('pk').first()
+        fees.exclude(pk=keep.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_fees, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='playerseasonfee',
+            constraint=models.UniqueConstraint(fields=('player', 'season'), name='unique_player_season_fee'),
+        ),
+    ]
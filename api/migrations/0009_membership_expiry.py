@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_playerseasonfee_unique_player_season'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('EXPIRED', 'Annual membership expired')], max_length=20)),
+                ('old_membership_type', models.CharField(choices=[('GENERIC_USER', 'Generic User'), ('SOCIAL_CARD_HOLDER', 'Social Card Holder'), ('GOLD_ANNUAL', 'Gold Annual'), ('SILVER_ANNUAL', 'Silver Annual')], max_length=20)),
+                ('new_membership_type', models.CharField(choices=[('GENERIC_USER', 'Generic User'), ('SOCIAL_CARD_HOLDER', 'Social Card Holder'), ('GOLD_ANNUAL', 'Gold Annual'), ('SILVER_ANNUAL', 'Silver Annual')], max_length=20)),
+                ('was_active_annual_member', models.BooleanField()),
+                ('annual_membership_expiry_date', models.DateField(blank=True, null=True)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['annual_membership_expiry_date'], name='user_membership_expiry_idx'),
+        ),
+        migrations.AddField(
+            model_name='membershipchange',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='membership_changes', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_membership_expiry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(fields=['date_of_play', 'exit_time'], name='attendance_date_exit_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_attendance_date_exit_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(fields=['player', 'date_of_play'], name='attendance_player_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playerseasonfee',
+            index=models.Index(fields=['player', 'season', 'payment_status'], name='fee_player_season_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playerseasonfee',
+            index=models.Index(condition=models.Q(('payment_status', 'PENDING')), fields=['season', 'player'], name='fee_season_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='season',
+            index=models.Index(fields=['start_date', 'end_date'], name='season_dates_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:09
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='playerseasonfee',
+            name='fee_player_season_status_idx',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:12
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def assume_past_visits_closed(apps, schema_editor):
+    # cleanup_attendance closes every visit the night after, so past months'
+    # visits are closed; the next refresh of a month counts them exactly
+    MonthlyMemberAttendance = apps.get_model('api', 'MonthlyMemberAttendance')
+    MonthlyMemberAttendance.objects.update(closed_visits=F('visits'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_drop_fee_player_season_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='monthlymemberattendance',
+            name='closed_visits',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(assume_past_visits_closed, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='AttendanceLogDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_of_play', models.DateField()),
+                ('player_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deleted_at'], name='attendance_deletion_at_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_monthly_closed_visits_and_log_deletions'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='playerseasonfee',
+            index=models.Index(fields=['payment_status', 'id'], name='fee_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='socialcard',
+            index=models.Index(fields=['status', 'id'], name='social_card_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['membership_type', 'id'], name='user_membership_type_idx'),
+        ),
+    ]
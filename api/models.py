@@ -2,16 +2,21 @@
 
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 
 # This class manages how users are created
 class UserManager(BaseUserManager):
-    def create_user(self, email, first_name, last_name, password=None, **extra_fields):
+    def create_user(self, email, first_name, last_name, password=None, password_hash=None, **extra_fields):
         if not email:
             raise ValueError('The Email field must be set')
         email = self.normalize_email(email)
         user = self.model(email=email, first_name=first_name, last_name=last_name, **extra_fields)
-        user.set_password(password)  # This automatically hashes the password
+        if password_hash is None:
+            user.set_password(password)  # This automatically hashes the password
+        else:
+            # Already hashed by the caller (the signup view hashes off the request thread)
+            user.password = password_hash
         user.save(using=self._db)
         return user
 
@@ -53,6 +58,14 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
+    class Meta:
+        indexes = [
+            # expire_memberships looks members up by expiry date
+            models.Index(fields=['annual_membership_expiry_date'], name='user_membership_expiry_idx'),
+            # The admin's membership type filter, newest first
+            models.Index(fields=['membership_type', 'id'], name='user_membership_type_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -68,6 +81,14 @@ class SocialCard(models.Model):
     sessions_total = models.IntegerField(default=10)
     sessions_remaining = models.IntegerField()
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.ACTIVE)
+    # The payment that bought this card, so a replayed webhook can't issue it twice
+    stripe_payment_intent_id = models.CharField(max_length=255, null=True, blank=True, unique=True)
+
+    class Meta:
+        indexes = [
+            # The admin's status filter, newest first
+            models.Index(fields=['status', 'id'], name='social_card_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.player.email} - {self.sessions_remaining} sessions left"
@@ -80,6 +101,12 @@ class Season(models.Model):
     fixture_fee_amount = models.DecimalField(max_digits=6, decimal_places=2)
     fixture_fee_due_date = models.DateField()
 
+    class Meta:
+        indexes = [
+            # Which season covers a date (see api/seasons.py)
+            models.Index(fields=['start_date', 'end_date'], name='season_dates_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -95,9 +122,33 @@ class PlayerSeasonFee(models.Model):
     payment_status = models.CharField(max_length=15, choices=PaymentStatus.choices, default=PaymentStatus.PENDING)
     stripe_charge_id = models.CharField(max_length=255, null=True, blank=True)
 
+    class Meta:
+        constraints = [
+            # One fee row per player per season, so the season roll-out and the
+            # webhook can both insert with ignore_conflicts and never double up.
+            # Its index also answers "has this player paid for this season"
+            models.UniqueConstraint(fields=['player', 'season'], name='unique_player_season_fee'),
+        ]
+        indexes = [
+            # Who still owes for a season, without reading the paid and waived rows
+            models.Index(fields=['season', 'player'], condition=models.Q(payment_status='PENDING'), name='fee_season_pending_idx'),
+            # The admin's payment status filter, newest first
+            models.Index(fields=['payment_status', 'id'], name='fee_status_idx'),
+        ]
+
     def __str__(self):
         return f"{self.player.email} - {self.season.name} - {self.payment_status}"
 
+# This is the Teams table. A captain can check their own team's eligibility
+# before a fixture (see BulkFixtureEligibilityView), and nobody else's
+class Team(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    captain = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='captained_teams')
+    players = models.ManyToManyField(User, blank=True, related_name='teams')
+
+    def __str__(self):
+        return self.name
+
 # This is the Attendance Logs table
 class AttendanceLog(models.Model):
     player = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attendance_logs')
@@ -105,6 +156,166 @@ class AttendanceLog(models.Model):
     entry_time = models.DateTimeField()
     exit_time = models.DateTimeField(null=True, blank=True)
     daily_session_consumed = models.BooleanField(default=False)
+    # Bumped on every change. The rollups use it to find which days need recomputing.
+    # Note that queryset .update() and bulk_update() don't set auto_now, so pass it yourself.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Open visits are a tiny slice of the table, so cleanup_attendance
+            # can find them without scanning the whole history
+            models.Index(fields=['date_of_play'], condition=models.Q(exit_time__isnull=True), name='attendance_open_by_date_idx'),
+            models.Index(fields=['updated_at'], name='attendance_updated_at_idx'),
+            # One player's visits on a day (scans) or over time (history)
+            models.Index(fields=['player', 'date_of_play'], name='attendance_player_date_idx'),
+            # Date ranges: the admin's date hierarchy, exports and reports
+            models.Index(fields=['date_of_play', 'exit_time'], name='attendance_date_exit_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.player.email} on {self.date_of_play}"
+
+# This is the Stripe webhook inbox. Every verified event is stored here first
+# and processed later by the process_webhook_events command.
+class StripeWebhookEvent(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'Pending'
+        PROCESSED = 'PROCESSED', 'Processed'
+        FAILED = 'FAILED', 'Failed'
+
+    # Stripe's own event id, so a redelivered event can't be stored twice
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The workers only ever look for pending events that are due
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='PENDING'), name='webhook_event_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.stripe_event_id} - {self.status}"
+
+
+# This is our local copy of each Stripe PaymentIntent we create, so a double
+# tap or page reload can reuse an open intent instead of creating another one.
+class StripePaymentIntent(models.Model):
+    class PaymentType(models.TextChoices):
+        FIXTURE_FEE = 'fixture_fee', 'Fixture Fee'
+        SOCIAL_CARD_PURCHASE = 'social_card_purchase', 'Social Card Purchase'
+
+    # Stripe statuses where the customer can still pay with the same intent
+    OPEN_STATUSES = ('requires_payment_method', 'requires_confirmation', 'requires_action', 'processing')
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='payment_intents')
+    payment_type = models.CharField(max_length=30, choices=PaymentType.choices)
+    season = models.ForeignKey(Season, on_delete=models.PROTECT, related_name='payment_intents', null=True, blank=True)
+    stripe_payment_intent_id = models.CharField(max_length=255, unique=True)
+    idempotency_key = models.CharField(max_length=255, unique=True)
+    client_secret = models.CharField(max_length=255)
+    amount = models.IntegerField()
+    currency = models.CharField(max_length=3, default='aud')
+    description = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=40)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'payment_type', 'season', 'status'], name='payment_intent_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} - {self.payment_type} - {self.status}"
+
+
+# Per day, per membership type attendance totals, kept up to date by the
+# refresh_attendance_rollups command so reports never scan AttendanceLog
+class DailyAttendanceRollup(models.Model):
+    date = models.DateField()
+    membership_type = models.CharField(max_length=20, choices=User.MembershipType.choices)
+    visits = models.IntegerField(default=0)
+    unique_players = models.IntegerField(default=0)
+    closed_visits = models.IntegerField(default=0)
+    total_session_seconds = models.BigIntegerField(default=0)
+    sessions_consumed = models.IntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'membership_type'], name='daily_rollup_unique_day_type'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.membership_type} - {self.visits} visits"
+
+# Per member, per month attendance totals
+class MonthlyMemberAttendance(models.Model):
+    player = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_attendance')
+    # Always the first day of the month
+    month = models.DateField()
+    visits = models.IntegerField(default=0)
+    days_played = models.IntegerField(default=0)
+    closed_visits = models.IntegerField(default=0)
+    total_session_seconds = models.BigIntegerField(default=0)
+    sessions_consumed = models.IntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'player'], name='monthly_attendance_unique_member'),
+        ]
+
+    def __str__(self):
+        return f"{self.player_id} - {self.month:%Y-%m} - {self.visits} visits"
+
+# A day and member that lost attendance logs, written once per pair by
+# delete_attendance_logs() and when a member is deleted (api/rollups.py). A
+# deleted row has no updated_at for the rollups' watermark to find, so this is
+# what tells the next refresh to recount them
+class AttendanceLogDeletion(models.Model):
+    date_of_play = models.DateField()
+    # Not a foreign key: deleting the member is one way their logs go
+    player_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at'], name='attendance_deletion_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.player_id} - {self.date_of_play} deleted at {self.deleted_at}"
+
+# Remembers how far a background job has got, so the next run can carry on from there
+class Watermark(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} at {self.value}"
+
+
+# An audit trail of membership changes made by the system rather than by a person
+class MembershipChange(models.Model):
+    class Reason(models.TextChoices):
+        EXPIRED = 'EXPIRED', 'Annual membership expired'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='membership_changes')
+    reason = models.CharField(max_length=20, choices=Reason.choices)
+    old_membership_type = models.CharField(max_length=20, choices=User.MembershipType.choices)
+    new_membership_type = models.CharField(max_length=20, choices=User.MembershipType.choices)
+    was_active_annual_member = models.BooleanField()
+    annual_membership_expiry_date = models.DateField(null=True, blank=True)
+    changed_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.player.email} on {self.date_of_play}"
\ No newline at end of file
+        return f"{self.user_id}: {self.old_membership_type} -> {self.new_membership_type} ({self.reason})"
@@ -0,0 +1,182 @@
+# api/occupancy.py
+
+import asyncio
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from . import attendance
+from .models import AttendanceLog
+
+# How many players are in the hall right now: today's visits with no
+# exit_time. The count lives in the cache and is moved up and down as scans
+# and cleanup_attendance commit, so reading it costs one cache round trip.
+#
+# Anything that changes logs some other way (the admin, a script) would let
+# the count drift, so it's recounted from the database (on the partial open
+# visit index) once every OCCUPANCY_RECONCILE_SECONDS, by whichever reader
+# gets there first, or straight away by the reconcile_occupancy command.
+#
+# The count must live in the shared cache (CACHE_URL) so every worker and
+# command moves the same number. Redis's INCR is atomic; DatabaseCache's incr
+# is a read then a write, so concurrent scans there can drift the count until
+# the next recount.
+#
+# The SSE stream doesn't read the cache per display either: each worker has
+# one OccupancyFeed per event loop that checks the count every
+# OCCUPANCY_STREAM_INTERVAL seconds and wakes every open stream when it moves.
+
+COUNT_KEY = 'api:occupancy:{}'
+CHECKED_KEY = 'api:occupancy-checked:{}'
+COUNT_TIMEOUT = 60 * 60 * 48
+
+# A comment line every so often stops proxies from closing an idle stream
+HEARTBEAT_SECONDS = 15
+
+# Under WSGI a stream would hold a worker thread for its whole life, so the
+# view sends one event and closes; EventSource then reconnects after this long
+POLL_RETRY_MILLISECONDS = 5000
+
+
+def today():
+    # attendance and this module import each other, so look club_date up late
+    return attendance.club_date(timezone.now())
+
+
+def count_open(day):
+    return AttendanceLog.objects.filter(date_of_play=day, exit_time__isnull=True).count()
+
+
+def reconcile(day=None):
+    """
+    Recounts a day's occupancy from the database and stores it.
+    """
+    day = day or today()
+    count = count_open(day)
+    cache.set(COUNT_KEY.format(day), count, COUNT_TIMEOUT)
+    cache.set(CHECKED_KEY.format(day), True, settings.OCCUPANCY_RECONCILE_SECONDS)
+    return count
+
+
+def current_occupancy(day=None):
+    day = day or today()
+    count_key, checked_key = COUNT_KEY.format(day), CHECKED_KEY.format(day)
+    found = cache.get_many([count_key, checked_key])
+    if count_key not in found:
+        return reconcile(day)
+    # Due for a recount: only the reader that claims it does one
+    if checked_key not in found and cache.add(checked_key, True, settings.OCCUPANCY_RECONCILE_SECONDS):
+        return reconcile(day)
+    return max(found[count_key], 0)
+
+
+def adjust_occupancy(changes):
+    """
+    Applies {day: change in open visits} to the cached counts. Call it once
+    the change has committed. A day with no count yet is left alone, the
+    next read counts it from the database.
+    """
+    for day, change in changes.items():
+        if change:
+            try:
+                cache.incr(COUNT_KEY.format(day), change)
+            except ValueError:
+                pass
+
+
+def occupancy_payload():
+    day = today()
+    return {'date': day.isoformat(), 'occupancy': current_occupancy(day)}
+
+
+class OccupancyFeed:
+    """
+    Checks the occupancy while anyone is listening, and sets `changed` (then
+    swaps in a fresh event) whenever the payload moves.
+    """
+
+    def __init__(self):
+        self.payload = None
+        self.changed = asyncio.Event()
+        self.listeners = 0
+        self.task = None
+
+    async def watch(self):
+        while True:
+            # Not thread sensitive: this task outlives the request that started it
+            payload = await sync_to_async(occupancy_payload, thread_sensitive=False)()
+            if payload != self.payload:
+                self.payload = payload
+                changed, self.changed = self.changed, asyncio.Event()
+                changed.set()
+            await asyncio.sleep(settings.OCCUPANCY_STREAM_INTERVAL)
+
+    def subscribe(self):
+        self.listeners += 1
+        if self.task is None:
+            self.task = asyncio.create_task(self.watch())
+
+    def unsubscribe(self):
+        self.listeners -= 1
+        # The last one out stops the checks, and the next stream starts fresh
+        if not self.listeners and self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.payload = None
+
+
+# One feed per event loop, as its events can't be shared between loops
+_feeds = weakref.WeakKeyDictionary()
+
+
+def get_feed():
+    loop = asyncio.get_running_loop()
+    feed = _feeds.get(loop)
+    if feed is None:
+        feed = _feeds[loop] = OccupancyFeed()
+    return feed
+
+
+def sse_event(payload):
+    return f"event: occupancy\ndata: {json.dumps(payload)}\n\n"
+
+
+def occupancy_snapshot():
+    """
+    A single SSE event and a retry delay, for when the stream can't be held open.
+    """
+    return f"retry: {POLL_RETRY_MILLISECONDS}\n\n" + sse_event(occupancy_payload())
+
+
+async def occupancy_events():
+    """
+    The SSE stream: the current occupancy straight away, then again whenever
+    it changes. It ends after OCCUPANCY_STREAM_SECONDS, and the browser's
+    EventSource reconnects, so a worker never holds a stream forever.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.OCCUPANCY_STREAM_SECONDS
+    yield "retry: 3000\n\n"
+
+    feed = get_feed()
+    feed.subscribe()
+    try:
+        sent = None
+        while True:
+            changed = feed.changed
+            if feed.payload is not None and feed.payload != sent:
+                sent = feed.payload
+                yield sse_event(sent)
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=min(HEARTBEAT_SECONDS, remaining))
+            except TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        feed.unsubscribe()
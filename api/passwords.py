@@ -0,0 +1,139 @@
+# api/passwords.py
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import aauthenticate, hashers, user_logged_in
+from django.contrib.auth.backends import ModelBackend
+from .models import User
+
+# Password hashing is the slowest thing the API does by far: a PBKDF2 hash at
+# Django's default work factor is hundreds of milliseconds of CPU. Done on
+# the request thread, a burst of logins at the start of a competition night
+# ties up every worker until it's through.
+#
+# So the async login and signup views hash on a small thread pool instead,
+# PASSWORD_HASH_WORKERS threads per worker process. hashlib (and the argon2,
+# bcrypt and scrypt libraries) release the GIL while they hash, so the pool
+# spreads over that many cores while the event loop goes on serving other
+# requests, and it caps how much CPU hashing can take at once.
+#
+# The hasher new passwords get, and its work factor, are settings
+# (PASSWORD_HASHER, PASSWORD_HASH_WORK_FACTOR). Any member whose stored hash
+# was made another way is rehashed the next time they log in.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def hashing_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS or os.cpu_count(),
+                    thread_name_prefix='password-hash',
+                )
+    return _executor
+
+
+def reset_hashing_executor():
+    # Used by benchmarks, after changing PASSWORD_HASH_WORKERS at runtime
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+async def run_hasher(func, *args):
+    """
+    Runs a hashing function on the hashing pool. Only for functions that
+    don't touch the database: the pool's threads have no connection.
+    """
+    return await asyncio.get_running_loop().run_in_executor(hashing_executor(), func, *args)
+
+
+async def ahash_password(password):
+    return await run_hasher(hashers.make_password, password)
+
+
+async def alogin(request, email, password):
+    """
+    The active member with this email and password, or None. Goes through
+    the AUTHENTICATION_BACKENDS like authenticate() does, so user_login_failed
+    is sent for a refused login, and user_logged_in for an accepted one.
+    """
+    user = await aauthenticate(request, username=email, password=password)
+    if user is not None:
+        await user_logged_in.asend(sender=user.__class__, request=request, user=user)
+    return user
+
+
+class HashingPoolModelBackend(ModelBackend):
+    """
+    ModelBackend, except that aauthenticate() checks the password on the
+    hashing pool. One query, and one UPDATE when the stored hash is rehashed.
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway, so an unknown email takes as long as a wrong password
+            await ahash_password(password)
+            return None
+
+        is_correct, must_update = await run_hasher(hashers.verify_password, password, user.password)
+        if not is_correct or not self.user_can_authenticate(user):
+            return None
+        if must_update:
+            user.password = await ahash_password(password)
+            await user.asave(update_fields=['password'])
+        return user
+
+
+class TunedHasherMixin:
+    """
+    Takes the work factor from PASSWORD_HASH_WORK_FACTOR when this is the
+    PASSWORD_HASHER new passwords use, else keeps Django's. must_update()
+    compares stored hashes against it, which is what rehashes them on login.
+    """
+
+    def work_factor_or(self, default):
+        if settings.PASSWORD_HASH_WORK_FACTOR and settings.PASSWORD_HASHER == self.algorithm:
+            return settings.PASSWORD_HASH_WORK_FACTOR
+        return default
+
+
+class PBKDF2PasswordHasher(TunedHasherMixin, hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return self.work_factor_or(hashers.PBKDF2PasswordHasher.iterations)
+
+
+class Argon2PasswordHasher(TunedHasherMixin, hashers.Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return self.work_factor_or(hashers.Argon2PasswordHasher.time_cost)
+
+
+class BCryptSHA256PasswordHasher(TunedHasherMixin, hashers.BCryptSHA256PasswordHasher):
+    @property
+    def rounds(self):
+        return self.work_factor_or(hashers.BCryptSHA256PasswordHasher.rounds)
+
+
+class ScryptPasswordHasher(TunedHasherMixin, hashers.ScryptPasswordHasher):
+    # The work factor is scrypt's N, a power of two
+    @property
+    def work_factor(self):
+        return self.work_factor_or(hashers.ScryptPasswordHasher.work_factor)
@@ -0,0 +1,21 @@
+# api/permissions.py
+
+from rest_framework.permissions import BasePermission
+from .models import Team
+
+
+def is_captain(user):
+    return Team.objects.filter(captain=user).exists()
+
+
+class IsAdminOrCaptain(BasePermission):
+    """
+    Staff, or a member who captains at least one team. Views using it scope
+    a captain's results to their own teams.
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if not (user and user.is_authenticated):
+            return False
+        return user.is_staff or is_captain(user)
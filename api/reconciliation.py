@@ -0,0 +1,265 @@
+# api/reconciliation.py
+
+import asyncio
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+from .attendance import club_date
+from .authentication import bump_user_versions
+from .conditional import bump_fee_versions
+from .models import PlayerSeasonFee, Season, SocialCard, StripePaymentIntent, User, Watermark
+from .replica import pin_to_primary
+from .seasons import get_current_season
+from .stripe_client import aclose_stripe_client, get_stripe_client
+from .webhooks import SOCIAL_CARD_SESSIONS
+
+# Webhooks get lost, and some fail for good (e.g. a receipt email that
+# matches nobody), which leaves a paid fee PENDING or a bought card never
+# issued. reconcile_payments() repairs that from Stripe's own record: it lists
+# the PaymentIntents created in a window, works out who paid for what, and
+# applies whatever is missing in a few bulk statements.
+#
+# The window is cut into slices that are listed side by side, at most
+# `workers` Stripe calls at a time. Slices are fetched and applied a round at
+# a time, and the watermark moves on after each round commits, so an
+# interrupted run carries on where it stopped and repeat runs only look at
+# new intents. Everything it writes is keyed on the payment, so re-reading an
+# intent never applies it twice.
+
+WATERMARK_NAME = 'stripe_reconciliation'
+
+# Intents are listed by when they were created, but a customer can finish
+# paying an open intent days later, so each run goes back this far again.
+WATERMARK_OVERLAP = timedelta(days=3)
+
+# How far back the first run looks
+FIRST_RUN_LOOKBACK = timedelta(days=90)
+
+RECONCILE_SLICE = timedelta(days=1)
+RECONCILE_PAGE_SIZE = 100
+RECONCILE_WORKERS = 8
+
+
+def slices(start, end, size=RECONCILE_SLICE):
+    while start < end:
+        yield start, min(start + size, end)
+        start += size
+
+
+def timestamp(moment):
+    return int(moment.timestamp())
+
+
+async def list_slice(service, limit, start, end, page_size):
+    """
+    Every PaymentIntent created in [start, end), a page at a time.
+    """
+    intents = []
+    params = {'created': {'gte': timestamp(start), 'lt': timestamp(end)}, 'limit': page_size}
+    while True:
+        async with limit:
+            page = await service.list_async(params=params)
+        intents.extend(page.data)
+        if not page.has_more or not page.data:
+            return intents
+        params = {**params, 'starting_after': page.data[-1].id}
+
+
+async def fetch_succeeded(window, workers, page_size):
+    # Each round runs on a loop of its own, with that loop's Stripe client
+    service = get_stripe_client().payment_intents
+    limit = asyncio.Semaphore(workers)
+    try:
+        pages = await asyncio.gather(*(list_slice(service, limit, start, end, page_size) for start, end in window))
+    finally:
+        await aclose_stripe_client()
+    return [intent for page in pages for intent in page if intent.get('status') == 'succeeded']
+
+
+def match_payments(intents):
+    """
+    Works out who paid for what, with a handful of queries for the lot.
+    Returns (payments, mismatches): payments as (intent, user_id, payment_type,
+    season_id) and mismatches as (intent id, reason).
+
+    The member is whoever our own StripePaymentIntent record says, else the
+    Stripe customer, else the receipt email. The payment type comes from our
+    record, then the metadata, then the description, as in the webhook.
+    """
+    ids = [intent['id'] for intent in intents]
+    records = {
+        row['stripe_payment_intent_id']: row
+        for row in StripePaymentIntent.objects.filter(stripe_payment_intent_id__in=ids)
+        .values('stripe_payment_intent_id', 'user_id', 'payment_type', 'season_id')
+    }
+    customers = {intent.get('customer') for intent in intents} - {None, ''}
+    by_customer = dict(
+        User.objects.filter(stripe_customer_id__in=customers).values_list('stripe_customer_id', 'pk')
+    ) if customers else {}
+    emails = {intent['receipt_email'].lower() for intent in intents if intent.get('receipt_email')}
+    by_email = dict(
+        User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails).values_list('email_lower', 'pk')
+    ) if emails else {}
+    season_ids = {
+        int(intent['metadata']['season_id']) for intent in intents
+        if str((intent.get('metadata') or {}).get('season_id', '')).isdigit()
+    }
+    seasons = set(Season.objects.filter(pk__in=season_ids).values_list('pk', flat=True)) if season_ids else set()
+
+    payments = []
+    mismatches = []
+    for intent in intents:
+        record = records.get(intent['id'])
+        metadata = intent.get('metadata') or {}
+        description = intent.get('description') or ''
+
+        customer_user = by_customer.get(intent.get('customer'))
+        email_user = by_email.get((intent.get('receipt_email') or '').lower())
+        if record:
+            user_id = record['user_id']
+        elif customer_user and email_user and customer_user != email_user:
+            mismatches.append((intent['id'], "customer and receipt_email belong to different members"))
+            continue
+        else:
+            user_id = customer_user or email_user
+        if user_id is None:
+            mismatches.append((intent['id'], f"no member with customer {intent.get('customer') or '-'} "
+                                             f"or email {intent.get('receipt_email') or '-'}"))
+            continue
+
+        if record:
+            payment_type, season_id = record['payment_type'], record['season_id']
+        else:
+            payment_type = metadata.get('payment_type')
+            if not payment_type and 'Fixture Fee' in description:
+                payment_type = StripePaymentIntent.PaymentType.FIXTURE_FEE
+            elif not payment_type and 'Social Card' in description:
+                payment_type = StripePaymentIntent.PaymentType.SOCIAL_CARD_PURCHASE
+            season_id = int(metadata['season_id']) if str(metadata.get('season_id', '')).isdigit() else None
+            if season_id not in seasons:
+                season_id = None
+
+        if payment_type not in StripePaymentIntent.PaymentType.values:
+            mismatches.append((intent['id'], f"can't tell what was paid for from {description!r}"))
+            continue
+        if payment_type == StripePaymentIntent.PaymentType.FIXTURE_FEE and season_id is None:
+            # The season that was current when the payment was made
+            created = datetime.fromtimestamp(intent['created'], tz=dt_timezone.utc)
+            season = get_current_season(club_date(created))
+            if season is None:
+                mismatches.append((intent['id'], "fixture fee paid outside any season"))
+                continue
+            season_id = season.pk
+
+        payments.append((intent, user_id, payment_type, season_id))
+    return payments, mismatches
+
+
+def apply_payments(payments):
+    """
+    Marks the fees paid and issues the cards that are missing, in bulk.
+    Returns (fees marked paid, cards issued).
+    """
+    if not payments:
+        return 0, 0
+
+    fees = {(user_id, season_id) for _, user_id, payment_type, season_id in payments
+            if payment_type == StripePaymentIntent.PaymentType.FIXTURE_FEE}
+    cards = {intent['id']: user_id for intent, user_id, payment_type, _ in payments
+             if payment_type == StripePaymentIntent.PaymentType.SOCIAL_CARD_PURCHASE}
+
+    with transaction.atomic():
+        StripePaymentIntent.objects.filter(
+            stripe_payment_intent_id__in=[intent['id'] for intent, *_ in payments]
+        ).exclude(status='succeeded').update(status='succeeded', updated_at=timezone.now())
+
+        # Fees: one UPDATE per season for rows that aren't paid yet, then
+        # insert PAID rows for members the roll-out never reached
+        fees_paid = 0
+        paid_players = set()
+        by_season = {}
+        for user_id, season_id in fees:
+            by_season.setdefault(season_id, set()).add(user_id)
+        for season_id, players in by_season.items():
+            unpaid = (
+                PlayerSeasonFee.objects
+                .filter(season_id=season_id, player_id__in=players)
+                .exclude(payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+            )
+            paid_players.update(unpaid.values_list('player_id', flat=True))
+            fees_paid += unpaid.update(payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+
+            existing = set(PlayerSeasonFee.objects.filter(season_id=season_id, player_id__in=players)
+                           .values_list('player_id', flat=True))
+            missing = players - existing
+            PlayerSeasonFee.objects.bulk_create([
+                PlayerSeasonFee(player_id=pk, season_id=season_id, payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+                for pk in missing
+            ], ignore_conflicts=True)
+            fees_paid += len(missing)
+            paid_players.update(missing)
+
+        # Cards: keyed on the payment, so an intent already issued (by the
+        # webhook or an earlier run) is skipped
+        issued = set(SocialCard.objects.filter(stripe_payment_intent_id__in=cards).values_list('stripe_payment_intent_id', flat=True))
+        new_cards = [
+            SocialCard(player_id=user_id, stripe_payment_intent_id=intent_id,
+                       sessions_total=SOCIAL_CARD_SESSIONS, sessions_remaining=SOCIAL_CARD_SESSIONS)
+            for intent_id, user_id in cards.items() if intent_id not in issued
+        ]
+        SocialCard.objects.bulk_create(new_cards, ignore_conflicts=True)
+        card_holders = {card.player_id for card in new_cards}
+        upgraded = list(
+            User.objects.filter(pk__in=card_holders, membership_type=User.MembershipType.GENERIC_USER)
+            .values_list('pk', flat=True)
+        )
+        User.objects.filter(pk__in=upgraded).update(membership_type=User.MembershipType.SOCIAL_CARD_HOLDER)
+
+        # update() and bulk_create() don't send post_save
+        changed = paid_players | card_holders
+        transaction.on_commit(lambda: bump_fee_versions(paid_players))
+        transaction.on_commit(lambda: bump_user_versions(upgraded))
+        transaction.on_commit(lambda: pin_to_primary(changed))
+
+    return fees_paid, len(new_cards)
+
+
+def reconcile_payments(since=None, until=None, workers=RECONCILE_WORKERS, page_size=RECONCILE_PAGE_SIZE, on_mismatch=None):
+    """
+    Applies every succeeded PaymentIntent created between `since` and `until`
+    that our database doesn't reflect yet. Without `since` it carries on from
+    the watermark, and only a run without `since` moves the watermark.
+    `on_mismatch(intent_id, reason)` is called for each intent that can't be
+    matched. Returns a dict of counts.
+    """
+    # Stripe filters on whole seconds, so round the window out to them
+    until = until or (timezone.now() + timedelta(seconds=1)).replace(microsecond=0)
+    watermark = None
+    if since is None:
+        watermark, _ = Watermark.objects.get_or_create(name=WATERMARK_NAME)
+        since = watermark.value - WATERMARK_OVERLAP if watermark.value else until - FIRST_RUN_LOOKBACK
+    since = since.replace(microsecond=0)
+
+    results = {'succeeded': 0, 'fees_paid': 0, 'cards_issued': 0, 'mismatches': 0}
+    window = list(slices(since, until))
+    for start in range(0, len(window), workers):
+        batch = window[start:start + workers]
+        intents = asyncio.run(fetch_succeeded(batch, workers, page_size))
+        payments, mismatches = match_payments(intents)
+        fees_paid, cards_issued = apply_payments(payments)
+
+        results['succeeded'] += len(intents)
+        results['fees_paid'] += fees_paid
+        results['cards_issued'] += cards_issued
+        results['mismatches'] += len(mismatches)
+        for intent_id, reason in mismatches:
+            if on_mismatch:
+                on_mismatch(intent_id, reason)
+
+        if watermark is not None:
+            watermark.value = batch[-1][1]
+            watermark.save(update_fields=['value', 'updated_at'])
+
+    return results
@@ -0,0 +1,42 @@
+# api/renderers.py
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The JSON renderer every API response goes through (see REST_FRAMEWORK in
+# settings). With orjson installed the body is encoded in C, several times
+# faster than json.dumps and its per-object default() calls; without it this
+# is DRF's own JSONRenderer. Either way the bytes are the same: compact
+# separators, UTF-8, "Z" for UTC datetimes, and U+2028/U+2029 escaped.
+#
+# Anything orjson can't encode natively (Decimal, lazy strings, generators)
+# goes through DRF's encoder, and a body orjson refuses outright (an integer
+# wider than 64 bits, say) is rendered the slow way.
+
+LINE_SEPARATORS = (b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None or data is None or self.ensure_ascii or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(
+                data, default=self.encoder_class().default,
+                option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        if LINE_SEPARATORS[0] in ret or LINE_SEPARATORS[1] in ret:
+            ret = ret.replace(LINE_SEPARATORS[0], b'\\u2028').replace(LINE_SEPARATORS[1], b'\\u2029')
+        return ret
@@ -0,0 +1,125 @@
+# api/replica.py
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Reads can go to a read-only replica of the database (DATABASE_REPLICA_URL,
+# added to DATABASES as 'replica'). Nothing goes there unless asked for:
+# views opt in with ReplicaReadsMixin, commands and scripts with
+# reading_from_replica(). Everything else, and every write, uses the primary.
+#
+# A replica lags a little behind the primary, so once a request has written,
+# the rest of it reads from the primary, and the user it was made for is
+# pinned to the primary for DATABASE_REPLICA_PIN_SECONDS so they see their
+# own writes on the next few requests too. The pin is kept in the cache every
+# process shares (CACHE_URL in settings): the request that reads is usually
+# served by another worker than the one that wrote, and a payment is applied
+# by process_webhook_events.
+
+REPLICA = 'replica'
+PIN_KEY = 'api:primary-pin:{}'
+
+
+class RoutingScope:
+    """
+    Where reads go for one request (or one reading_from_replica() block).
+    """
+
+    def __init__(self):
+        self.replica = False
+        self.wrote = False
+
+
+current_scope = ContextVar('current_scope', default=None)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def routing_scope():
+    scope = RoutingScope()
+    token = current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        current_scope.reset(token)
+
+
+@contextmanager
+def reading_from_replica():
+    """
+    Sends reads in this block to the replica, until something in it writes.
+    For reporting commands and scripts; views use ReplicaReadsMixin.
+    """
+    with routing_scope() as scope:
+        scope.replica = True
+        yield scope
+
+
+def pin_to_primary(user_ids):
+    """
+    Keeps these users' reads on the primary for a little while, e.g. after
+    applying a payment they are about to look at.
+    """
+    if replica_configured():
+        cache.set_many({PIN_KEY.format(pk): True for pk in user_ids}, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def pinned_to_primary(user):
+    return bool(user and user.is_authenticated) and cache.get(PIN_KEY.format(user.pk)) is not None
+
+
+def read_from_replica(user):
+    """
+    Sends the rest of the current request's reads to the replica, unless
+    `user` wrote recently. Does nothing without a replica.
+    """
+    scope = current_scope.get()
+    if scope is not None and not pinned_to_primary(user):
+        scope.replica = True
+
+
+class ReplicaReadsMixin:
+    """
+    For read-only APIViews. The user is authenticated against the primary,
+    then the view's reads (including a streamed body) go to the replica.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        read_from_replica(request.user)
+
+
+# The model behind DatabaseCache (CACHE_URL=db://). The cache always uses the
+# primary, and its writes don't count as the request writing.
+CACHE_APP_LABEL = 'django_cache'
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        scope = current_scope.get()
+        if scope is not None and scope.replica and not scope.wrote and replica_configured():
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        scope = current_scope.get()
+        if scope is not None and model._meta.app_label != CACHE_APP_LABEL:
+            scope.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary by replication
+        return db == DEFAULT_DB_ALIAS
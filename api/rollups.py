@@ -0,0 +1,321 @@
+# api/rollups.py
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.utils import timezone
+from .archive import archived_months, attendance_rows
+from .models import AttendanceLog, AttendanceLogDeletion, DailyAttendanceRollup, MonthlyMemberAttendance, User, Watermark
+
+WATERMARK_NAME = 'attendance_rollups'
+
+# Re-read this much before the watermark on each run. A transaction that
+# started before the last run but committed after it would otherwise have its
+# changes skipped, because its updated_at is older than the watermark.
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+session_length = ExpressionWrapper(F('exit_time') - F('entry_time'), output_field=DurationField())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def seconds(duration):
+    return int(duration.total_seconds()) if duration else 0
+
+
+def archived_rollups(month, days, also=()):
+    """
+    The daily rollups for `days` and the monthly rollups of everyone who
+    played on them (and of the players in `also`), for a month that has been
+    (partly) archived. Those rows are no longer all in the database, so
+    they're added up here instead. Returns (daily rows, players, monthly rows).
+    """
+    rows = attendance_rows(month, next_month(month) - timedelta(days=1))
+    types = dict(User.objects.filter(pk__in={row['player_id'] for row in rows}).values_list('pk', 'membership_type'))
+    # Deleting a member deletes their live logs, so their archived visits
+    # don't count either (and a monthly row would have no one to point at)
+    rows = [row for row in rows if row['player_id'] in types]
+    dirty = set(days)
+
+    by_day = {}
+    players = set(also)
+    for row in rows:
+        if row['date_of_play'] not in dirty:
+            continue
+        players.add(row['player_id'])
+        entry = by_day.setdefault((row['date_of_play'], types[row['player_id']]), {
+            'visits': 0, 'players': set(), 'closed': 0, 'session': timedelta(), 'consumed': 0,
+        })
+        entry['visits'] += 1
+        entry['players'].add(row['player_id'])
+        if row['exit_time']:
+            entry['closed'] += 1
+            entry['session'] += row['exit_time'] - row['entry_time']
+        entry['consumed'] += row['daily_session_consumed']
+
+    by_player = {}
+    for row in rows:
+        if row['player_id'] not in players:
+            continue
+        entry = by_player.setdefault(row['player_id'], {
+            'visits': 0, 'days': set(), 'closed': 0, 'session': timedelta(), 'consumed': 0,
+        })
+        entry['visits'] += 1
+        entry['days'].add(row['date_of_play'])
+        if row['exit_time']:
+            entry['closed'] += 1
+            entry['session'] += row['exit_time'] - row['entry_time']
+        entry['consumed'] += row['daily_session_consumed']
+
+    daily = [
+        DailyAttendanceRollup(
+            date=day,
+            membership_type=membership_type,
+            visits=entry['visits'],
+            unique_players=len(entry['players']),
+            closed_visits=entry['closed'],
+            total_session_seconds=seconds(entry['session']),
+            sessions_consumed=entry['consumed'],
+        )
+        for (day, membership_type), entry in by_day.items()
+    ]
+    monthly = [
+        MonthlyMemberAttendance(
+            player_id=player_id,
+            month=month,
+            visits=entry['visits'],
+            days_played=len(entry['days']),
+            closed_visits=entry['closed'],
+            total_session_seconds=seconds(entry['session']),
+            sessions_consumed=entry['consumed'],
+        )
+        for player_id, entry in by_player.items()
+    ]
+    return daily, players, monthly
+
+
+def refresh_days(days, deleted=()):
+    """
+    Recomputes the daily rollups for the given dates, and the monthly rollups
+    of every member who played on them. `deleted` is (date, player id) pairs
+    of logs deleted since, whose members are recounted too even if they have
+    nothing left on those days. Returns the number of days refreshed.
+    """
+    gone = {}
+    for day, player_id in deleted:
+        gone.setdefault(month_start(day), set()).add(player_id)
+    days = sorted(set(days) | {day for day, _ in deleted})
+    if not days:
+        return 0
+
+    # Months archive_attendance has moved out of the database are added up
+    # from the archive (see archived_rollups()), the rest in the database
+    archived = set(archived_months())
+    live_days = [day for day in days if month_start(day) not in archived]
+    logs = AttendanceLog.objects.filter(date_of_play__in=live_days)
+
+    daily_rows = (
+        logs.values('date_of_play', 'player__membership_type')
+        .annotate(
+            visits=Count('pk'),
+            unique_players=Count('player', distinct=True),
+            closed_visits=Count('exit_time'),
+            total_session=Sum(session_length),
+            sessions_consumed=Count('pk', filter=Q(daily_session_consumed=True)),
+        )
+        .order_by()
+    )
+    daily = [
+        DailyAttendanceRollup(
+            date=row['date_of_play'],
+            membership_type=row['player__membership_type'],
+            visits=row['visits'],
+            unique_players=row['unique_players'],
+            closed_visits=row['closed_visits'],
+            total_session_seconds=seconds(row['total_session']),
+            sessions_consumed=row['sessions_consumed'],
+        )
+        for row in daily_rows
+    ]
+
+    # The monthly rows only change for members who played on a dirty day
+    months = sorted({month_start(day) for day in live_days})
+    monthly = []
+    for month in months:
+        played = logs.filter(date_of_play__gte=month, date_of_play__lt=next_month(month)).values('player')
+        players = Q(player__in=played) | Q(player__in=gone.get(month, ()))
+        member_rows = (
+            AttendanceLog.objects
+            .filter(players, date_of_play__gte=month, date_of_play__lt=next_month(month))
+            .values('player')
+            .annotate(
+                visits=Count('pk'),
+                days_played=Count('date_of_play', distinct=True),
+                closed_visits=Count('exit_time'),
+                total_session=Sum(session_length),
+                sessions_consumed=Count('pk', filter=Q(daily_session_consumed=True)),
+            )
+            .order_by()
+        )
+        monthly.append((month, players, [
+            MonthlyMemberAttendance(
+                player_id=row['player'],
+                month=month,
+                visits=row['visits'],
+                days_played=row['days_played'],
+                closed_visits=row['closed_visits'],
+                total_session_seconds=seconds(row['total_session']),
+                sessions_consumed=row['sessions_consumed'],
+            )
+            for row in member_rows
+        ]))
+
+    for month in sorted({month_start(day) for day in days} & archived):
+        month_daily, players, rows = archived_rollups(month, [day for day in days if month_start(day) == month],
+                                                      also=gone.get(month, ()))
+        daily.extend(month_daily)
+        monthly.append((month, Q(player__in=players), rows))
+
+    with transaction.atomic():
+        DailyAttendanceRollup.objects.filter(date__in=days).delete()
+        DailyAttendanceRollup.objects.bulk_create(daily)
+        for month, players, rows in monthly:
+            MonthlyMemberAttendance.objects.filter(players, month=month).delete()
+            MonthlyMemberAttendance.objects.bulk_create(rows)
+
+    return len(days)
+
+
+def delete_attendance_logs(logs):
+    """
+    Deletes a queryset of logs, first noting each (day, member) it touches in
+    AttendanceLogDeletion so refresh_dirty_days() recounts them. That's one
+    read and one insert however many logs go, and the delete itself stays a
+    single statement. Returns the number of logs deleted.
+    """
+    with transaction.atomic():
+        record_deleted_logs(logs)
+        return logs.delete()[0]
+
+
+def record_deleted_logs(logs):
+    pairs = logs.values_list('date_of_play', 'player_id').distinct().order_by()
+    AttendanceLogDeletion.objects.bulk_create(
+        AttendanceLogDeletion(date_of_play=day, player_id=player_id) for day, player_id in pairs
+    )
+
+
+def refresh_dirty_days():
+    """
+    Finds the days whose logs changed since the last run (by updated_at, and
+    AttendanceLogDeletion for deleted ones) and refreshes just those. The
+    first run rebuilds everything. Returns the number of days refreshed.
+    """
+    watermark, _ = Watermark.objects.get_or_create(name=WATERMARK_NAME)
+    high = timezone.now()
+
+    changed = AttendanceLog.objects.filter(updated_at__lte=high)
+    deleted = AttendanceLogDeletion.objects.filter(deleted_at__lte=high)
+    if watermark.value is not None:
+        changed = changed.filter(updated_at__gt=watermark.value - WATERMARK_OVERLAP)
+        deleted = deleted.filter(deleted_at__gt=watermark.value - WATERMARK_OVERLAP)
+    days = changed.values_list('date_of_play', flat=True).distinct().order_by()
+    deleted = deleted.values_list('date_of_play', 'player_id').distinct().order_by()
+
+    refreshed = refresh_days(list(days), list(deleted))
+
+    watermark.value = high
+    watermark.save(update_fields=['value', 'updated_at'])
+    # Deletions no later run will look at again
+    AttendanceLogDeletion.objects.filter(deleted_at__lte=high - WATERMARK_OVERLAP).delete()
+    return refreshed
+
+
+def refresh_range(since, until):
+    """
+    Rebuilds every day between since and until (inclusive), e.g. after a backfill.
+    """
+    days = [since + timedelta(days=n) for n in range((until - since).days + 1)]
+    with transaction.atomic():
+        # Clear out days that no longer have any logs at all
+        DailyAttendanceRollup.objects.filter(date__gte=since, date__lte=until).delete()
+        return refresh_days(days)
+
+
+def daily_report(start, end):
+    """
+    Reads a date range straight from the rollups, one row per day with a
+    breakdown per membership type.
+    """
+    days = {}
+    rows = (
+        DailyAttendanceRollup.objects
+        .filter(date__gte=start, date__lte=end)
+        .order_by('date', 'membership_type')
+        .values_list('date', 'membership_type', 'visits', 'unique_players',
+                     'closed_visits', 'total_session_seconds', 'sessions_consumed')
+    )
+    for day, membership_type, visits, unique_players, closed, total_seconds, consumed in rows:
+        entry = days.setdefault(day, {
+            'date': day,
+            'visits': 0,
+            'unique_players': 0,
+            'closed_visits': 0,
+            'total_session_seconds': 0,
+            'sessions_consumed': 0,
+            'by_membership_type': {},
+        })
+        entry['visits'] += visits
+        entry['unique_players'] += unique_players
+        entry['closed_visits'] += closed
+        entry['total_session_seconds'] += total_seconds
+        entry['sessions_consumed'] += consumed
+        entry['by_membership_type'][membership_type] = {
+            'visits': visits,
+            'unique_players': unique_players,
+            'average_session_minutes': average_minutes(total_seconds, closed),
+            'sessions_consumed': consumed,
+        }
+
+    report = []
+    for entry in days.values():
+        entry['average_session_minutes'] = average_minutes(entry.pop('total_session_seconds'), entry.pop('closed_visits'))
+        report.append(entry)
+    return report
+
+
+def average_minutes(total_seconds, closed_visits):
+    return round(total_seconds / closed_visits / 60, 1) if closed_visits else None
+
+
+def member_month_report(month):
+    """
+    Every member's totals for one month, busiest first.
+    """
+    rows = (
+        MonthlyMemberAttendance.objects
+        .filter(month=month_start(month))
+        .order_by('-visits', 'player_id')
+        .values('player_id', 'player__email', 'player__first_name', 'player__last_name',
+                'visits', 'days_played', 'closed_visits', 'total_session_seconds', 'sessions_consumed')
+    )
+    return [
+        {
+            'player_id': row['player_id'],
+            'email': row['player__email'],
+            'first_name': row['player__first_name'],
+            'last_name': row['player__last_name'],
+            'visits': row['visits'],
+            'days_played': row['days_played'],
+            'average_session_minutes': average_minutes(row['total_session_seconds'], row['closed_visits']),
+            'sessions_consumed': row['sessions_consumed'],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,160 @@
+# api/seasons.py
+
+import bisect
+import threading
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import Season
+
+# The season table is tiny and almost never changes, but the "which season are
+# we in today?" question is asked on every eligibility check, payment intent
+# and webhook. So we keep all the season date ranges in memory, sorted by
+# start date, and only reload them from the database when a Season is saved
+# or deleted (see api/signals.py).
+#
+# The cache every process shares (CACHE_URL in settings) holds a copy of the
+# rows plus a version token, so a season saved in one gunicorn worker or a
+# command is seen by the others on their next lookup, and when one worker
+# reloads, the others can pick up the new rows without going to the database
+# themselves. The token is random rather than a
+# counter so an evicted key can never come back with a value we've seen before.
+
+CACHE_KEY_ROWS = 'api:seasons:rows'
+CACHE_KEY_VERSION = 'api:seasons:version'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class SeasonIndex:
+    """
+    A sorted interval index over the seasons' (start_date, end_date) ranges.
+    """
+
+    def __init__(self, seasons):
+        # Sort by start date, then by pk so that overlapping seasons come out
+        # in the same order as an unordered queryset's .first() would give us
+        self.seasons = sorted(seasons, key=lambda s: (s.start_date, s.pk))
+        self.starts = [s.start_date for s in self.seasons]
+
+        # max_ends[i] is the latest end_date among seasons[0..i]. It lets us
+        # stop scanning backwards as soon as nothing earlier can cover the date.
+        self.max_ends = []
+        latest = None
+        for season in self.seasons:
+            if latest is None or season.end_date > latest:
+                latest = season.end_date
+            self.max_ends.append(latest)
+
+    def covering(self, day):
+        """
+        Returns every season whose range includes `day`, ordered by pk.
+        """
+        matches = []
+        i = bisect.bisect_right(self.starts, day) - 1
+        while i >= 0 and self.max_ends[i] >= day:
+            if self.seasons[i].end_date >= day:
+                matches.append(self.seasons[i])
+            i -= 1
+        matches.sort(key=lambda s: s.pk)
+        return matches
+
+
+class SeasonResolver:
+    """
+    Answers "what is the current season?" from the in-process index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+
+    def _load_index(self):
+        version = cache.get(CACHE_KEY_VERSION)
+        index = self._index
+        if index is not None and version is not None and version == self._version:
+            return index
+
+        with self._lock:
+            if self._index is not None and version is not None and version == self._version:
+                return self._index
+
+            if version is None:
+                cache.add(CACHE_KEY_VERSION, uuid.uuid4().hex, CACHE_TIMEOUT)
+                version = cache.get(CACHE_KEY_VERSION)
+
+            cached = cache.get(CACHE_KEY_ROWS)
+            if cached is not None and cached[0] == version:
+                rows = cached[1]
+            else:
+                rows = list(Season.objects.all())
+                cache.set(CACHE_KEY_ROWS, (version, rows), CACHE_TIMEOUT)
+
+            index = SeasonIndex(rows)
+            # The token of the rows it was built from, for callers that need both
+            index.version = version
+            self._index = index
+            self._version = version
+            return index
+
+    def version(self):
+        """
+        The token of the season rows the index was built from. It changes
+        whenever a season is saved or deleted.
+        """
+        return self._load_index().version
+
+    def _covering(self, day):
+        if day is None:
+            day = timezone.now().date()
+        index = self._load_index()
+        return index.covering(day), index.version
+
+    def active_seasons(self, day=None):
+        return self._covering(day)[0]
+
+    def first(self, day=None):
+        """
+        Same result as Season.objects.filter(start_date__lte=day, end_date__gte=day).first()
+        """
+        seasons = self.active_seasons(day)
+        return seasons[0] if seasons else None
+
+    def get(self, day=None, with_version=False):
+        """
+        Same result as Season.objects.get(start_date__lte=day, end_date__gte=day),
+        including raising DoesNotExist / MultipleObjectsReturned. With
+        with_version=True, returns (season, version()) from the same lookup.
+        """
+        seasons, version = self._covering(day)
+        if not seasons:
+            raise Season.DoesNotExist("Season matching query does not exist.")
+        if len(seasons) > 1:
+            raise Season.MultipleObjectsReturned(
+                f"get() returned more than one Season -- it returned {len(seasons)}!"
+            )
+        return (seasons[0], version) if with_version else seasons[0]
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._version = None
+        cache.set(CACHE_KEY_VERSION, uuid.uuid4().hex, CACHE_TIMEOUT)
+        cache.delete(CACHE_KEY_ROWS)
+
+
+season_resolver = SeasonResolver()
+
+
+def get_current_season(day=None):
+    return season_resolver.first(day)
+
+
+def invalidate_season_cache():
+    # Drop the index right away, and again once the transaction commits, so
+    # that a request which rebuilt it from uncommitted data in between doesn't
+    # leave stale rows behind.
+    season_resolver.invalidate()
+    transaction.on_commit(season_resolver.invalidate)
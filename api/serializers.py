@@ -1,7 +1,13 @@
 # api/serializers.py
 
-from rest_framework import serializers
-from .models import User
+from datetime import date
+
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .models import User, Season
+from .attendance import CHECK_IN, CHECK_OUT
+from .history import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, decode_cursor
 
 # This serializer will handle creating a new user
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -34,12 +40,141 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
             last_name=validated_data['last_name'],
             phone=validated_data['phone'],
             dob=dob, # Use the safely retrieved dob value
-            password=validated_data['password']
+            password=validated_data['password'],
+            # Passed to save() by a view that hashed the password already
+            password_hash=validated_data.get('password_hash')
         )
         return user
 
+# This serializer checks one row of a member import (see api/imports.py)
+class MemberImportSerializer(UserRegistrationSerializer):
+    """
+    The same rules as UserRegistrationSerializer, except that the email may
+    already belong to a member (the import updates them), password2 may be
+    left out, and with require_password=False in the context (invites) no
+    password is needed at all.
+    """
+    password = serializers.CharField(write_only=True, required=False)
+    password2 = serializers.CharField(write_only=True, required=False, label='Confirm password')
+
+    class Meta(UserRegistrationSerializer.Meta):
+        extra_kwargs = dict(UserRegistrationSerializer.Meta.extra_kwargs, email={'validators': []})
+
+    def validate(self, attrs):
+        if self.context.get('require_password', True):
+            if not attrs.get('password'):
+                raise serializers.ValidationError({"password": "This field is required."})
+            attrs.setdefault('password2', attrs['password'])
+            attrs = super().validate(attrs)
+        attrs.pop('password2', None)
+        return attrs
+
 # This serializer will return user data after a successful login
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'first_name', 'last_name', 'email', 'phone', 'dob', 'membership_type', 'is_active_annual_member', 'annual_membership_expiry_date')
+
+# This compiles a read-only serializer for the hot paths (login, signup, profile)
+class CompiledSerializer:
+    """
+    Builds the same dict as `serializer_class(obj).data`, from a model
+    instance or a values() row. The serializer's fields are looked at once,
+    here, and each becomes a (name, source, convert) step; the common field
+    types convert with a plain builtin, anything else with the field's own
+    to_representation(). Sources must be plain attributes, not dotted
+    paths or '*'.
+    """
+    CONVERTERS = {
+        serializers.IntegerField: int,
+        serializers.CharField: str,
+        serializers.EmailField: str,
+        serializers.ChoiceField: str,
+        serializers.BooleanField: bool,
+    }
+
+    def __init__(self, serializer_class):
+        self.steps = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if '.' in field.source or field.source == '*':
+                raise ValueError(f"{serializer_class.__name__}.{name} has a source CompiledSerializer can't follow.")
+            convert = self.CONVERTERS.get(type(field), field.to_representation)
+            if type(field) is serializers.DateField and getattr(field, 'format', api_settings.DATE_FORMAT) == ISO_8601:
+                convert = date.isoformat
+            self.steps.append((name, field.source, convert))
+        # What to pass to values() for rows this can serialize
+        self.fields = tuple(source for _, source, _ in self.steps)
+
+    def __call__(self, obj):
+        get = obj.__getitem__ if isinstance(obj, dict) else obj.__getattribute__
+        data = {}
+        for name, source, convert in self.steps:
+            value = get(source)
+            data[name] = None if value is None else convert(value)
+        return data
+
+user_payload = CompiledSerializer(UserSerializer)
+
+# This serializer checks the body of a bulk fixture eligibility request
+class BulkEligibilityRequestSerializer(serializers.Serializer):
+    player_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=1000)
+    season = serializers.PrimaryKeyRelatedField(queryset=Season.objects.all(), required=False)
+
+    def validate(self, attrs):
+        if 'player_ids' not in attrs and 'season' not in attrs:
+            raise serializers.ValidationError("Provide a list of player_ids or a season to check.")
+        return attrs
+
+# These serializers check the events sent by the door scanners
+class ScanSerializer(serializers.Serializer):
+    player_id = serializers.IntegerField(required=False, min_value=1)
+    card_id = serializers.UUIDField(required=False)
+    timestamp = serializers.DateTimeField(required=False, default=timezone.now)
+
+    def validate(self, attrs):
+        if 'player_id' not in attrs and 'card_id' not in attrs:
+            raise serializers.ValidationError("Provide either a player_id or a card_id.")
+        return attrs
+
+class ScanEventSerializer(ScanSerializer):
+    kind = serializers.ChoiceField(choices=[CHECK_IN, CHECK_OUT])
+
+class ScanBatchSerializer(serializers.Serializer):
+    events = ScanEventSerializer(many=True, allow_empty=False, max_length=5000)
+
+# These serializers check the query parameters of the attendance reports
+class ReportRangeSerializer(serializers.Serializer):
+    start = serializers.DateField()
+    end = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError("start must not be after end.")
+        if (attrs['end'] - attrs['start']).days > 366:
+            raise serializers.ValidationError("Reports cover at most a year at a time.")
+        return attrs
+
+class ReportMonthSerializer(serializers.Serializer):
+    month = serializers.DateField(input_formats=['%Y-%m'])
+
+# This serializer checks the query parameters of a player history page
+class PlayerHistorySerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=HISTORY_MAX_PAGE_SIZE, default=HISTORY_PAGE_SIZE)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value)
+        except ValueError:
+            raise serializers.ValidationError("Invalid cursor.")
+
+# This serializer checks the query parameters of a data export
+class ExportRequestSerializer(serializers.Serializer):
+    # Not called "format", because DRF uses ?format= to pick a renderer
+    file_format = serializers.ChoiceField(choices=['csv', 'jsonl'], default='csv')
+    gzip = serializers.BooleanField(default=False)
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    season = serializers.PrimaryKeyRelatedField(queryset=Season.objects.all(), required=False)
@@ -1,11 +1,10 @@
 # api/services.py
-    
-import stripe
-from django.conf import settings
-from django.utils import timezone
-from .models import Season
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from .models import StripePaymentIntent
+from .seasons import get_current_season
+from .stripe_client import get_stripe_client, stripe_slot
 
 def get_payment_amount_and_description(payment_type: str):
     """
@@ -14,37 +13,107 @@ def get_payment_amount_and_description(payment_type: str):
     """
     amount = 0
     description = ""
-    
+
     if payment_type == 'fixture_fee':
-        today = timezone.now().date()
-        current_season = Season.objects.filter(start_date__lte=today, end_date__gte=today).first()
+        current_season = get_current_season()
         if current_season:
             amount = int(current_season.fixture_fee_amount * 100)
-            description = f"Payment for {current_season.name}"
-            
+            # The webhook recognises fixture fee payments by this wording
+            description = f"Fixture Fee payment for {current_season.name}"
+
     elif payment_type == 'social_card_purchase':
         amount = 5000  # Placeholder for $50.00
         description = "Purchase of 10-Session Social Card"
-        
+
     return amount, description
 
-def create_stripe_payment_intent(payment_type: str, user):
+def get_payment_season(payment_type: str):
+    """
+    The season a payment belongs to, or None for payments that aren't tied to one.
+    """
+    if payment_type == 'fixture_fee':
+        return get_current_season()
+    return None
+
+def build_idempotency_key(user, payment_type, season, amount, generation):
+    """
+    A deterministic Stripe idempotency key. Two requests for the same payment
+    at the same time produce the same key, so Stripe hands both of them the
+    same PaymentIntent. `generation` moves on once an earlier intent for the
+    same payment is finished, so buying a second social card gets a new one.
+    """
+    season_part = season.pk if season else 0
+    return f"gctta-pi-{user.pk}-{payment_type}-{season_part}-{amount}-{generation}"
+
+def get_payment_details(payment_type: str):
     """
-    Creates a Stripe Payment Intent and returns its client_secret.
+    (amount in cents, description, season) for a payment type.
     """
-    amount_in_cents, description = get_payment_amount_and_description(payment_type)
-    
+    amount, description = get_payment_amount_and_description(payment_type)
+    return amount, description, get_payment_season(payment_type)
+
+async def acreate_stripe_payment_intent(payment_type: str, user):
+    """
+    Returns the client_secret of an open PaymentIntent for this payment,
+    creating a new one on Stripe only if there isn't one already.
+
+    Async, so a worker can wait on many Stripe calls at once: the lookups go
+    through the async ORM and the Stripe call is awaited on the event loop,
+    inside a stripe_slot() so only so many are in flight at once.
+    """
+    # The season index may need reloading, which is sync code
+    amount_in_cents, description, season = await sync_to_async(get_payment_details)(payment_type)
+
     if amount_in_cents <= 0:
         raise ValueError("Could not determine payment amount for the specified type.")
 
+    existing = StripePaymentIntent.objects.filter(user=user, payment_type=payment_type, season=season)
+
+    open_intent = await (
+        existing
+        .filter(status__in=StripePaymentIntent.OPEN_STATUSES, amount=amount_in_cents)
+        .order_by('-pk')
+        .only('client_secret')
+        .afirst()
+    )
+    if open_intent:
+        return open_intent.client_secret
+
+    idempotency_key = build_idempotency_key(user, payment_type, season, amount_in_cents, await existing.acount())
+    async with stripe_slot():
+        payment_intent = await get_stripe_client().payment_intents.create_async(
+            params={
+                'amount': amount_in_cents,
+                'currency': 'aud',
+                'automatic_payment_methods': {'enabled': True},
+                'receipt_email': user.email,
+                'description': description,
+                'metadata': {
+                    'user_id': str(user.pk),
+                    'payment_type': payment_type,
+                    'season_id': str(season.pk) if season else '',
+                },
+            },
+            options={'idempotency_key': idempotency_key}
+        )
+
     try:
-        payment_intent = stripe.PaymentIntent.create(
-            amount=amount_in_cents,
-            currency='aud',
-            automatic_payment_methods={'enabled': True},
-            receipt_email=user.email,
-            description=description
+        # update_or_create() runs in a transaction of its own
+        await StripePaymentIntent.objects.aupdate_or_create(
+            stripe_payment_intent_id=payment_intent.id,
+            defaults={
+                'user': user,
+                'payment_type': payment_type,
+                'season': season,
+                'idempotency_key': idempotency_key,
+                'client_secret': payment_intent.client_secret,
+                'amount': amount_in_cents,
+                'description': description,
+                'status': payment_intent.status,
+            }
         )
-        return payment_intent.client_secret
-    except Exception as e:
-        raise e
\ No newline at end of file
+    except IntegrityError:
+        # A concurrent request with the same key already saved this intent
+        pass
+
+    return payment_intent.client_secret
@@ -0,0 +1,48 @@
+# api/signals.py
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .authentication import invalidate_user
+from .conditional import invalidate_fees
+from .metrics import record_query
+from .models import AttendanceLog, AttendanceLogDeletion, PlayerSeasonFee, Season, User
+from .rollups import record_deleted_logs
+from .seasons import invalidate_season_cache
+
+
+# Any change to a season means the cached season index is out of date
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def season_changed(sender, **kwargs):
+    invalidate_season_cache()
+
+
+# Any change to a user means cached copies of them are out of date
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+# Responses built from a member's fees (e.g. their eligibility) are out of date
+@receiver(post_save, sender=PlayerSeasonFee)
+@receiver(post_delete, sender=PlayerSeasonFee)
+def fee_changed(sender, instance, **kwargs):
+    invalidate_fees(instance.player_id)
+
+
+# Deleting a member deletes their logs too, so note their days for the
+# rollups (see api/rollups.py) in one insert. There's deliberately no receiver
+# on AttendanceLog itself: one would stop its deletes being a single statement
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    record_deleted_logs(AttendanceLog.objects.filter(player=instance))
+
+
+# Count every query towards the current request's metrics (a reconnect keeps
+# the wrapper list, so only add it once)
+@receiver(connection_created)
+def install_query_metrics(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
@@ -0,0 +1,152 @@
+# api/stripe_client.py
+
+import asyncio
+import threading
+import weakref
+from contextlib import asynccontextmanager
+
+import requests
+import stripe
+from django.conf import settings
+from .metrics import stripe_timer
+
+# One Stripe client per process. It keeps a pooled HTTP session open so each
+# API call reuses a warm TLS connection instead of doing a fresh handshake,
+# and every call is bounded by STRIPE_TIMEOUT so a slow Stripe can't hold a
+# worker forever.
+#
+# Async code (the async views) calls the *_async methods instead, which go
+# out through an httpx client on the event loop, so waiting on Stripe
+# doesn't hold a thread. An httpx client's connections belong to the loop
+# that opened them, and under WSGI (or asyncio.run() in a command) every call
+# gets a fresh loop, so async code gets a client of its own per event loop
+# rather than the process's one. At most STRIPE_ASYNC_CONCURRENCY of those calls are
+# in flight per event loop; the rest wait up to STRIPE_QUEUE_TIMEOUT for a
+# turn and then fail with StripeBusy rather than piling up.
+
+_client = None
+_client_lock = threading.Lock()
+
+# event loop -> (Stripe client, its httpx client)
+_loop_clients = weakref.WeakKeyDictionary()
+
+
+class TimedRequestsClient(stripe.RequestsClient):
+    # Every HTTP round trip to Stripe (retries included) is added to the
+    # current request's Stripe time, see api/middleware.py
+    def request(self, *args, **kwargs):
+        with stripe_timer():
+            return super().request(*args, **kwargs)
+
+
+class TimedHTTPXClient(stripe.HTTPXClient):
+    async def request_async(self, *args, **kwargs):
+        with stripe_timer():
+            return await super().request_async(*args, **kwargs)
+
+
+def _pooled_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.STRIPE_HTTP_POOL_SIZE
+    )
+    session.mount('https://', adapter)
+    return session
+
+
+def build_stripe_client():
+    if settings.STRIPE_CLIENT == 'stub':
+        from .stripe_stub import StubStripeClient
+        return StubStripeClient()
+
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=TimedRequestsClient(
+            timeout=settings.STRIPE_TIMEOUT,
+            session=_pooled_session()
+        ),
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES
+    )
+
+
+def build_async_stripe_client():
+    http_client = TimedHTTPXClient(timeout=settings.STRIPE_TIMEOUT)
+    client = stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES
+    )
+    return client, http_client
+
+
+def get_stripe_client():
+    """
+    The Stripe client for the caller: the process's one in sync code, the
+    running event loop's one in async code. The offline stub is shared by both.
+    """
+    if settings.STRIPE_CLIENT != 'stub':
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not None:
+            if loop not in _loop_clients:
+                _loop_clients[loop] = build_async_stripe_client()
+            return _loop_clients[loop][0]
+
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = build_stripe_client()
+    return _client
+
+
+async def aclose_stripe_client():
+    """
+    Closes the running event loop's Stripe connections. Code that runs its
+    own loop (asyncio.run() in a command) calls this before the loop ends.
+    """
+    entry = _loop_clients.pop(asyncio.get_running_loop(), None)
+    if entry is not None:
+        await entry[1].close_async()
+
+
+def reset_stripe_client():
+    # Used by tests, and after changing the STRIPE_* settings at runtime
+    global _client
+    with _client_lock:
+        _client = None
+    _loop_clients.clear()
+
+
+class StripeBusy(Exception):
+    """
+    Too many Stripe calls were already in flight for too long.
+    """
+
+
+# One semaphore per event loop: an asyncio.Semaphore can't be shared between loops
+_slots = weakref.WeakKeyDictionary()
+
+
+@asynccontextmanager
+async def stripe_slot():
+    """
+    Waits for one of the STRIPE_ASYNC_CONCURRENCY slots for a Stripe call.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _slots.get(loop)
+    if semaphore is None:
+        semaphore = _slots[loop] = asyncio.Semaphore(settings.STRIPE_ASYNC_CONCURRENCY)
+
+    try:
+        async with asyncio.timeout(settings.STRIPE_QUEUE_TIMEOUT):
+            await semaphore.acquire()
+    except TimeoutError:
+        raise StripeBusy(f"No Stripe slot free after {settings.STRIPE_QUEUE_TIMEOUT}s.")
+    try:
+        yield
+    finally:
+        semaphore.release()
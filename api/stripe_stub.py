@@ -0,0 +1,146 @@
+# api/stripe_stub.py
+
+import asyncio
+import itertools
+import threading
+import time
+
+import stripe
+
+from .metrics import stripe_timer
+
+# An in-memory stand-in for the parts of stripe.StripeClient we use, so the
+# payment code can run offline in tests and benchmarks. Select it with
+# STRIPE_CLIENT=stub. It honours idempotency keys the same way Stripe does:
+# the same key always gives back the same PaymentIntent. Like the real
+# client, every method has an *_async twin.
+
+
+class StubPaymentIntentService:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.intents = {}
+        self.by_idempotency_key = {}
+        self.create_calls = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # Calls waiting on the "network" right now, and the most there have been
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _track(self, change):
+        with self._lock:
+            self.in_flight += change
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _wait(self):
+        # Stands in for the round trip, so it's timed like one
+        with stripe_timer():
+            self._track(1)
+            try:
+                if self.latency:
+                    time.sleep(self.latency)
+            finally:
+                self._track(-1)
+
+    async def _wait_async(self):
+        with stripe_timer():
+            self._track(1)
+            try:
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+            finally:
+                self._track(-1)
+
+    def _construct(self, values):
+        return stripe.PaymentIntent.construct_from(values, 'sk_stub')
+
+    def create(self, params, options=None):
+        self._wait()
+        return self._create(params, options)
+
+    async def create_async(self, params, options=None):
+        await self._wait_async()
+        return self._create(params, options)
+
+    def _create(self, params, options):
+        key = (options or {}).get('idempotency_key')
+        with self._lock:
+            self.create_calls += 1
+            if key and key in self.by_idempotency_key:
+                return self._construct(self.intents[self.by_idempotency_key[key]])
+
+            number = next(self._ids)
+            intent_id = f"pi_stub_{number}"
+            values = {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': params['amount'],
+                'currency': params['currency'],
+                'client_secret': f"{intent_id}_secret_{number}",
+                'created': int(time.time()),
+                'description': params.get('description'),
+                'metadata': dict(params.get('metadata') or {}),
+                'receipt_email': params.get('receipt_email'),
+                'customer': params.get('customer'),
+                'status': 'requires_payment_method',
+            }
+            self.intents[intent_id] = values
+            if key:
+                self.by_idempotency_key[key] = intent_id
+            return self._construct(values)
+
+    def retrieve(self, intent_id, params=None, options=None):
+        self._wait()
+        return self._retrieve(intent_id)
+
+    async def retrieve_async(self, intent_id, params=None, options=None):
+        await self._wait_async()
+        return self._retrieve(intent_id)
+
+    def _retrieve(self, intent_id):
+        try:
+            return self._construct(self.intents[intent_id])
+        except KeyError:
+            raise stripe.InvalidRequestError(f"No such payment_intent: '{intent_id}'", 'intent')
+
+    def list(self, params=None, options=None):
+        self._wait()
+        return self._list(params or {})
+
+    async def list_async(self, params=None, options=None):
+        await self._wait_async()
+        return self._list(params or {})
+
+    def _list(self, params):
+        created = params.get('created') or {}
+        limit = params.get('limit', 10)
+        starting_after = params.get('starting_after')
+
+        # Stripe lists newest first
+        intents = sorted(self.intents.values(), key=lambda i: (i['created'], i['id']), reverse=True)
+        if 'gte' in created:
+            intents = [i for i in intents if i['created'] >= created['gte']]
+        if 'lt' in created:
+            intents = [i for i in intents if i['created'] < created['lt']]
+        if starting_after:
+            ids = [i['id'] for i in intents]
+            intents = intents[ids.index(starting_after) + 1:] if starting_after in ids else []
+
+        page = intents[:limit]
+        return stripe.ListObject.construct_from({
+            'object': 'list',
+            'data': page,
+            'has_more': len(intents) > limit,
+            'url': '/v1/payment_intents',
+        }, 'sk_stub')
+
+    def set_status(self, intent_id, status):
+        # Test helper: pretend the customer finished (or abandoned) the payment
+        self.intents[intent_id]['status'] = status
+        return self._construct(self.intents[intent_id])
+
+
+class StubStripeClient:
+    def __init__(self, latency=0.0):
+        self.payment_intents = StubPaymentIntentService(latency=latency)
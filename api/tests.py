@@ -1,3 +1,1690 @@
-from django.test import TestCase
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import date, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+import httpx
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import user_logged_in, user_login_failed
+from django.core.management import CommandError, call_command
+from django.core.cache import cache, caches
+from django.db import connection, connections, router
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from .archive import COLUMNS as ARCHIVE_COLUMNS, archived_months, attendance_rows, read_month, segments, write_segment
+from .rollups import delete_attendance_logs
+from .attendance import club_date, ingest_scans
+from . import renderers
+from .authentication import user_cache, user_version
+from .imports import MemberImport
+from .metrics import registry
+from . import occupancy
+from .occupancy import adjust_occupancy, current_occupancy, occupancy_events, reconcile
+from .replica import REPLICA, pin_to_primary, pinned_to_primary, reading_from_replica, replica_configured
+from .models import Season, PlayerSeasonFee, Team, User, SocialCard, AttendanceLog, StripeWebhookEvent, StripePaymentIntent, MembershipChange, Watermark, DailyAttendanceRollup, MonthlyMemberAttendance
+from .stripe_client import get_stripe_client, reset_stripe_client
+from . import seasons
+from .seasons import SeasonResolver, season_resolver, get_current_season
+from .serializers import UserSerializer, user_payload
+
+
+def make_season(name, start, end, **kwargs):
+    kwargs.setdefault('fixture_fee_amount', Decimal('40.00'))
+    kwargs.setdefault('fixture_fee_due_date', start)
+    return Season.objects.create(name=name, start_date=start, end_date=end, **kwargs)
+
+
+def make_current_season(name='Current', days=30, **kwargs):
+    # Spans today on any day of the month. It's the resolver's (UTC) today, as
+    # that's the one it looks seasons up by
+    today = timezone.now().date()
+    return make_season(name, today - timedelta(days=days), today + timedelta(days=days), **kwargs)
+
+
+def shared_cache(directory):
+    # A cache whose instances all see the same data, as every process sees Redis or the database cache
+    return override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory,
+    }})
+
+
+def archive_in(directory=None):
+    # Archive segments as files under `directory`, or in memory without one
+    storage = {'BACKEND': 'django.core.files.storage.InMemoryStorage'} if directory is None else {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': directory},
+    }
+    return override_settings(STORAGES={**settings.STORAGES, 'attendance_archive': storage})
+
+
+@contextmanager
+def other_process():
+    """
+    Runs the block with its own instance of the default cache, as a
+    management command or another worker would have.
+    """
+    own = caches['default']
+    caches['default'] = caches.create_connection('default')
+    try:
+        yield
+    finally:
+        caches['default'] = own
+
+
+class SeasonResolverTests(TestCase):
+    def setUp(self):
+        # Rolled back test transactions don't fire signals, so start clean
+        season_resolver.invalidate()
+
+    def test_matches_queryset_lookup(self):
+        summer = make_season('Summer', date(2025, 1, 1), date(2025, 3, 31))
+        make_season('Winter', date(2025, 6, 1), date(2025, 8, 31))
+
+        self.assertEqual(get_current_season(date(2025, 2, 1)), summer)
+        self.assertIsNone(get_current_season(date(2025, 4, 15)))
+        with self.assertRaises(Season.DoesNotExist):
+            season_resolver.get(date(2025, 4, 15))
+
+    def test_overlapping_seasons(self):
+        long_season = make_season('Long', date(2025, 1, 1), date(2025, 12, 31))
+        make_season('Short', date(2025, 3, 1), date(2025, 3, 31))
+
+        # .first() semantics pick the lowest pk, .get() semantics complain
+        self.assertEqual(get_current_season(date(2025, 3, 15)), long_season)
+        with self.assertRaises(Season.MultipleObjectsReturned):
+            season_resolver.get(date(2025, 3, 15))
+
+    def test_cached_until_a_season_changes(self):
+        season = make_season('Summer', date(2025, 1, 1), date(2025, 3, 31))
+        get_current_season(date(2025, 2, 1))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_current_season(date(2025, 2, 1)), season)
+
+        season.end_date = date(2025, 1, 31)
+        season.save()
+        self.assertIsNone(get_current_season(date(2025, 2, 1)))
+
+    def test_edit_in_another_process(self):
+        self.enterContext(shared_cache(self.enterContext(tempfile.TemporaryDirectory())))
+        season = make_season('Summer', date(2025, 1, 1), date(2025, 3, 31))
+        self.assertEqual(get_current_season(date(2025, 2, 1)), season)
+
+        # That process has its own resolver, so this one's index is only
+        # dropped through the shared version token
+        with other_process(), mock.patch.object(seasons, 'season_resolver', SeasonResolver()):
+            season.end_date = date(2025, 1, 31)
+            season.save()
+        self.assertIsNone(get_current_season(date(2025, 2, 1)))
+
+
+class BulkFixtureEligibilityTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        self.season = make_current_season(fixture_fee_due_date=date.today())
+        self.admin = User.objects.create_superuser('desk@example.com', 'Desk', 'Admin', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def make_players(self, count):
+        players = User.objects.bulk_create([
+            User(email=f'p{i}@example.com', first_name='P', last_name=str(i),
+                 membership_type=User.MembershipType.GOLD_ANNUAL if i % 3 == 0 else User.MembershipType.GENERIC_USER)
+            for i in range(count)
+        ])
+        PlayerSeasonFee.objects.bulk_create([
+            PlayerSeasonFee(player=p, season=self.season, payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+            for p in players[::2]
+        ])
+        return players
+
+    def fetch(self, body):
+        response = self.client.post(reverse('fixture-eligibility-bulk'), body, format='json')
+        return response, json.loads(b''.join(response.streaming_content))
+
+    def test_matches_single_player_payload(self):
+        players = self.make_players(6)
+        response, body = self.fetch({'player_ids': [p.pk for p in players]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['season_name'], 'Current')
+
+        for player, row in zip(players, body['players']):
+            self.client.force_authenticate(player)
+            single = self.client.get(reverse('fixture-eligibility')).json()
+            self.assertEqual(row['player_id'], player.pk)
+            self.assertEqual({k: row[k] for k in single}, single)
+
+    def test_query_count_does_not_grow_with_roster(self):
+        players = self.make_players(60)
+        get_current_season()
+        with self.assertNumQueries(1):
+            self.fetch({'player_ids': [p.pk for p in players]})
+
+    def test_requires_ids_or_season(self):
+        response = self.client.post(reverse('fixture-eligibility-bulk'), {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_captain_only_sees_their_team(self):
+        players = self.make_players(4)
+        captain, teammate, rival = players[1], players[2], players[3]
+        Team.objects.create(name='Rivals', captain=rival).players.set([rival])
+        Team.objects.create(name='Firsts', captain=captain).players.set([captain, teammate])
+
+        self.client.force_authenticate(captain)
+        get_current_season()
+        # The captain check, then the roster as before
+        with self.assertNumQueries(2):
+            response, body = self.fetch({'player_ids': [p.pk for p in players]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['player_id'] for row in body['players']], [captain.pk, teammate.pk])
+
+        # Neither a player nor a captain
+        self.client.force_authenticate(players[0])
+        response = self.client.post(reverse('fixture-eligibility-bulk'), {'player_ids': [captain.pk]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+def signed_webhook(client, event, secret='whsec_test'):
+    """
+    Posts `event` to the webhook view with a valid Stripe signature.
+    """
+    import hashlib, hmac, time
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return client.post(
+        reverse('stripe-webhook'), payload, content_type='application/json',
+        HTTP_STRIPE_SIGNATURE=f"t={timestamp},v1={signature}"
+    )
+
+
+class LoopBoundTransport(httpx.AsyncBaseTransport):
+    """
+    Answers every request with handler(request) as JSON. Like a real
+    connection pool, it only works on the event loop it was first used on.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.loop = None
+
+    async def handle_async_request(self, request):
+        loop = asyncio.get_running_loop()
+        if self.loop not in (None, loop):
+            raise RuntimeError('Event loop is closed')
+        self.loop = loop
+        return httpx.Response(200, json=self.handler(request))
+
+
+@contextmanager
+def live_stripe(handler):
+    """
+    The real Stripe client, with its httpx clients answering from `handler`
+    instead of the network. Yields the transports, one per httpx client made.
+    """
+    real_client = httpx.AsyncClient
+    transports = []
+
+    def client(**kwargs):
+        transports.append(LoopBoundTransport(handler))
+        return real_client(transport=transports[-1], **kwargs)
+
+    with override_settings(STRIPE_CLIENT='live', STRIPE_SECRET_KEY='sk_test_123', STRIPE_MAX_NETWORK_RETRIES=0), \
+            mock.patch.object(httpx, 'AsyncClient', client):
+        reset_stripe_client()
+        try:
+            yield transports
+        finally:
+            reset_stripe_client()
+
+
+class PlayerHistoryTests(TestCase):
+    def setUp(self):
+        self.player = User.objects.create_user('player@example.com', 'Pat', 'Player', 'pw')
+        other = User.objects.create_user('other@example.com', 'O', 'Ther', 'pw')
+        self.season = make_season('2024', date(2024, 1, 1), date(2024, 12, 31))
+        PlayerSeasonFee.objects.create(player=self.player, season=self.season, payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+        SocialCard.objects.create(player=self.player, sessions_remaining=7)
+        for day in (date(2024, 3, 4), date(2024, 3, 4), date(2024, 5, 1), date(2024, 6, 2), date(2024, 6, 2), date.today()):
+            entry = timezone.now()
+            AttendanceLog.objects.create(player=self.player, date_of_play=day, entry_time=entry, exit_time=entry)
+            AttendanceLog.objects.create(player=other, date_of_play=day, entry_time=entry, exit_time=entry)
+        self.expected = list(
+            AttendanceLog.objects.filter(player=self.player).order_by('-date_of_play', '-id').values_list('id', flat=True)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.player)
+
+    def history(self, **params):
+        response = self.client.get(reverse('player-history'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self):
+        with self.assertNumQueries(3):
+            page = self.history(limit=4)
+        self.assertEqual(page['fees'][0]['payment_status'], 'PAID')
+        self.assertEqual(page['fees'][0]['amount'], '40.00')
+        self.assertEqual(page['social_cards'][0]['sessions_remaining'], 7)
+        seen = [row['id'] for row in page['attendance']]
+        while page['next']:
+            with self.assertNumQueries(1):
+                page = self.history(limit=4, cursor=page['next'])
+            self.assertNotIn('fees', page)
+            seen += [row['id'] for row in page['attendance']]
+        return seen
+
+    def test_pages_by_date_and_id(self):
+        self.assertEqual(self.walk(), self.expected)
+        response = self.client.get(reverse('player-history'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_archived_visits_are_still_listed(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with archive_in(directory.name):
+            call_command('archive_attendance', '--older-than', '30', stdout=StringIO())
+            self.assertEqual(AttendanceLog.objects.filter(player=self.player).count(), 1)
+            self.assertEqual(self.walk(), self.expected)
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        self.season = make_current_season()
+        self.player = User.objects.create_user('player@example.com', 'Pat', 'Player', 'pw')
+
+    def succeeded_event(self, event_id, email='player@example.com'):
+        return {
+            'id': event_id,
+            'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': 'pi_1', 'receipt_email': email, 'description': 'Fixture Fee'}},
+        }
+
+    def test_duplicate_events_are_stored_once(self):
+        for _ in range(2):
+            response = signed_webhook(self.client, self.succeeded_event('evt_1'))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeWebhookEvent.objects.count(), 1)
+        self.assertFalse(PlayerSeasonFee.objects.exists())
+
+        call_command('process_webhook_events', stdout=StringIO())
+        fee = PlayerSeasonFee.objects.get()
+        self.assertEqual(fee.payment_status, PlayerSeasonFee.PaymentStatus.PAID)
+        self.assertEqual(StripeWebhookEvent.objects.get().status, StripeWebhookEvent.Status.PROCESSED)
+
+    def test_unknown_user_is_retried_with_backoff(self):
+        signed_webhook(self.client, self.succeeded_event('evt_2', email='nobody@example.com'))
+        call_command('process_webhook_events', stdout=StringIO())
+
+        event = StripeWebhookEvent.objects.get()
+        self.assertEqual(event.status, StripeWebhookEvent.Status.PENDING)
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.next_attempt_at, event.received_at)
+
+    def test_bad_signature_is_rejected(self):
+        response = signed_webhook(self.client, self.succeeded_event('evt_3'), secret='wrong')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeWebhookEvent.objects.exists())
+
+
+@override_settings(STRIPE_CLIENT='stub', STRIPE_WEBHOOK_SECRET='whsec_test')
+class PaymentIntentReuseTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        self.season = make_current_season()
+        self.player = User.objects.create_user('player@example.com', 'Pat', 'Player', 'pw')
+        self.client = APIClient()
+        # A real token: the payment intent view is async, so it isn't a DRF
+        # view that force_authenticate() can reach
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.player).access_token}')
+
+    def create_intent(self, payment_type='fixture_fee'):
+        response = self.client.post(reverse('create-payment-intent'), {'payment_type': payment_type}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['client_secret']
+
+    def test_open_intent_is_reused(self):
+        first = self.create_intent()
+        self.assertEqual(self.create_intent(), first)
+        self.assertEqual(get_stripe_client().payment_intents.create_calls, 1)
+        self.assertEqual(StripePaymentIntent.objects.get().season, self.season)
+
+    def test_webhook_updates_record_and_marks_fee_paid(self):
+        self.create_intent()
+        record = StripePaymentIntent.objects.get()
+        intent = get_stripe_client().payment_intents.set_status(record.stripe_payment_intent_id, 'succeeded')
+
+        signed_webhook(self.client, {
+            'id': 'evt_paid', 'object': 'event', 'type': 'payment_intent.succeeded',
+            'data': {'object': intent.to_dict()},
+        })
+        call_command('process_webhook_events', stdout=StringIO())
+
+        record.refresh_from_db()
+        self.assertEqual(record.status, 'succeeded')
+        self.assertEqual(PlayerSeasonFee.objects.get(player=self.player, season=self.season).payment_status, PlayerSeasonFee.PaymentStatus.PAID)
+
+        # The old intent is finished, so buying again makes a fresh one
+        self.create_intent()
+        self.assertEqual(StripePaymentIntent.objects.count(), 2)
+
+
+@override_settings(STRIPE_CLIENT='stub')
+class AsyncPaymentIntentTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        user_cache.clear()
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        get_stripe_client().payment_intents.latency = 0.2
+        self.tokens = [
+            str(RefreshToken.for_user(User.objects.create_user(f'p{i}@example.com', 'P', str(i), 'pw')).access_token)
+            for i in range(5)
+        ]
+
+    async def buy_card(self, token):
+        return await self.async_client.post(reverse('create-payment-intent'), {'payment_type': 'social_card_purchase'},
+                                            content_type='application/json', headers={'Authorization': f'Bearer {token}'})
+
+    async def test_stripe_calls_wait_side_by_side(self):
+        responses = await asyncio.gather(*(self.buy_card(token) for token in self.tokens))
+        self.assertEqual([r.status_code for r in responses], [200] * 5)
+        self.assertEqual(get_stripe_client().payment_intents.max_in_flight, 5)
+
+    @override_settings(STRIPE_ASYNC_CONCURRENCY=1, STRIPE_QUEUE_TIMEOUT=0.05)
+    async def test_busy_when_no_slot_frees_up(self):
+        responses = await asyncio.gather(*(self.buy_card(token) for token in self.tokens[:2]))
+        self.assertEqual(sorted(r.status_code for r in responses), [200, 503])
+        self.assertEqual(get_stripe_client().payment_intents.max_in_flight, 1)
+
+    async def test_requires_a_token(self):
+        response = await self.async_client.post(reverse('create-payment-intent'), {'payment_type': 'social_card_purchase'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = await self.buy_card('not-a-token')
+        self.assertEqual(response.status_code, 401)
+
+
+class LiveStripeClientTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        user_cache.clear()
+        self.intents = itertools.count(1)
+
+    def payment_intent(self, request):
+        return {'id': f'pi_{next(self.intents)}', 'object': 'payment_intent', 'status': 'requires_payment_method',
+                'client_secret': 'secret'}
+
+    def test_each_event_loop_gets_its_own_client(self):
+        # Sync requests to an async view run it on a new event loop each time
+        with live_stripe(self.payment_intent) as transports:
+            for i in range(2):
+                player = User.objects.create_user(f'p{i}@example.com', 'P', str(i), 'pw')
+                client = APIClient()
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(player).access_token}')
+                response = client.post(reverse('create-payment-intent'), {'payment_type': 'social_card_purchase'}, format='json')
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(transports), 2)
+        self.assertEqual(StripePaymentIntent.objects.count(), 2)
+
+
+class AttendanceScanTests(TestCase):
+    def setUp(self):
+        self.desk = User.objects.create_superuser('scanner@example.com', 'Door', 'Scanner', 'pw')
+        self.player = User.objects.create_user('player@example.com', 'Pat', 'Player', 'pw',
+                                               membership_type=User.MembershipType.SOCIAL_CARD_HOLDER)
+        self.card = SocialCard.objects.create(player=self.player, sessions_total=10, sessions_remaining=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.desk)
+
+    def scan(self, name, **body):
+        return self.client.post(reverse(name), body, format='json')
+
+    def test_check_in_uses_last_session_and_check_out_closes_log(self):
+        response = self.scan('attendance-check-in', card_id=str(self.card.card_id_string))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sessions_consumed'], 1)
+
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.sessions_remaining, 0)
+        self.assertEqual(self.card.status, SocialCard.Status.USED_UP)
+
+        log = AttendanceLog.objects.get()
+        self.assertTrue(log.daily_session_consumed)
+        self.assertIsNone(log.exit_time)
+
+        self.scan('attendance-check-out', player_id=self.player.pk)
+        log.refresh_from_db()
+        self.assertIsNotNone(log.exit_time)
+
+    def test_batch_collapses_duplicates_and_consumes_once_per_day(self):
+        self.card.sessions_remaining = 5
+        self.card.save()
+        start = timezone.now().replace(hour=10)
+        events = [
+            {'kind': 'in', 'player_id': self.player.pk, 'timestamp': start.isoformat()},
+            {'kind': 'in', 'player_id': self.player.pk, 'timestamp': (start + timedelta(seconds=5)).isoformat()},
+            {'kind': 'out', 'player_id': self.player.pk, 'timestamp': (start + timedelta(hours=1)).isoformat()},
+            {'kind': 'in', 'player_id': self.player.pk, 'timestamp': (start + timedelta(hours=2)).isoformat()},
+        ]
+        response = self.client.post(reverse('attendance-scans'), {'events': events}, format='json')
+        summary = response.json()
+
+        self.assertEqual(summary['checked_in'], 2)
+        self.assertEqual(summary['checked_out'], 1)
+        self.assertEqual(summary['duplicates'], 1)
+        self.assertEqual(summary['sessions_consumed'], 1)
+        self.assertEqual(AttendanceLog.objects.count(), 2)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.sessions_remaining, 4)
+
+    def test_unknown_card_is_not_found(self):
+        response = self.scan('attendance-check-in', card_id='00000000-0000-0000-0000-000000000000')
+        self.assertEqual(response.status_code, 404)
+
+
+class CleanupAttendanceTests(TestCase):
+    def test_closes_each_log_at_the_end_of_its_own_day(self):
+        player = User.objects.create_user('player@example.com', 'Pat', 'Player', 'pw')
+        today = timezone.localdate()
+        days = [today - timedelta(days=n) for n in (3, 2, 0)]
+        for day in days:
+            for _ in range(3):
+                AttendanceLog.objects.create(player=player, date_of_play=day, entry_time=timezone.now())
+        # Far past the others: batches follow the ids there are, not the gap
+        AttendanceLog.objects.create(pk=10 ** 9, player=player, date_of_play=days[0], entry_time=timezone.now())
+
+        out = StringIO()
+        call_command('cleanup_attendance', '--batch-size', '2', '--dry-run', stdout=out)
+        self.assertIn('7 attendance log(s) would be cleaned up', out.getvalue())
+        self.assertEqual(AttendanceLog.objects.filter(exit_time__isnull=True).count(), 10)
+
+        call_command('cleanup_attendance', '--batch-size', '2', stdout=StringIO())
+        for log in AttendanceLog.objects.exclude(date_of_play=today):
+            exit_local = timezone.localtime(log.exit_time)
+            self.assertEqual(exit_local.date(), log.date_of_play)
+            self.assertEqual((exit_local.hour, exit_local.minute), (23, 59))
+        self.assertEqual(AttendanceLog.objects.filter(date_of_play=today, exit_time__isnull=True).count(), 3)
+
+
+class OccupancyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.players = [User.objects.create_user(f'p{i}@example.com', 'P', str(i), 'pw') for i in range(3)]
+
+    def scan(self, kind, player):
+        with self.captureOnCommitCallbacks(execute=True):
+            ingest_scans([{'kind': kind, 'player_id': player.pk, 'timestamp': timezone.now()}])
+
+    def occupancy(self):
+        return self.client.get(reverse('attendance-occupancy')).json()['occupancy']
+
+    def test_counted_incrementally_and_reconciled(self):
+        self.scan('in', self.players[0])
+        # The first read counts from the database, the rest come from the cache
+        self.assertEqual(self.occupancy(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.occupancy(), 1)
+
+        self.scan('in', self.players[1])
+        self.scan('in', self.players[2])
+        self.scan('out', self.players[0])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.occupancy(), 2)
+
+        # A change made behind its back is picked up by the next recount
+        AttendanceLog.objects.filter(player=self.players[1]).update(exit_time=timezone.now())
+        self.assertEqual(self.occupancy(), 2)
+        cache.delete(f'api:occupancy-checked:{club_date(timezone.now())}')
+        self.assertEqual(self.occupancy(), 1)
+
+    def test_reconcile_command(self):
+        self.scan('in', self.players[0])
+        self.assertEqual(self.occupancy(), 1)
+        AttendanceLog.objects.filter(player=self.players[0]).update(exit_time=timezone.now())
+        out = StringIO()
+        call_command('reconcile_occupancy', stdout=out)
+        self.assertIn('0 player(s)', out.getvalue())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.occupancy(), 0)
+
+    def test_cleanup_closes_earlier_days(self):
+        yesterday = club_date(timezone.now()) - timedelta(days=1)
+        AttendanceLog.objects.create(player=self.players[0], date_of_play=yesterday, entry_time=timezone.now() - timedelta(days=1))
+        self.assertEqual(current_occupancy(yesterday), 1)
+        call_command('cleanup_attendance', stdout=StringIO())
+        self.assertEqual(current_occupancy(yesterday), 0)
+
+
+class OccupancyStreamTests(TransactionTestCase):
+    # The feed counts on a thread of its own, so it only sees committed logs
+    def setUp(self):
+        cache.clear()
+        self.players = [User.objects.create_user(f'p{i}@example.com', 'P', str(i), 'pw') for i in range(2)]
+
+    @override_settings(OCCUPANCY_STREAM_INTERVAL=0.01)
+    async def test_stream_pushes_changes(self):
+        day = club_date(timezone.now())
+        await sync_to_async(reconcile)(day)
+        response = await self.async_client.get(reverse('attendance-occupancy-stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        stream = response.streaming_content
+        events = []
+        try:
+            async for chunk in stream:
+                if chunk.startswith(b'event:'):
+                    events.append(json.loads(chunk.decode().split('data: ')[1])['occupancy'])
+                    if len(events) == 1:
+                        await AttendanceLog.objects.abulk_create(
+                            AttendanceLog(player=player, date_of_play=day, entry_time=timezone.now())
+                            for player in self.players)
+                        await sync_to_async(adjust_occupancy)({day: len(self.players)})
+                    else:
+                        break
+        finally:
+            await stream.aclose()
+        self.assertEqual(events, [0, 2])
+
+    def test_polls_under_wsgi(self):
+        # The test client is WSGI: one event and a retry, not an open stream
+        AttendanceLog.objects.create(player=self.players[0], date_of_play=club_date(timezone.now()), entry_time=timezone.now())
+        response = self.client.get(reverse('attendance-occupancy-stream'))
+        self.assertFalse(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertIn('retry: 5000', body)
+        self.assertEqual(json.loads(body.split('data: ')[1])['occupancy'], 1)
+
+
+class AttendanceRollupTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@example.com', 'Ad', 'Min', 'pw')
+        self.gold = User.objects.create_user('gold@example.com', 'Gold', 'Player', 'pw', membership_type=User.MembershipType.GOLD_ANNUAL)
+        self.social = User.objects.create_user('social@example.com', 'Social', 'Player', 'pw', membership_type=User.MembershipType.SOCIAL_CARD_HOLDER)
+        self.day = date(2025, 5, 10)
+        entry = timezone.make_aware(timezone.datetime(2025, 5, 10, 18, 0))
+        for player, minutes in ((self.gold, 60), (self.gold, 30), (self.social, 120)):
+            AttendanceLog.objects.create(player=player, date_of_play=self.day, entry_time=entry,
+                                         exit_time=entry + timedelta(minutes=minutes),
+                                         daily_session_consumed=player == self.social)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def report(self):
+        response = self.client.get(reverse('attendance-report'), {'start': '2025-05-01', 'end': '2025-05-31'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['days']
+
+    def test_report_is_served_from_rollups(self):
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        [day] = self.report()
+        self.assertEqual(day['visits'], 3)
+        self.assertEqual(day['unique_players'], 2)
+        self.assertEqual(day['sessions_consumed'], 1)
+        self.assertEqual(day['average_session_minutes'], 70.0)
+        self.assertEqual(day['by_membership_type']['GOLD_ANNUAL']['visits'], 2)
+
+        members = self.client.get(reverse('member-attendance-report'), {'month': '2025-05'}).json()['members']
+        self.assertEqual([m['player_id'] for m in members], [self.gold.pk, self.social.pk])
+
+    def test_only_dirty_days_are_recomputed(self):
+        # Age the existing logs past the watermark's overlap window
+        AttendanceLog.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        AttendanceLog.objects.create(player=self.social, date_of_play=date(2025, 5, 11), entry_time=timezone.now())
+
+        out = StringIO()
+        call_command('refresh_attendance_rollups', stdout=out)
+        self.assertIn('for 1 day(s)', out.getvalue())
+        self.assertEqual([d['date'] for d in self.report()], ['2025-05-10', '2025-05-11'])
+
+    def test_deleted_logs_are_taken_out(self):
+        AttendanceLog.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        self.assertEqual(delete_attendance_logs(AttendanceLog.objects.filter(player=self.social)), 1)
+
+        out = StringIO()
+        call_command('refresh_attendance_rollups', stdout=out)
+        self.assertIn('for 1 day(s)', out.getvalue())
+        [day] = self.report()
+        self.assertEqual(day['visits'], 2)
+        self.assertNotIn('SOCIAL_CARD_HOLDER', day['by_membership_type'])
+        members = self.client.get(reverse('member-attendance-report'), {'month': '2025-05'}).json()['members']
+        self.assertEqual([m['player_id'] for m in members], [self.gold.pk])
+
+    def test_deleted_members_are_taken_out(self):
+        AttendanceLog.objects.update(updated_at=timezone.now() - timedelta(hours=1))
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        self.social.delete()
+
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        [day] = self.report()
+        self.assertEqual(day['visits'], 2)
+        self.assertNotIn('SOCIAL_CARD_HOLDER', day['by_membership_type'])
+
+    def test_member_average_leaves_out_open_visits(self):
+        AttendanceLog.objects.create(player=self.gold, date_of_play=self.day, entry_time=timezone.now())
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        members = self.client.get(reverse('member-attendance-report'), {'month': '2025-05'}).json()['members']
+        self.assertEqual((members[0]['visits'], members[0]['average_session_minutes']), (3, 45.0))
+
+    def test_rebuild_runs_until_the_clubs_today(self):
+        # Late evening in UTC is already the next day at the club
+        now = timezone.datetime(2025, 5, 10, 20, 0, tzinfo=dt_timezone.utc)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            out = StringIO()
+            call_command('refresh_attendance_rollups', '--since', '2025-05-10', stdout=out)
+        self.assertIn('for 2 day(s)', out.getvalue())
+
+
+class AttendanceArchiveTests(TestCase):
+    def setUp(self):
+        # Any storage backend will do, not just local files
+        self.enterContext(archive_in())
+        self.gold = User.objects.create_user('gold@example.com', 'Gold', 'Player', 'pw', membership_type=User.MembershipType.GOLD_ANNUAL)
+        self.social = User.objects.create_user('social@example.com', 'Social', 'Player', 'pw', membership_type=User.MembershipType.SOCIAL_CARD_HOLDER)
+        self.logs = []
+        for day, player, minutes in ((date(2024, 3, 5), self.gold, 60), (date(2024, 3, 5), self.social, 90),
+                                     (date(2024, 3, 20), self.social, 30), (date(2024, 4, 2), self.gold, 45)):
+            entry = timezone.make_aware(timezone.datetime(day.year, day.month, day.day, 18, 0))
+            log = AttendanceLog.objects.create(player=player, date_of_play=day, entry_time=entry, exit_time=entry + timedelta(minutes=minutes),
+                                               daily_session_consumed=player == self.social)
+            self.logs.append(log.pk)
+        self.open_log = AttendanceLog.objects.create(player=self.gold, date_of_play=date(2024, 4, 9), entry_time=timezone.now())
+        self.recent = AttendanceLog.objects.create(player=self.gold, date_of_play=date.today(), entry_time=timezone.now())
+
+    def rollups(self):
+        return (
+            list(DailyAttendanceRollup.objects.order_by('date', 'membership_type').values_list(
+                'date', 'membership_type', 'visits', 'unique_players', 'closed_visits', 'total_session_seconds', 'sessions_consumed')),
+            list(MonthlyMemberAttendance.objects.order_by('month', 'player').values_list(
+                'month', 'player', 'visits', 'days_played', 'total_session_seconds', 'sessions_consumed')),
+        )
+
+    def archive(self):
+        out = StringIO()
+        call_command('archive_attendance', '--older-than', '30', '--batch-size', '1', stdout=out)
+        return out.getvalue()
+
+    def test_moves_closed_months_and_reads_them_back(self):
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        before = self.rollups()
+
+        out = self.archive()
+        self.assertIn('Archived 4 attendance log(s)', out)
+        self.assertIn('1 open log(s)', out)
+        self.assertEqual(set(AttendanceLog.objects.values_list('pk', flat=True)), {self.open_log.pk, self.recent.pk})
+        self.assertEqual(archived_months(), [date(2024, 3, 1), date(2024, 4, 1)])
+
+        history = attendance_rows(player_id=self.gold.pk)
+        self.assertEqual([row['date_of_play'] for row in history], [date(2024, 3, 5), date(2024, 4, 2), date(2024, 4, 9), date.today()])
+        self.assertEqual(list(read_month(date(2024, 3, 1), self.social.pk)), self.logs[1:3])
+
+        # Rebuilding the archived months gives the same rollups
+        call_command('refresh_attendance_rollups', '--since', '2024-03-01', '--until', '2024-04-30', stdout=StringIO())
+        self.assertEqual(self.rollups(), before)
+
+    def test_rerun_after_an_interrupted_run(self):
+        # A run that wrote March's segment and then died before deleting anything
+        write_segment(date(2024, 3, 1), list(AttendanceLog.objects.filter(date_of_play__month=3).values(*ARCHIVE_COLUMNS)))
+
+        self.assertIn('Archived 4 attendance log(s)', self.archive())
+        self.assertEqual([index['rows'] for _, index in segments(date(2024, 3, 1))], [3])
+        self.assertEqual(len(attendance_rows(date(2024, 3, 1), date(2024, 4, 30))), 5)
+        self.assertIn('No attendance logs needed archiving', self.archive())
+
+    def test_nothing_is_deleted_without_archive_storage(self):
+        storages = {alias: backend for alias, backend in settings.STORAGES.items() if alias != 'attendance_archive'}
+        with override_settings(STORAGES=storages):
+            with self.assertRaisesMessage(CommandError, 'ATTENDANCE_ARCHIVE_STORAGE'):
+                self.archive()
+            self.assertEqual(archived_months(), [])
+        self.assertEqual(AttendanceLog.objects.count(), 6)
+
+    def test_player_deleted_after_archiving(self):
+        self.archive()
+        self.social.delete()
+
+        call_command('refresh_attendance_rollups', '--since', '2024-03-01', '--until', '2024-04-30', stdout=StringIO())
+        daily, monthly = self.rollups()
+        # Their archived visits go the way their live ones did
+        self.assertEqual([row[:3] for row in daily if row[0].month == 3], [(date(2024, 3, 5), 'GOLD_ANNUAL', 1)])
+        self.assertEqual({row[1] for row in monthly}, {self.gold.pk})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@example.com', 'Ad', 'Min', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        for day in (1, 2, 3):
+            AttendanceLog.objects.create(player=self.admin, date_of_play=date(2025, 5, day), entry_time=timezone.now())
+
+    def test_csv_export_with_date_filter(self):
+        response = self.client.get(reverse('export', args=['attendance']), {'since': '2025-05-02'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'player_id', 'player__email'])
+        self.assertEqual(len(lines), 3)
+
+    def test_attendance_export_includes_archived_months(self):
+        self.enterContext(archive_in())
+        entry = timezone.make_aware(timezone.datetime(2024, 3, 5, 18, 0))
+        archived = AttendanceLog.objects.create(player=self.admin, date_of_play=date(2024, 3, 5), entry_time=entry,
+                                                exit_time=entry + timedelta(hours=1))
+        call_command('archive_attendance', '--older-than', '30', stdout=StringIO())
+        self.assertFalse(AttendanceLog.objects.filter(pk=archived.pk).exists())
+
+        response = self.client.get(reverse('export', args=['attendance']), {'file_format': 'jsonl', 'until': '2025-05-01'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['id'], row['player__email'], row['date_of_play']) for row in rows],
+                         [(archived.pk, 'admin@example.com', '2024-03-05'), (rows[1]['id'], 'admin@example.com', '2025-05-01')])
+
+    def test_gzipped_jsonl_export(self):
+        import gzip
+        response = self.client.get(reverse('export', args=['members']), {'file_format': 'jsonl', 'gzip': '1'})
+        rows = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(json.loads(rows[0])['email'], 'admin@example.com')
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.player = User.objects.create_user('gold@example.com', 'Gold', 'Player', 'pw', membership_type=User.MembershipType.GOLD_ANNUAL)
+        token = RefreshToken.for_user(self.player).access_token
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_warm_cache_makes_no_auth_queries(self):
+        self.client.get(reverse('fixture-eligibility'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('fixture-eligibility'))
+        self.assertEqual(response.json()['is_fee_owed'], False)
+
+    def test_saving_the_user_invalidates_the_cache(self):
+        self.client.get(reverse('fixture-eligibility'))
+        self.player.is_active = False
+        self.player.save()
+
+        response = self.client.get(reverse('fixture-eligibility'))
+        self.assertEqual(response.status_code, 401)
+
+
+class FastSerializationTests(TestCase):
+    def setUp(self):
+        self.player = User.objects.create_user('fast@example.com', 'Fast', 'Player', 'pw', phone='0400',
+                                               dob=date(1990, 5, 17))
+
+    def test_compiled_serializer_matches_user_serializer(self):
+        other = User.objects.create_user('nodob@example.com', 'No', 'Dob', 'pw')
+        for user in (self.player, other, User.objects.get(pk=other.pk)):
+            self.assertEqual(user_payload(user), dict(UserSerializer(user).data))
+
+        row = User.objects.values(*user_payload.fields).get(pk=self.player.pk)
+        self.assertEqual(user_payload(row), dict(UserSerializer(self.player).data))
+
+    def test_renderer_matches_drf(self):
+        data = {
+            'when': timezone.now(), 'day': date(2024, 2, 29), 'amount': Decimal('40.00'),
+            'card': SocialCard(player=self.player, sessions_remaining=1).card_id_string,
+            'name': 'Zoë ', 7: [1, None, True],
+        }
+        expected = JSONRenderer().render(data)
+        self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.FastJSONRenderer().render(data), expected)
+
+
+@override_settings(PASSWORD_HASH_WORK_FACTOR=1000)
+class PasswordPolicyTests(TestCase):
+    def setUp(self):
+        self.player = User.objects.create_user('login@example.com', 'Log', 'In', 'right-password')
+        self.client = APIClient()
+
+    def login(self, password='right-password', email='login@example.com'):
+        return self.client.post(reverse('login'), {'email': email, 'password': password}, format='json')
+
+    def test_rehashed_when_the_work_factor_changes(self):
+        self.assertTrue(self.player.password.startswith('pbkdf2_sha256$1000$'))
+        with self.settings(PASSWORD_HASH_WORK_FACTOR=2000):
+            # The read, the new hash and last_login
+            with self.assertNumQueries(3):
+                response = self.login()
+            self.assertEqual(response.status_code, 200)
+            self.player.refresh_from_db()
+            self.assertTrue(self.player.password.startswith('pbkdf2_sha256$2000$'))
+            # Up to date now, so the next login only reads and sets last_login
+            with self.assertNumQueries(2):
+                self.login()
+
+    def test_rehashed_when_the_hasher_changes(self):
+        with self.settings(PASSWORD_HASHER='scrypt', PASSWORD_HASH_WORK_FACTOR=2 ** 10,
+                           PASSWORD_HASHERS=['api.passwords.ScryptPasswordHasher', 'api.passwords.PBKDF2PasswordHasher']):
+            self.assertEqual(self.login().status_code, 200)
+            self.player.refresh_from_db()
+            self.assertTrue(self.player.password.startswith('scrypt$'))
+            self.assertEqual(self.login().status_code, 200)
+
+    def test_rejected_logins(self):
+        User.objects.filter(pk=self.player.pk).update(is_active=False)
+        self.assertEqual(self.login().status_code, 401)
+        self.assertEqual(self.login(email='nobody@example.com').status_code, 401)
+        self.assertEqual(self.client.post(reverse('login'), {'email': 'login@example.com'}, format='json').status_code, 400)
+
+        User.objects.filter(pk=self.player.pk).update(is_active=True)
+        self.assertEqual(self.login('wrong-password').status_code, 401)
+
+    def test_logins_send_the_auth_signals(self):
+        logged_in, failed = mock.Mock(), mock.Mock()
+        user_logged_in.connect(logged_in, weak=False)
+        user_login_failed.connect(failed, weak=False)
+        self.addCleanup(user_logged_in.disconnect, logged_in)
+        self.addCleanup(user_login_failed.disconnect, failed)
+
+        self.assertEqual(self.login('wrong-password').status_code, 401)
+        self.assertEqual(failed.call_args.kwargs['credentials']['username'], 'login@example.com')
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(logged_in.call_args.kwargs['user'], self.player)
+        self.player.refresh_from_db()
+        self.assertIsNotNone(self.player.last_login)
+
+    def test_hashers_checked_when_settings_load(self):
+        # An scrypt N that isn't a power of two, and hashers whose library is missing
+        for hasher, work_factor, module in (('scrypt', '1000', None), ('argon2', '0', 'argon2'), ('bcrypt_sha256', '0', 'bcrypt')):
+            if module and importlib.util.find_spec(module):
+                continue
+            env = dict(os.environ, PASSWORD_HASHER=hasher, PASSWORD_HASH_WORK_FACTOR=work_factor)
+            result = subprocess.run([sys.executable, '-c', 'import gctta_project.settings'], env=env, capture_output=True, text=True)
+            self.assertIn('ImproperlyConfigured', result.stderr, hasher)
+
+    def test_signed_up_members_can_log_in(self):
+        response = self.client.post(reverse('signup'), {
+            'email': 'new@example.com', 'first_name': 'N', 'last_name': 'U', 'phone': '0400',
+            'password': 'pw-123456', 'password2': 'pw-123456',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['user']['email'], 'new@example.com')
+        self.assertTrue(User.objects.get(email='new@example.com').password.startswith('pbkdf2_sha256$1000$'))
+
+        response = self.login('pw-123456', 'new@example.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.json()['token']}")
+        self.assertEqual(self.client.get(reverse('player-profile')).json()['email'], 'new@example.com')
+
+
+@override_settings(STRIPE_CLIENT='stub')
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        season_resolver.invalidate()
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        make_current_season()
+        self.player = User.objects.create_user('player@example.com', 'Pat', 'Player', 'pw')
+        self.client = APIClient()
+        # A real token: the payment intent view is async, so it isn't a DRF
+        # view that force_authenticate() can reach
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.player).access_token}')
+
+    def test_server_timing_and_histograms(self):
+        response = self.client.get(reverse('fixture-eligibility'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+        response = self.client.post(reverse('create-payment-intent'), {'payment_type': 'fixture_fee'}, format='json')
+        self.assertIn('stripe;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 calls"', response['Server-Timing'])
+
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('gctta_request_duration_seconds_count{view="fixture-eligibility",method="GET"} 1', body)
+        self.assertIn('gctta_request_stripe_duration_seconds_count{view="create-payment-intent",method="POST"} 1', body)
+        self.assertIn('gctta_requests_total{view="fixture-eligibility",method="GET",status="200"} 1', body)
+        self.assertIn('gctta_webhook_events{status="PENDING"} 0', body)
+
+    def test_multiprocess_mode_merges_worker_files(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROC_DIR=directory):
+            # Another worker's snapshot
+            with open(f'{directory}/1.json', 'w') as f:
+                json.dump({
+                    'histograms': [['gctta_request_db_queries', ['fixture-eligibility', 'GET'], [0, 0, 2, 0, 0, 0, 0, 0, 0, 0], 4.0, 2]],
+                    'counters': [['gctta_requests_total', ['fixture-eligibility', 'GET', '200'], 2]],
+                }, f)
+            self.client.get(reverse('fixture-eligibility'))
+            body = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('gctta_requests_total{view="fixture-eligibility",method="GET",status="200"} 3', body)
+        self.assertIn('gctta_request_db_queries_count{view="fixture-eligibility",method="GET"} 3', body)
+
+    @override_settings(METRICS_AUTH_TOKEN='scrape-me')
+    def test_metrics_token(self):
+        client = APIClient()
+        self.assertEqual(client.get(reverse('metrics')).status_code, 401)
+        response = client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+
+
+class ImportMembersTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.existing = User.objects.create_user('old@example.com', 'Old', 'Name', 'keep-me', phone='0400')
+
+    def write(self, name, content):
+        path = f'{self.directory.name}/{name}'
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_csv_import_creates_updates_and_reports_errors(self):
+        path = self.write('members.csv', (
+            'email,first_name,last_name,phone,dob,password,password2\n'
+            'new@example.com,New,Member,0411,1990-05-01,s3cret-pw,s3cret-pw\n'
+            'old@example.com,Renamed,Name,0422,,other-pw,\n'
+            'bad@example.com,Bad,Row,0433,,one,two\n'
+            'new@example.com,Again,Member,0411,,s3cret-pw,\n'
+        ))
+        out = StringIO()
+        call_command('import_members', path, '--workers', '1', stdout=out)
+        self.assertIn('2 member(s): 1 new, 1 updated', out.getvalue())
+
+        new = User.objects.get(email='new@example.com')
+        self.assertTrue(new.check_password('s3cret-pw'))
+        self.assertEqual(new.dob, date(1990, 5, 1))
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.first_name, self.existing.phone), ('Renamed', '0422'))
+        self.assertTrue(self.existing.check_password('keep-me'))
+
+        with open(f'{path}.errors.csv') as f:
+            report = f.read().splitlines()
+        self.assertEqual([line.split(',')[:2] for line in report[1:]], [['4', 'bad@example.com'], ['5', 'new@example.com']])
+
+    def test_member_who_signs_up_mid_import_is_updated(self):
+        path = self.write('members.csv', 'email,first_name,last_name,phone,password\nlate@example.com,Late,Comer,0455,import-pw\n')
+        start_batch = MemberImport.start_batch
+        signed_up = {}
+
+        def sign_up_after_lookup(importer, batch, pool):
+            started = start_batch(importer, batch, pool)
+            signed_up['user'] = User.objects.create_user('late@example.com', 'Signed', 'Up', 'own-pw')
+            signed_up['version'] = user_version(signed_up['user'].pk)
+            return started
+
+        out = StringIO()
+        with mock.patch.object(MemberImport, 'start_batch', sign_up_after_lookup):
+            call_command('import_members', path, '--workers', '1', stdout=out)
+        self.assertIn('1 member(s): 0 new, 1 updated', out.getvalue())
+
+        user = signed_up['user']
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Late')
+        self.assertTrue(user.check_password('own-pw'))
+        self.assertNotEqual(user_version(user.pk), signed_up['version'])
+
+    def test_jsonl_invite_import(self):
+        path = self.write('members.jsonl', json.dumps(
+            {'email': 'invitee@example.com', 'first_name': 'In', 'last_name': 'Vitee', 'phone': '0444'}
+        ) + '\nnot json\n')
+        call_command('import_members', path, '--invite', stdout=StringIO())
+        self.assertFalse(User.objects.get(email='invitee@example.com').has_usable_password())
+
+
+class SeasonFeeRollOutTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        self.season = make_current_season()
+        self.gold = User.objects.create_user('gold@example.com', 'Gold', 'Player', 'pw', membership_type=User.MembershipType.GOLD_ANNUAL)
+        self.paid = User.objects.create_user('paid@example.com', 'Paid', 'Player', 'pw')
+        self.owing = User.objects.create_user('owing@example.com', 'Owing', 'Player', 'pw')
+        User.objects.create_user('gone@example.com', 'Gone', 'Player', 'pw', is_active=False)
+        self.admin = User.objects.create_superuser('admin@example.com', 'Ad', 'Min', 'pw')
+        PlayerSeasonFee.objects.create(player=self.paid, season=self.season, payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+
+    def statuses(self):
+        return dict(PlayerSeasonFee.objects.filter(season=self.season).values_list('player__email', 'payment_status'))
+
+    def test_roll_out_is_idempotent(self):
+        out = StringIO()
+        call_command('roll_out_season_fees', stdout=out)
+        self.assertIn('Created 2 fee row(s)', out.getvalue())
+        call_command('roll_out_season_fees', str(self.season.pk), stdout=out)
+        self.assertIn('Created 0 fee row(s)', out.getvalue())
+
+        self.assertEqual(self.statuses(), {
+            'gold@example.com': 'WAIVED_GOLD',
+            'paid@example.com': 'PAID',
+            'owing@example.com': 'PENDING',
+        })
+
+    def test_admin_action(self):
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:api_season_changelist'), {
+            'action': 'roll_out_fees', '_selected_action': [self.season.pk],
+        })
+        self.assertEqual(len(self.statuses()), 3)
+
+
+class ExpireMembershipsTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        yesterday = date.today() - timedelta(days=1)
+        self.gold = User.objects.create_user(
+            'gold@example.com', 'Gold', 'Player', 'pw', membership_type=User.MembershipType.GOLD_ANNUAL,
+            is_active_annual_member=True, annual_membership_expiry_date=yesterday
+        )
+        self.silver = User.objects.create_user(
+            'silver@example.com', 'Silver', 'Player', 'pw', membership_type=User.MembershipType.SILVER_ANNUAL,
+            is_active_annual_member=True, annual_membership_expiry_date=yesterday
+        )
+        SocialCard.objects.create(player=self.silver, sessions_remaining=4)
+        self.current = User.objects.create_user(
+            'current@example.com', 'Current', 'Player', 'pw', membership_type=User.MembershipType.GOLD_ANNUAL,
+            is_active_annual_member=True, annual_membership_expiry_date=date.today()
+        )
+
+    def test_demotes_and_audits_once(self):
+        token = RefreshToken.for_user(self.gold).access_token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(client.get(reverse('fixture-eligibility')).json()['is_fee_owed'], False)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('expire_memberships', '--batch-size', '1', stdout=StringIO())
+        call_command('expire_memberships', stdout=StringIO())
+
+        types = dict(User.objects.values_list('email', 'membership_type'))
+        self.assertEqual(types['gold@example.com'], User.MembershipType.GENERIC_USER)
+        self.assertEqual(types['silver@example.com'], User.MembershipType.SOCIAL_CARD_HOLDER)
+        self.assertEqual(types['current@example.com'], User.MembershipType.GOLD_ANNUAL)
+        self.assertFalse(User.objects.get(pk=self.gold.pk).is_active_annual_member)
+
+        changes = MembershipChange.objects.order_by('user_id').values_list('user__email', 'old_membership_type', 'new_membership_type')
+        self.assertEqual(list(changes), [
+            ('gold@example.com', 'GOLD_ANNUAL', 'GENERIC_USER'),
+            ('silver@example.com', 'SILVER_ANNUAL', 'SOCIAL_CARD_HOLDER'),
+        ])
+
+        # The cached copy of the user was dropped, so the fee now shows as owed
+        make_current_season()
+        season_resolver.invalidate()
+        self.assertEqual(client.get(reverse('fixture-eligibility')).json()['is_fee_owed'], True)
+
+    def test_demotion_reaches_other_processes(self):
+        # The command runs in its own process, with its own cache instance
+        self.enterContext(shared_cache(self.enterContext(tempfile.TemporaryDirectory())))
+        season_resolver.invalidate()
+        make_current_season()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.gold).access_token}')
+        first = client.get(reverse('fixture-eligibility'))
+        self.assertEqual(first.json()['is_fee_owed'], False)
+
+        with other_process(), self.captureOnCommitCallbacks(execute=True):
+            call_command('expire_memberships', stdout=StringIO())
+
+        response = client.get(reverse('fixture-eligibility'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['is_fee_owed'], True)
+
+
+@override_settings(STRIPE_CLIENT='stub')
+class ReconcilePaymentsTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        self.stripe = get_stripe_client().payment_intents
+        self.season = make_current_season()
+        self.payer = User.objects.create_user('payer@example.com', 'Pay', 'Er', 'pw')
+        self.buyer = User.objects.create_user('buyer@example.com', 'Buy', 'Er', 'pw', stripe_customer_id='cus_buyer')
+        PlayerSeasonFee.objects.create(player=self.payer, season=self.season)
+
+    def paid_intent(self, days_ago=0, **params):
+        params.setdefault('amount', 4000)
+        params.setdefault('currency', 'aud')
+        intent = self.stripe.create(params)
+        self.stripe.intents[intent.id]['created'] -= days_ago * 24 * 60 * 60
+        self.stripe.set_status(intent.id, 'succeeded')
+        return intent.id
+
+    def reconcile(self, *args):
+        out, err = StringIO(), StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('reconcile_payments', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_applies_lost_payments_once_and_reports_mismatches(self):
+        self.paid_intent(days_ago=2, receipt_email='PAYER@example.com', description='Fixture Fee payment for Current',
+                         metadata={'payment_type': 'fixture_fee', 'season_id': str(self.season.pk)})
+        card = self.paid_intent(customer='cus_buyer', description='Purchase of 10-Session Social Card')
+        self.paid_intent(receipt_email='stranger@example.com', description='Purchase of 10-Session Social Card')
+        self.stripe.create({'amount': 5000, 'currency': 'aud', 'receipt_email': 'payer@example.com'})
+
+        out, err = self.reconcile()
+        self.assertIn('marked 1 fee(s) paid, issued 1 card(s), 1 could not be matched', out)
+        self.assertIn('stranger@example.com', err)
+        self.assertEqual(PlayerSeasonFee.objects.get(player=self.payer).payment_status, PlayerSeasonFee.PaymentStatus.PAID)
+        self.assertEqual(SocialCard.objects.get(player=self.buyer).stripe_payment_intent_id, card)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).membership_type, User.MembershipType.SOCIAL_CARD_HOLDER)
+        self.assertIsNotNone(Watermark.objects.get(name='stripe_reconciliation').value)
+
+        # The next run re-reads the overlap but applies nothing twice
+        out, _ = self.reconcile()
+        self.assertIn('marked 0 fee(s) paid, issued 0 card(s)', out)
+        self.assertEqual(SocialCard.objects.count(), 1)
+
+    def test_lists_slices_side_by_side(self):
+        for days_ago in range(6):
+            self.paid_intent(days_ago=days_ago, receipt_email='buyer@example.com', description='Purchase of 10-Session Social Card')
+        self.stripe.latency = 0.05
+        self.stripe.max_in_flight = 0
+
+        out, _ = self.reconcile('--since', str(date.today() - timedelta(days=7)), '--until', str(date.today() + timedelta(days=1)),
+                                '--workers', '3', '--page-size', '1')
+        self.assertIn('issued 6 card(s)', out)
+        self.assertEqual(self.stripe.max_in_flight, 3)
+        # An explicit window leaves the watermark alone
+        self.assertFalse(Watermark.objects.filter(name='stripe_reconciliation', value__isnull=False).exists())
+
+    def test_live_client_across_rounds(self):
+        def list_intents(request):
+            created = int(request.url.params['created[gte]'])
+            return {'object': 'list', 'url': '/v1/payment_intents', 'has_more': False, 'data': [{
+                'id': f'pi_{created}', 'object': 'payment_intent', 'status': 'succeeded', 'created': created,
+                'customer': 'cus_buyer', 'description': 'Purchase of 10-Session Social Card', 'metadata': {},
+            }]}
+
+        # One worker, so each day of the window is a round on a new event loop
+        with live_stripe(list_intents) as transports:
+            out, _ = self.reconcile('--since', str(date.today() - timedelta(days=3)), '--until', str(date.today()),
+                                    '--workers', '1')
+        self.assertIn('issued 3 card(s)', out)
+        self.assertEqual(len(transports), 3)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin@example.com', 'Ad', 'Min', 'pw')
+        self.client.force_login(self.admin)
+        self.players = [User.objects.create_user(f'p{i}@example.com', 'P', str(i), 'pw') for i in range(3)]
+
+    def add_logs(self, players):
+        for player in players:
+            AttendanceLog.objects.create(player=player, date_of_play=date(2025, 5, 1), entry_time=timezone.now())
+            SocialCard.objects.create(player=player, sessions_remaining=5)
+
+    def changelist_queries(self, name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:api_{name}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        self.add_logs(self.players[:1])
+        few = {name: self.changelist_queries(name) for name in ('attendancelog', 'socialcard')}
+        self.add_logs(self.players[1:])
+        many = {name: self.changelist_queries(name) for name in ('attendancelog', 'socialcard')}
+        self.assertEqual(few, many)
+
+    def test_search_matches_exact_email(self):
+        self.add_logs(self.players)
+        response = self.client.get(reverse('admin:api_attendancelog_changelist'), {'q': 'p1@example.com'})
+        self.assertEqual([log.player.email for log in response.context['cl'].result_list], ['p1@example.com'])
+
+
+class ReplicaFallbackTests(TestCase):
+    @skipUnless(not replica_configured(), 'A replica is configured')
+    def test_reads_use_primary_without_replica(self):
+        with reading_from_replica():
+            self.assertEqual(router.db_for_read(User), 'default')
+        response = APIClient().get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_pin_reaches_other_processes(self):
+        # e.g. process_webhook_events pins a member who then reads from a worker
+        player = User.objects.create_user('p@example.com', 'P', 'Layer', 'pw')
+        self.enterContext(shared_cache(self.enterContext(tempfile.TemporaryDirectory())))
+        with mock.patch('api.replica.replica_configured', return_value=True):
+            with other_process():
+                pin_to_primary([player.pk])
+            self.assertTrue(pinned_to_primary(player))
+
+
+@skipUnless(replica_configured(), 'Set DATABASE_REPLICA_URL to test reads from the replica')
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class ReplicaRoutingTests(TransactionTestCase):
+    # The replica is a TEST MIRROR of the default database: a second
+    # connection to it, which only sees committed rows (hence a
+    # TransactionTestCase). What's checked is which connection was queried.
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        season_resolver.invalidate()
+        today = date.today()
+        make_season('Current', today - timedelta(days=30), today + timedelta(days=30))
+        get_current_season()
+        self.staff = User.objects.create_superuser('desk@example.com', 'Front', 'Desk', 'pw')
+        self.player = User.objects.create_user('p@example.com', 'P', 'Layer', 'pw')
+        self.client = APIClient()
+
+    def queries_on(self, alias, request):
+        with CaptureQueriesContext(connections[alias]) as queries:
+            response = request()
+        self.assertLess(response.status_code, 400)
+        return len(queries)
+
+    def test_read_only_view_reads_from_replica(self):
+        self.client.force_authenticate(self.staff)
+        report = lambda: self.client.get(reverse('attendance-report'), {'start': date.today(), 'end': date.today()})
+        self.assertEqual(self.queries_on(REPLICA, report), 1)
+
+    def test_reads_after_a_write_use_primary(self):
+        with reading_from_replica():
+            self.assertEqual(router.db_for_read(User), REPLICA)
+            User.objects.filter(pk=self.player.pk).update(first_name='Q')
+            self.assertEqual(router.db_for_read(User), 'default')
+        self.assertEqual(router.db_for_read(User), 'default')
+
+    def test_user_who_wrote_is_pinned_to_primary(self):
+        self.client.force_authenticate(self.staff)
+        self.client.post(reverse('attendance-check-in'), {'player_id': self.player.pk}, format='json')
+        self.assertTrue(pinned_to_primary(self.staff))
+
+        report = lambda: self.client.get(reverse('attendance-report'), {'start': date.today(), 'end': date.today()})
+        self.assertEqual(self.queries_on(REPLICA, report), 0)
+        cache.clear()
+        self.assertEqual(self.queries_on(REPLICA, report), 1)
+
+    def test_paid_member_is_pinned_to_primary(self):
+        signed_webhook(self.client, {
+            'id': 'evt_1', 'object': 'event', 'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': 'pi_1', 'receipt_email': 'p@example.com', 'description': 'Fixture Fee'}},
+        })
+        call_command('process_webhook_events', stdout=StringIO())
+        self.assertTrue(pinned_to_primary(self.player))
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        season_resolver.invalidate()
+        user_cache.clear()
+        today = date.today()
+        self.season = make_season('Current', today - timedelta(days=30), today + timedelta(days=30))
+        self.player = User.objects.create_user('p@example.com', 'P', 'Layer', 'pw')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.player).access_token}')
+        # Warm the auth and season caches, as they are in a running server
+        self.client.get(reverse('player-profile'))
+
+    def test_unchanged_eligibility_is_not_modified(self):
+        first = self.client.get(reverse('fixture-eligibility'))
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.json()['is_fee_owed'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('fixture-eligibility'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        # Without the ETag, the body comes from the cache
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('fixture-eligibility'))
+        self.assertEqual(response.json(), first.json())
+
+    def test_not_modified_is_cheaper_than_uncached(self):
+        # Cold: the user, the seasons and the fee from the database
+        cache.clear()
+        user_cache.clear()
+        season_resolver.invalidate()
+        with self.assertNumQueries(3):
+            first = self.client.get(reverse('fixture-eligibility'))
+        self.assertEqual(first.status_code, 200)
+
+        # Warm: no queries, and each version is read from the shared cache once
+        shared = caches['default']
+        with self.assertNumQueries(0), mock.patch.object(shared, 'get', wraps=shared.get) as get, \
+                mock.patch.object(shared, 'get_many', wraps=shared.get_many) as get_many:
+            response = self.client.get(reverse('fixture-eligibility'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(get.call_count + get_many.call_count, 3)
+
+    def test_paid_fee_changes_eligibility(self):
+        first = self.client.get(reverse('fixture-eligibility'))
+        signed_webhook(self.client, {
+            'id': 'evt_1', 'object': 'event', 'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': 'pi_1', 'receipt_email': 'p@example.com', 'description': 'Fixture Fee'}},
+        })
+        call_command('process_webhook_events', stdout=StringIO())
+
+        response = self.client.get(reverse('fixture-eligibility'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertFalse(response.json()['is_fee_owed'])
+
+    def test_fee_paid_by_another_process(self):
+        self.enterContext(shared_cache(self.enterContext(tempfile.TemporaryDirectory())))
+        first = self.client.get(reverse('fixture-eligibility'))
+        signed_webhook(self.client, {
+            'id': 'evt_1', 'object': 'event', 'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': 'pi_1', 'receipt_email': 'p@example.com', 'description': 'Fixture Fee'}},
+        })
+        with other_process():
+            call_command('process_webhook_events', stdout=StringIO())
+
+        response = self.client.get(reverse('fixture-eligibility'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['is_fee_owed'])
+
+    def test_per_process_cache_refused_in_production(self):
+        # Nor is a cache picked for production: CACHE_URL has to be set
+        for cache_url in ('locmem://', None):
+            env = dict(os.environ, DEBUG='False', CACHE_URL=cache_url or '')
+            if cache_url is None:
+                del env['CACHE_URL']
+            result = subprocess.run([sys.executable, '-c', 'import gctta_project.settings'], env=env, capture_output=True, text=True)
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn('ImproperlyConfigured', result.stderr)
+
+    def test_season_edit_changes_eligibility(self):
+        first = self.client.get(reverse('fixture-eligibility'))
+        self.season.fixture_fee_amount = Decimal('55.00')
+        self.season.save()
+
+        response = self.client.get(reverse('fixture-eligibility'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['amount_owed'], '55.00')
+
+    def test_profile(self):
+        first = self.client.get(reverse('player-profile'))
+        self.assertEqual(first.json()['email'], 'p@example.com')
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('player-profile'), HTTP_IF_NONE_MATCH=f'W/{first["ETag"]}')
+        self.assertEqual(response.status_code, 304)
+
+        self.player.phone = '0499'
+        self.player.save()
+        response = self.client.get(reverse('player-profile'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.json()['phone'], '0499')
+
+
+@override_settings(STRIPE_CLIENT='stub', STRIPE_WEBHOOK_SECRET='whsec_test')
+class QueryCountTests(TestCase):
+    """
+    Pins how many queries each endpoint and command makes. Every fixture has
+    several rows, so anything that starts querying once per row fails here.
+    If a change really needs another query, update the number on purpose.
+    """
+
+    def setUp(self):
+        season_resolver.invalidate()
+        user_cache.clear()
+        reset_stripe_client()
+        self.addCleanup(reset_stripe_client)
+        today = date.today()
+        self.season = make_season('Current', today - timedelta(days=30), today + timedelta(days=30))
+        self.staff = User.objects.create_superuser('desk@example.com', 'Front', 'Desk', 'pw')
+        self.players = [
+            User.objects.create_user(f'p{i}@example.com', 'P', str(i), 'pw', membership_type=membership_type)
+            for i, membership_type in enumerate([User.MembershipType.GENERIC_USER, User.MembershipType.SOCIAL_CARD_HOLDER,
+                                                 User.MembershipType.SILVER_ANNUAL])
+        ]
+        SocialCard.objects.create(player=self.players[1], sessions_remaining=5)
+        for day in (1, 2, 3):
+            for player in self.players:
+                entry = timezone.now() - timedelta(days=day)
+                AttendanceLog.objects.create(player=player, date_of_play=entry.date(), entry_time=entry,
+                                             exit_time=entry + timedelta(hours=1))
+        PlayerSeasonFee.objects.create(player=self.players[0], season=self.season, payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+        # Warm the season cache, as it is in a running server
+        get_current_season()
+
+        self.client = APIClient()
+
+    def as_user(self, user):
+        self.client.force_authenticate(user)
+        return self.client
+
+    def test_signup(self):
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('signup'), {
+                'email': 'new@example.com', 'first_name': 'N', 'last_name': 'U', 'phone': '0400',
+                'password': 'pw-123456', 'password2': 'pw-123456',
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_login(self):
+        # The user, then last_login
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('login'), {'email': 'p0@example.com', 'password': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile(self):
+        with self.assertNumQueries(0):
+            self.as_user(self.players[0]).get(reverse('player-profile'))
+
+    def test_player_history(self):
+        client = self.as_user(self.players[1])
+        # Fees, social cards and visits on the first page; only visits after it
+        with self.assertNumQueries(3):
+            page = client.get(reverse('player-history'), {'limit': 2}).json()
+        with self.assertNumQueries(1):
+            client.get(reverse('player-history'), {'limit': 2, 'cursor': page['next']})
+
+    def test_occupancy(self):
+        AttendanceLog.objects.filter(player__in=self.players[:2]).update(exit_time=None)
+        cache.clear()
+        # One recount, then reads come from the cache until it's due again
+        with self.assertNumQueries(1):
+            self.client.get(reverse('attendance-occupancy'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('attendance-occupancy'))
+
+    def test_occupancy_stream(self):
+        # Every display on a worker shares one count. It's run on this thread
+        # here (not the feed's own) so the count shows up in the connection
+        async def first_events(displays):
+            streams = [occupancy_events() for _ in range(displays)]
+            try:
+                return [[await anext(stream) for _ in range(2)] for stream in streams]
+            finally:
+                for stream in streams:
+                    await stream.aclose()
+
+        cache.clear()
+        with mock.patch.object(occupancy, 'sync_to_async', lambda func, **kwargs: sync_to_async(func)):
+            with self.assertNumQueries(1):
+                events = async_to_sync(first_events)(3)
+        self.assertEqual(len(events), 3)
+
+
+    def test_fixture_eligibility(self):
+        with self.assertNumQueries(1):
+            self.as_user(self.players[0]).get(reverse('fixture-eligibility'))
+
+    def test_bulk_fixture_eligibility(self):
+        with self.assertNumQueries(1):
+            response = self.as_user(self.staff).post(reverse('fixture-eligibility-bulk'),
+                                                     {'player_ids': [p.pk for p in self.players]}, format='json')
+            b''.join(response.streaming_content)
+
+    def test_create_payment_intent(self):
+        # An async view, so authenticated with a real token (from a warm user cache)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.players[0]).access_token}')
+        self.client.get(reverse('player-profile'))
+        with self.assertNumQueries(8):
+            response = self.client.post(reverse('create-payment-intent'), {'payment_type': 'social_card_purchase'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_check_in_and_out(self):
+        client = self.as_user(self.staff)
+        with self.assertNumQueries(6):
+            client.post(reverse('attendance-check-in'), {'player_id': self.players[1].pk}, format='json')
+        with self.assertNumQueries(5):
+            client.post(reverse('attendance-check-out'), {'player_id': self.players[1].pk}, format='json')
+
+    def test_scan_batch(self):
+        now = timezone.now()
+        events = [{'kind': 'in', 'player_id': p.pk, 'timestamp': now.isoformat()} for p in self.players]
+        with self.assertNumQueries(8):
+            response = self.as_user(self.staff).post(reverse('attendance-scans'), {'events': events}, format='json')
+        self.assertEqual(response.json()['checked_in'], 3)
+
+    def test_reports(self):
+        call_command('refresh_attendance_rollups', stdout=StringIO())
+        client = self.as_user(self.staff)
+        today = date.today()
+        with self.assertNumQueries(1):
+            client.get(reverse('attendance-report'), {'start': today - timedelta(days=7), 'end': today})
+        with self.assertNumQueries(1):
+            client.get(reverse('member-attendance-report'), {'month': today.strftime('%Y-%m')})
+
+    def test_export(self):
+        with self.assertNumQueries(1):
+            response = self.as_user(self.staff).get(reverse('export', args=['attendance']))
+            b''.join(response.streaming_content)
+
+    def test_auth_cache_stats(self):
+        with self.assertNumQueries(0):
+            self.as_user(self.staff).get(reverse('auth-cache-stats'))
+
+    def test_webhook_and_processing(self):
+        with self.assertNumQueries(1):
+            signed_webhook(self.client, {
+                'id': 'evt_1', 'object': 'event', 'type': 'payment_intent.succeeded',
+                'data': {'object': {'id': 'pi_1', 'receipt_email': 'p1@example.com', 'description': 'Fixture Fee'}},
+            })
+        with self.assertNumQueries(14):
+            call_command('process_webhook_events', stdout=StringIO())
+
+    def test_metrics(self):
+        with self.assertNumQueries(3):
+            self.client.get(reverse('metrics'))
+
+    def test_attendance_commands(self):
+        AttendanceLog.objects.update(exit_time=None)
+        # Per day, a keyset read of the batch's ids and its UPDATE
+        with self.assertNumQueries(21):
+            call_command('cleanup_attendance', stdout=StringIO())
+        with self.assertNumQueries(16):
+            call_command('refresh_attendance_rollups', stdout=StringIO())
+        with self.assertNumQueries(1):
+            call_command('export_data', 'attendance', stdout=StringIO())
+
+    def test_reconcile_payments(self):
+        stripe = get_stripe_client().payment_intents
+        for player, description in zip(self.players, ('Fixture Fee', 'Purchase of 10-Session Social Card', 'Fixture Fee')):
+            intent = stripe.create({'amount': 4000, 'currency': 'aud', 'receipt_email': player.email, 'description': description})
+            stripe.set_status(intent.id, 'succeeded')
+        # --since, so the run doesn't move the watermark
+        with self.assertNumQueries(12):
+            call_command('reconcile_payments', '--since', str(date.today() - timedelta(days=1)), stdout=StringIO())
+
+    def test_delete_attendance_logs(self):
+        # The (day, member) pairs, one insert of them, then a single DELETE
+        logs = AttendanceLog.objects.count()
+        with self.assertNumQueries(5):
+            self.assertEqual(delete_attendance_logs(AttendanceLog.objects.all()), logs)
+
+    def test_archive_attendance(self):
+        self.enterContext(archive_in(self.enterContext(tempfile.TemporaryDirectory())))
+        for day in (date(2024, 3, 5), date(2024, 3, 20), date(2024, 4, 2)):
+            entry = timezone.make_aware(timezone.datetime(day.year, day.month, day.day, 18, 0))
+            for player in self.players:
+                AttendanceLog.objects.create(player=player, date_of_play=day, entry_time=entry, exit_time=entry + timedelta(hours=1))
+        # The months, each month's reads and delete, then the open logs left behind
+        with self.assertNumQueries(14):
+            call_command('archive_attendance', '--older-than', '30', stdout=StringIO())
+
+    def test_member_commands(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = f'{directory.name}/members.csv'
+        with open(path, 'w') as f:
+            f.write('email,first_name,last_name,phone\n')
+            f.writelines(f'import{i}@example.com,I,M,0400\n' for i in range(3))
+            f.write('p0@example.com,P,Zero,0400\n')
+
+        # The lookup, the insert, the update and the check for late sign-ups
+        with self.assertNumQueries(6):
+            call_command('import_members', path, '--invite', stdout=StringIO())
+        with self.assertNumQueries(5):
+            call_command('roll_out_season_fees', stdout=StringIO())
+
+        User.objects.filter(pk__in=[p.pk for p in self.players]).update(
+            annual_membership_expiry_date=date.today() - timedelta(days=1), is_active_annual_member=True)
+        with self.assertNumQueries(8):
+            call_command('expire_memberships', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Query plans are only checked on PostgreSQL')
+class IndexUsageTests(TestCase):
+    """
+    The hot lookups can be answered from an index. Sequential scans are
+    turned off so a handful of test rows doesn't make the planner prefer one.
+    """
+
+    def setUp(self):
+        today = date.today()
+        self.season = make_season('Current', today - timedelta(days=30), today + timedelta(days=30))
+        self.player = User.objects.create_user('p@example.com', 'P', 'Layer', 'pw')
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, *names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in names), plan)
+
+    def test_season_for_date(self):
+        today = date.today()
+        self.assertUsesIndex(Season.objects.filter(start_date__lte=today, end_date__gte=today), 'season_dates_idx')
+
+    def test_paid_fee_lookup(self):
+        fees = PlayerSeasonFee.objects.filter(player=self.player, season=self.season,
+                                              payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+        self.assertUsesIndex(fees, 'unique_player_season_fee')
+
+    def test_admin_filters(self):
+        # The changelists list newest first
+        self.assertUsesIndex(User.objects.filter(membership_type=User.MembershipType.GOLD_ANNUAL).order_by('-pk'),
+                             'user_membership_type_idx')
+        self.assertUsesIndex(SocialCard.objects.filter(status=SocialCard.Status.USED_UP).order_by('-pk'), 'social_card_status_idx')
+        self.assertUsesIndex(PlayerSeasonFee.objects.filter(payment_status=PlayerSeasonFee.PaymentStatus.WAIVED_GOLD).order_by('-pk'),
+                             'fee_status_idx')
+
+    def test_pending_fees_for_season(self):
+        fees = PlayerSeasonFee.objects.filter(season=self.season, payment_status=PlayerSeasonFee.PaymentStatus.PENDING)
+        self.assertUsesIndex(fees, 'fee_season_pending_idx')
+
+    def test_player_attendance_history(self):
+        today = date.today()
+        logs = AttendanceLog.objects.filter(player=self.player, date_of_play__range=(today - timedelta(days=30), today))
+        self.assertUsesIndex(logs, 'attendance_player_date_idx')
+
+    def test_open_visits(self):
+        self.assertUsesIndex(AttendanceLog.objects.filter(date_of_play__lt=date.today(), exit_time__isnull=True),
+                             'attendance_open_by_date_idx', 'attendance_date_exit_idx')
+
+    def test_expired_memberships(self):
+        from .memberships import expired_members
+        self.assertUsesIndex(expired_members(date.today()), 'user_membership_expiry_idx')
@@ -4,16 +4,40 @@ from django.urls import path
 from .views import (
     UserRegistrationView,
     UserLoginView,
+    ProfileView,
     FixtureEligibilityView,
+    PlayerHistoryView,
+    BulkFixtureEligibilityView,
     CreatePaymentIntentView,
+    CheckInView,
+    CheckOutView,
+    ScanBatchView,
+    OccupancyView,
+    OccupancyStreamView,
+    AttendanceReportView,
+    MemberAttendanceReportView,
+    ExportView,
+    AuthCacheStatsView,
     StripeWebhookView # Import the new view
 )
 
 urlpatterns = [
     path('auth/signup/', UserRegistrationView.as_view(), name='signup'),
     path('auth/login/', UserLoginView.as_view(), name='login'),
+    path('player/profile/', ProfileView.as_view(), name='player-profile'),
+    path('player/history/', PlayerHistoryView.as_view(), name='player-history'),
     path('player/fixture_eligibility/', FixtureEligibilityView.as_view(), name='fixture-eligibility'),
+    path('player/fixture_eligibility/bulk/', BulkFixtureEligibilityView.as_view(), name='fixture-eligibility-bulk'),
     path('payments/create-intent/', CreatePaymentIntentView.as_view(), name='create-payment-intent'),
+    path('attendance/check-in/', CheckInView.as_view(), name='attendance-check-in'),
+    path('attendance/check-out/', CheckOutView.as_view(), name='attendance-check-out'),
+    path('attendance/scans/', ScanBatchView.as_view(), name='attendance-scans'),
+    path('attendance/occupancy/', OccupancyView.as_view(), name='attendance-occupancy'),
+    path('attendance/occupancy/stream/', OccupancyStreamView.as_view(), name='attendance-occupancy-stream'),
+    path('reports/attendance/', AttendanceReportView.as_view(), name='attendance-report'),
+    path('reports/attendance/members/', MemberAttendanceReportView.as_view(), name='member-attendance-report'),
+    path('exports/<str:dataset>/', ExportView.as_view(), name='export'),
+    path('stats/auth-cache/', AuthCacheStatsView.as_view(), name='auth-cache-stats'),
     # Add the URL for our new webhook endpoint
     path('stripe/webhook/', StripeWebhookView.as_view(), name='stripe-webhook'),
 ]
\ No newline at end of file
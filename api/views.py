@@ -1,107 +1,450 @@
 # api/views.py
 
+from asgiref.sync import sync_to_async
 from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, ParseError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.contrib.auth import authenticate
-from .serializers import UserRegistrationSerializer, UserSerializer
-from rest_framework.permissions import IsAuthenticated
-from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from .serializers import (
+    UserRegistrationSerializer,
+    user_payload,
+    BulkEligibilityRequestSerializer,
+    ScanSerializer,
+    ScanBatchSerializer,
+    ReportRangeSerializer,
+    ReportMonthSerializer,
+    PlayerHistorySerializer,
+    ExportRequestSerializer,
+)
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from .models import Season, PlayerSeasonFee, User
-from .services import create_stripe_payment_intent
+from .passwords import ahash_password, alogin
+from .services import acreate_stripe_payment_intent
+from .stripe_client import StripeBusy
+from .seasons import season_resolver
+from .history import attendance_page, player_cards, player_fees
+from .eligibility import fixture_eligibility_payload, roster_eligibility_rows, stream_roster_eligibility
+from .webhooks import astore_event, inbox_metrics
+from .attendance import CHECK_IN, CHECK_OUT, ingest_scans
+from .occupancy import occupancy_events, occupancy_payload, occupancy_snapshot
+from .rollups import daily_report, member_month_report
+from .exports import EXPORTS, export_filename, stream_export
+from .authentication import aauthenticate, request_user_version, user_cache
+from .conditional import member_versions, versioned_response
+from .metrics import merged_snapshot, render_prometheus
+from .permissions import IsAdminOrCaptain
+from .replica import ReplicaReadsMixin
 
 # New imports for the webhook
+import hmac
+import json
 import stripe
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 
 
-class UserRegistrationView(APIView):
-    def post(self, request):
-        serializer = UserRegistrationSerializer(data=request.data)
-        if serializer.is_valid():
-            user = serializer.save()
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'token': str(refresh.access_token),
-                'user': UserSerializer(user).data
-            }, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-
-class UserLoginView(APIView):
-    def post(self, request):
-        if 'email' not in request.data or 'password' not in request.data:
-            return Response({'error': 'Please provide both email and password'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        email = request.data['email']
-        password = request.data['password']
-        user = authenticate(username=email, password=password)
-
-        if user:
-            refresh = RefreshToken.for_user(user)
-            user_data = UserSerializer(user).data 
-            return Response({
-                'token': str(refresh.access_token),
-                'user': user_data
-            }, status=status.HTTP_200_OK)
-        
-        return Response({'error': 'Invalid Credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+@method_decorator(csrf_exempt, name='dispatch')
+class UserRegistrationView(View):
+    """
+    Signs a member up. An async view, so the password is hashed on the
+    hashing pool (see api/passwords.py) while the worker serves other requests.
+    """
+
+    async def post(self, request):
+        try:
+            serializer = UserRegistrationSerializer(data=request_body(request))
+        except APIException as e:
+            return api_error(e)
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        password_hash = await ahash_password(serializer.validated_data['password'])
+        user = await sync_to_async(serializer.save)(password_hash=password_hash)
+        return JsonResponse({
+            'token': str(AccessToken.for_user(user)),
+            'user': user_payload(user)
+        }, status=status.HTTP_201_CREATED)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UserLoginView(View):
+    """
+    Logs a member in. An async view, so checking the password runs on the
+    hashing pool, and a stored hash from an older hasher or work factor is
+    redone then. The token is made from the user already loaded, so a login
+    is one query plus the last_login UPDATE.
+    """
+
+    async def post(self, request):
+        try:
+            data = request_body(request)
+        except APIException as e:
+            return api_error(e)
+        if not isinstance(data.get('email'), str) or not isinstance(data.get('password'), str):
+            return JsonResponse({'error': 'Please provide both email and password'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = await alogin(request, data['email'], data['password'])
+        if user is None:
+            return JsonResponse({'error': 'Invalid Credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse({
+            'token': str(AccessToken.for_user(user)),
+            'user': user_payload(user)
+        })
+
+
+class ProfileView(APIView):
+    """
+    The signed-in member's own details. Answers with a 304 while the client's
+    ETag is current; the user comes from the auth cache, so that costs no queries.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        return versioned_response(request, 'profile', [request_user_version(user)], lambda: user_payload(user))
 
 
 class FixtureEligibilityView(APIView):
+    """
+    Whether the signed-in member owes this season's fixture fee. Polled by the
+    app, so answered with a 304 while the client's ETag is current, and
+    otherwise from a cached copy until the member, their fees or the seasons
+    change. A rebuilt body is read from the primary: it's cached until the
+    next change, so it mustn't come from a replica that is behind.
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
-        today = timezone.now().date()
 
-        if user.membership_type == User.MembershipType.GOLD_ANNUAL:
-            return Response({"is_fee_owed": False, "reason": "Gold Annual Members have fees included."})
+        current_season = None
+        if user.membership_type != User.MembershipType.GOLD_ANNUAL:
+            try:
+                current_season, season_version = season_resolver.get(with_version=True)
+            except Season.DoesNotExist:
+                return Response({"error": "No active season found."}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            season_version = season_resolver.version()
+
+        versions = [*member_versions(user.pk, request_user_version(user)), season_version, current_season and current_season.pk]
+        return versioned_response(request, 'fixture-eligibility', versions, lambda: self.payload(user, current_season))
+
+    def payload(self, user, current_season):
+        if current_season is None:
+            return fixture_eligibility_payload(user.membership_type, False, None)
 
-        try:
-            current_season = Season.objects.get(start_date__lte=today, end_date__gte=today)
-        except Season.DoesNotExist:
-            return Response({"error": "No active season found."}, status=status.HTTP_404_NOT_FOUND)
-        
         is_paid = PlayerSeasonFee.objects.filter(player=user, season=current_season, payment_status=PlayerSeasonFee.PaymentStatus.PAID).exists()
 
-        if is_paid:
-            return Response({"is_fee_owed": False, "season_name": current_season.name})
-        else:
-            return Response({
-                "is_fee_owed": True,
-                "amount_owed": str(current_season.fixture_fee_amount),
-                "season_name": current_season.name,
-                "due_date": current_season.fixture_fee_due_date
-            })
-
-class CreatePaymentIntentView(APIView):
+        return fixture_eligibility_payload(user.membership_type, is_paid, current_season)
+
+
+class PlayerHistoryView(ReplicaReadsMixin, APIView):
+    """
+    The signed-in member's visits, newest first, a page at a time: pass the
+    `next` cursor of one page as ?cursor= to get the next (?limit= sets the
+    page size). The first page also carries their social cards and season
+    fees. A fixed number of queries however deep the page: one for the
+    visits, and two more for the cards and fees on the first page.
+    """
     permission_classes = [IsAuthenticated]
 
+    def get(self, request):
+        serializer = PlayerHistorySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        position = serializer.validated_data.get('cursor')
+        rows, next_cursor = attendance_page(request.user.pk, position, serializer.validated_data['limit'])
+        data = {'attendance': rows, 'next': next_cursor}
+        if position is None:
+            data['social_cards'] = player_cards(request.user.pk)
+            data['fees'] = player_fees(request.user.pk)
+        return Response(data)
+
+
+class BulkFixtureEligibilityView(ReplicaReadsMixin, APIView):
+    """
+    Fixture eligibility for a whole roster at once, for the match-night desk.
+    Takes either a list of player_ids or a season (everyone with a fee row for
+    that season), and streams back the same payload as FixtureEligibilityView
+    for each player.
+
+    Staff see anyone; a team captain only sees the players on their own
+    teams, whichever ids they ask for.
+    """
+    permission_classes = [IsAdminOrCaptain]
+
     def post(self, request):
-        payment_type = request.data.get('payment_type')
+        serializer = BulkEligibilityRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            current_season = season_resolver.get()
+        except Season.DoesNotExist:
+            return Response({"error": "No active season found."}, status=status.HTTP_404_NOT_FOUND)
+
+        rows = roster_eligibility_rows(
+            current_season,
+            player_ids=serializer.validated_data.get('player_ids'),
+            roster_season=serializer.validated_data.get('season'),
+            captain=None if request.user.is_staff else request.user
+        )
+        return StreamingHttpResponse(
+            stream_roster_eligibility(current_season, rows),
+            content_type='application/json'
+        )
+
+def api_error(exc):
+    # The same body and status DRF's exception handler gives an APIException
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code, safe=False)
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        response['WWW-Authenticate'] = 'Bearer realm="api"'
+    return response
+
+
+def request_body(request):
+    """
+    The parsed body of a plain Django request, as DRF's request.data would
+    give it: JSON, or else form data.
+    """
+    if request.content_type != 'application/json':
+        return request.POST
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as e:
+        raise ParseError(f'JSON parse error - {e}')
+    if not isinstance(data, dict):
+        raise ParseError('Expected a JSON object.')
+    return data
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CreatePaymentIntentView(View):
+    """
+    Starts a payment. An async view (not DRF, which is sync only), so under
+    an ASGI server the worker serves other requests while this one waits on
+    Stripe, instead of a slow Stripe draining the pool of sync workers.
+    """
+
+    async def post(self, request):
+        try:
+            user = await aauthenticate(request)
+            if user is None:
+                raise NotAuthenticated()
+            request.user = user
+            payment_type = request_body(request).get('payment_type')
+        except APIException as e:
+            return api_error(e)
+
         if not payment_type:
-            return Response({'error': 'A payment_type is required.'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': 'A payment_type is required.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            client_secret = create_stripe_payment_intent(payment_type, request.user)
-            return Response({'client_secret': client_secret})
+            client_secret = await acreate_stripe_payment_intent(payment_type, user)
+            return JsonResponse({'client_secret': client_secret})
         except ValueError as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except StripeBusy:
+            response = JsonResponse({'error': 'The payment provider is busy, please try again shortly.'},
+                                    status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '5'
+            return response
         except Exception as e:
-            return Response({'error': 'An error occurred while communicating with the payment provider.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({'error': 'An error occurred while communicating with the payment provider.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class CheckInView(APIView):
+    """
+    A single door scan. Scanners log in with a staff account.
+    """
+    permission_classes = [IsAdminUser]
+    kind = CHECK_IN
+
+    def post(self, request):
+        serializer = ScanSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = ingest_scans([dict(serializer.validated_data, kind=self.kind)])
+        if summary['unknown_cards'] or summary['unmatched']:
+            return Response(dict(summary, error='No matching player, card or open visit found.'), status=status.HTTP_404_NOT_FOUND)
+        return Response(summary)
+
+
+class CheckOutView(CheckInView):
+    kind = CHECK_OUT
+
+
+class ScanBatchView(APIView):
+    """
+    Takes a buffered array of scanner events in one go. Offline scanners
+    replay everything they saved up once they're back online.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        serializer = ScanBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        summary = ingest_scans(serializer.validated_data['events'])
+        return Response(summary)
+
+
+class OccupancyView(APIView):
+    """
+    How many players are in the hall right now, for the front desk and the
+    public display. Read from the shared cache, so polling it doesn't touch
+    the database; only the periodic recount does (see api/occupancy.py).
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return Response(occupancy_payload())
+
+
+class OccupancyStreamView(View):
+    """
+    The occupancy as Server-Sent Events: one event now and one each time it
+    changes. Async, so under ASGI an open stream costs no thread. Every
+    stream in a worker shares one check of the count (see api/occupancy.py).
+
+    Streaming needs ASGI. Under WSGI the response would be buffered or hold a
+    worker for the whole stream, so there it sends one event and closes, and
+    the browser's EventSource polls by reconnecting.
+    """
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            response = HttpResponse(await sync_to_async(occupancy_snapshot)(), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            return response
+        response = StreamingHttpResponse(occupancy_events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Stops nginx-style proxies from buffering the events
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class AttendanceReportView(ReplicaReadsMixin, APIView):
+    """
+    Visits, unique players, average session length and social card sessions
+    per day (and per membership type) for ?start=YYYY-MM-DD&end=YYYY-MM-DD.
+    Served from the rollup tables, so it costs the same however big
+    AttendanceLog gets.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = ReportRangeSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        start, end = serializer.validated_data['start'], serializer.validated_data['end']
+        return Response({'start': start, 'end': end, 'days': daily_report(start, end)})
+
+
+class MemberAttendanceReportView(ReplicaReadsMixin, APIView):
+    """
+    Each member's attendance totals for ?month=YYYY-MM, from the monthly rollup.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = ReportMonthSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        month = serializer.validated_data['month']
+        return Response({'month': month.strftime('%Y-%m'), 'members': member_month_report(month)})
+
+
+class ExportView(ReplicaReadsMixin, APIView):
+    """
+    Streams attendance, fees or members out as CSV or JSON lines
+    (?file_format=csv|jsonl), optionally gzipped (?gzip=1), with
+    ?since=&until= (attendance dates) and ?season= filters.
+    Rows are read from a cursor and written as they arrive, so memory stays
+    flat however many rows there are.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, dataset):
+        if dataset not in EXPORTS:
+            return Response({'error': f"Unknown export '{dataset}'."}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = ExportRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        options = serializer.validated_data
+        export_format = options.pop('file_format')
+        gzip = options.pop('gzip')
+
+        response = StreamingHttpResponse(
+            stream_export(dataset, export_format, gzip, **options),
+            content_type='application/gzip' if gzip else ('text/csv' if export_format == 'csv' else 'application/x-ndjson')
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(dataset, export_format, gzip)}"'
+        return response
+
+
+class AuthCacheStatsView(APIView):
+    """
+    Hit/miss counters of the in-process JWT user cache (for this worker only).
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(user_cache.stats())
+
+
+class MetricsView(ReplicaReadsMixin, APIView):
+    """
+    Request metrics in the Prometheus text format, plus the webhook inbox
+    backlog. Scraped by Prometheus rather than called by users, so it skips
+    JWT auth and is guarded by METRICS_AUTH_TOKEN instead (when that's set).
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request):
+        token = settings.METRICS_AUTH_TOKEN
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+
+        inbox = inbox_metrics()
+        gauges = [
+            ('gctta_webhook_events', 'Stored Stripe webhook events, by status.',
+             [({'status': name}, count) for name, count in inbox['counts'].items()]),
+            ('gctta_webhook_events_due', 'Pending webhook events due for processing now.', [({}, inbox['due'])]),
+            ('gctta_webhook_oldest_pending_age_seconds', 'Age of the oldest pending webhook event.',
+             [({}, inbox['oldest_pending_age_seconds'])]),
+        ]
+        return HttpResponse(
+            render_prometheus(merged_snapshot(), gauges),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
 
 
 # This is the new View for handling Stripe's notifications
-class StripeWebhookView(APIView):
+@method_decorator(csrf_exempt, name='dispatch')
+class StripeWebhookView(View):
     """
     Stripe webhook handler.
     This view does not have authentication because it's called by Stripe's servers.
     Security is handled by verifying the webhook signature.
+    Async, like CreatePaymentIntentView, so a burst of events doesn't tie up workers.
     """
-    def post(self, request):
+    async def post(self, request):
         payload = request.body
         sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
         endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
@@ -118,38 +461,9 @@ class StripeWebhookView(APIView):
             # Invalid signature
             return HttpResponse(status=400)
 
-        # Handle the payment_intent.succeeded event
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            user_email = payment_intent.get('receipt_email')
-            description = payment_intent.get('description', '')
-
-            if not user_email:
-                return HttpResponse(status=400)
-            
-            try:
-                user = User.objects.get(email=user_email)
-
-                # Update the database based on the payment description
-                if 'Fixture Fee' in description:
-                    today = timezone.now().date()
-                    current_season = Season.objects.filter(start_date__lte=today, end_date__gte=today).first()
-                    if current_season:
-                        # Mark the fee as paid for this user and season
-                        PlayerSeasonFee.objects.update_or_create(
-                            player=user,
-                            season=current_season,
-                            defaults={'payment_status': PlayerSeasonFee.PaymentStatus.PAID}
-                        )
-                        print(f"SUCCESS: Updated fixture fee for {user.email}")
-                
-                # You can add more 'elif' blocks here to handle other payment types
-                # elif 'Social Card' in description:
-                #     ... create a new social card ...
-
-            except User.DoesNotExist:
-                print(f"ERROR: User with email {user_email} not found for successful payment.")
-        else:
-            print(f"Unhandled event type {event['type']}")
+        # Store the event and acknowledge it straight away. The actual work
+        # happens in the process_webhook_events command, so a slow database
+        # never turns into Stripe retries.
+        await astore_event(event['id'], event['type'], json.loads(payload))
 
-        return HttpResponse(status=200)
\ No newline at end of file
+        return HttpResponse(status=200)
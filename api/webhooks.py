@@ -0,0 +1,224 @@
+# api/webhooks.py
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+from .conditional import invalidate_fees
+from .models import StripeWebhookEvent, StripePaymentIntent, PlayerSeasonFee, Season, SocialCard, User
+from .replica import pin_to_primary
+from .seasons import get_current_season
+
+# Retry schedule for events that fail: 30s, 1m, 2m, 4m ... capped at an hour
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 60 * 60
+DEFAULT_MAX_ATTEMPTS = 8
+
+# Matches the "10-Session Social Card" we sell in services.py
+SOCIAL_CARD_SESSIONS = 10
+
+
+class WebhookProcessingError(Exception):
+    """
+    The event couldn't be applied right now, try it again later.
+    """
+
+
+class PermanentWebhookError(Exception):
+    """
+    The event can never be applied, so don't bother retrying it.
+    """
+
+
+def store_event(event_id, event_type, payload):
+    """
+    Saves a verified Stripe event to the inbox. Stripe redelivers events, so a
+    duplicate id is silently ignored by the unique constraint.
+    """
+    StripeWebhookEvent.objects.bulk_create(
+        [StripeWebhookEvent(stripe_event_id=event_id, event_type=event_type, payload=payload)],
+        ignore_conflicts=True
+    )
+
+
+async def astore_event(event_id, event_type, payload):
+    """
+    store_event() for the async webhook view.
+    """
+    await StripeWebhookEvent.objects.abulk_create(
+        [StripeWebhookEvent(stripe_event_id=event_id, event_type=event_type, payload=payload)],
+        ignore_conflicts=True
+    )
+
+
+def sync_payment_intent_record(payment_intent):
+    """
+    Copies the latest status from a payment_intent.* event onto our local
+    StripePaymentIntent record. Returns the record, or None if we didn't
+    create this intent (e.g. it was made in the Stripe dashboard).
+    """
+    record = (
+        StripePaymentIntent.objects
+        .select_related('season')
+        .filter(stripe_payment_intent_id=payment_intent['id'])
+        .first()
+    )
+    if record and record.status != payment_intent.get('status'):
+        record.status = payment_intent['status']
+        record.save(update_fields=['status', 'updated_at'])
+    return record
+
+
+def resolve_payment(payment_intent, record):
+    """
+    Works out (payment_type, season) for a succeeded intent. Our own record is
+    the most reliable source, then the metadata we attach, then the description.
+    """
+    metadata = payment_intent.get('metadata') or {}
+    description = payment_intent.get('description') or ''
+
+    if record:
+        return record.payment_type, record.season
+
+    payment_type = metadata.get('payment_type')
+    if not payment_type and 'Fixture Fee' in description:
+        payment_type = StripePaymentIntent.PaymentType.FIXTURE_FEE
+    elif not payment_type and 'Social Card' in description:
+        payment_type = StripePaymentIntent.PaymentType.SOCIAL_CARD_PURCHASE
+
+    season = None
+    if payment_type == StripePaymentIntent.PaymentType.FIXTURE_FEE:
+        season_id = metadata.get('season_id')
+        season = Season.objects.filter(pk=season_id).first() if season_id else None
+        if season is None:
+            season = get_current_season()
+    return payment_type, season
+
+
+def handle_event(event):
+    """
+    Applies one Stripe event (as a plain dict) to the database.
+    """
+    if not event['type'].startswith('payment_intent.'):
+        return
+
+    payment_intent = event['data']['object']
+    record = sync_payment_intent_record(payment_intent)
+
+    if event['type'] == 'payment_intent.succeeded':
+        user_email = payment_intent.get('receipt_email')
+
+        if not user_email:
+            raise PermanentWebhookError("Payment intent has no receipt_email.")
+
+        try:
+            user = User.objects.get(email=user_email)
+        except User.DoesNotExist:
+            raise WebhookProcessingError(f"User with email {user_email} not found for successful payment.")
+
+        payment_type, season = resolve_payment(payment_intent, record)
+
+        # Update the database based on what was paid for
+        if payment_type == StripePaymentIntent.PaymentType.FIXTURE_FEE:
+            if season:
+                # Mark the fee as paid for this user and season. The season
+                # roll-out has normally created the row already, so this is
+                # one UPDATE on the (player, season) unique index.
+                fees = PlayerSeasonFee.objects.filter(player=user, season=season)
+                if not fees.update(payment_status=PlayerSeasonFee.PaymentStatus.PAID):
+                    PlayerSeasonFee.objects.bulk_create(
+                        [PlayerSeasonFee(player=user, season=season, payment_status=PlayerSeasonFee.PaymentStatus.PAID)],
+                        ignore_conflicts=True
+                    )
+                    # In case a roll-out inserted a PENDING row in between
+                    fees.update(payment_status=PlayerSeasonFee.PaymentStatus.PAID)
+                # update() and bulk_create() don't send post_save
+                invalidate_fees(user.pk)
+
+        elif payment_type == StripePaymentIntent.PaymentType.SOCIAL_CARD_PURCHASE:
+            # Issue the card. Keyed on the payment, so a replayed event can't issue two.
+            SocialCard.objects.get_or_create(
+                stripe_payment_intent_id=payment_intent['id'],
+                defaults={'player': user, 'sessions_total': SOCIAL_CARD_SESSIONS, 'sessions_remaining': SOCIAL_CARD_SESSIONS}
+            )
+            if user.membership_type == User.MembershipType.GENERIC_USER:
+                user.membership_type = User.MembershipType.SOCIAL_CARD_HOLDER
+                user.save(update_fields=['membership_type'])
+
+        # The member is probably waiting on their eligibility or card right
+        # now, so don't let them read a replica that hasn't caught up
+        transaction.on_commit(lambda: pin_to_primary([user.pk]))
+
+
+def backoff_delay(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS))
+
+
+def process_pending_events(batch_size=100, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """
+    Claims one batch of due events and processes them.
+    The rows are locked with SKIP LOCKED, so several workers can drain the
+    inbox at the same time without ever picking up the same event.
+    Returns a dict with how many events were processed, retried and failed.
+    """
+    results = {'processed': 0, 'retried': 0, 'failed': 0}
+
+    with transaction.atomic():
+        now = timezone.now()
+        events = list(
+            StripeWebhookEvent.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=StripeWebhookEvent.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'pk')[:batch_size]
+        )
+
+        for event in events:
+            event.attempts += 1
+            try:
+                # A savepoint per event, so one bad event doesn't undo the rest
+                with transaction.atomic():
+                    handle_event(event.payload)
+            except PermanentWebhookError as e:
+                event.status = StripeWebhookEvent.Status.FAILED
+                event.last_error = str(e)
+                results['failed'] += 1
+            except Exception as e:
+                event.last_error = f"{type(e).__name__}: {e}"
+                if event.attempts >= max_attempts:
+                    event.status = StripeWebhookEvent.Status.FAILED
+                    results['failed'] += 1
+                else:
+                    event.next_attempt_at = now + backoff_delay(event.attempts)
+                    results['retried'] += 1
+            else:
+                event.status = StripeWebhookEvent.Status.PROCESSED
+                event.processed_at = timezone.now()
+                event.last_error = ''
+                results['processed'] += 1
+
+        StripeWebhookEvent.objects.bulk_update(
+            events, ['status', 'attempts', 'next_attempt_at', 'last_error', 'processed_at']
+        )
+
+    return results
+
+
+def inbox_metrics():
+    """
+    Backlog numbers for monitoring: events per status, how many pending
+    events are due right now, and the age in seconds of the oldest one.
+    """
+    now = timezone.now()
+    counts = {status: 0 for status in StripeWebhookEvent.Status.values}
+    for row in StripeWebhookEvent.objects.values('status').annotate(total=Count('pk')):
+        counts[row['status']] = row['total']
+
+    pending = StripeWebhookEvent.objects.filter(status=StripeWebhookEvent.Status.PENDING)
+    oldest = pending.aggregate(oldest=Min('received_at'))['oldest']
+
+    return {
+        'counts': counts,
+        'due': pending.filter(next_attempt_at__lte=now).count(),
+        'oldest_pending_age_seconds': (now - oldest).total_seconds() if oldest else 0,
+    }
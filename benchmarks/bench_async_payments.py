@@ -0,0 +1,125 @@
+# benchmarks/bench_async_payments.py
+#
+# Payment intent throughput when every Stripe call is slow, served the way
+# sync gunicorn workers would serve it vs the way one ASGI (uvicorn) worker does.
+#
+#   python -m benchmarks.bench_async_payments --stripe-latency 0.5 --workers 4
+#
+# Each request is a new social card purchase by a different member, so each
+# one makes one call to the offline Stripe stub, which sleeps for
+# --stripe-latency seconds.
+#
+#   sync   --workers threads, each sending one request at a time: what a pool
+#          of sync workers can do, one request per worker.
+#   asgi   one event loop sending --concurrency requests at once through the
+#          ASGI request path, as a single uvicorn worker would serve them.
+#
+# Requests per second and the most Stripe calls in flight at once show
+# whether the worker count is still the cap.
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import ThreadSensitiveContext  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.test import AsyncClient, Client  # noqa: E402
+from api.stripe_client import get_stripe_client  # noqa: E402
+from benchmarks import dataset  # noqa: E402
+from benchmarks.loadtest import QUICK, LoadContext, clean_up, percentile, snapshot  # noqa: E402
+
+URL = '/api/payments/create-intent/'
+BODY = {'payment_type': 'social_card_purchase'}
+
+
+def run_sync(ctx, requests, workers):
+    local = threading.local()
+
+    def send(i):
+        if not hasattr(local, 'client'):
+            local.client = Client(raise_request_exception=False)
+        started = time.perf_counter()
+        response = local.client.post(URL, BODY, content_type='application/json', **ctx.member_auth(i))
+        return time.perf_counter() - started, response.status_code
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(send, range(requests)))
+        wall = time.perf_counter() - started
+        list(pool.map(lambda _: connections.close_all(), range(workers)))
+    return results, wall
+
+
+async def run_asgi(ctx, requests, concurrency, offset):
+    client = AsyncClient(raise_request_exception=False)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def send(i):
+        async with limit:
+            # As the ASGI handler does: each request gets its own thread for sync code
+            async with ThreadSensitiveContext():
+                headers = {'Authorization': ctx.member_auth(i)['HTTP_AUTHORIZATION']}
+                started = time.perf_counter()
+                response = await client.post(URL, BODY, content_type='application/json', headers=headers)
+                return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(send(offset + i) for i in range(requests)))
+    return results, time.perf_counter() - started
+
+
+def report(mode, parallel, results, wall, stub):
+    latencies = sorted(r[0] for r in results)
+    errors = sum(1 for r in results if r[1] != 200)
+    print(f"{mode:<8}{parallel:>10}{len(results) / wall:>10.1f}{percentile(latencies, 50) * 1000:>10.0f}"
+          f"{percentile(latencies, 95) * 1000:>10.0f}{stub.max_in_flight:>12}{errors:>8}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Payment intent throughput, sync workers vs one ASGI worker, with a slow Stripe.')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per mode.')
+    parser.add_argument('--workers', type=int, default=4, help='Sync workers to compare against.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once on the event loop.')
+    parser.add_argument('--stripe-latency', type=float, default=0.5, help='Seconds the Stripe stub sleeps per call.')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # The load test's --quick dataset, so the two can share it
+    dataset.seed(random.Random(args.seed), users=QUICK['users'], cards=QUICK['cards'], logs=QUICK['logs'])
+    # Each request needs a member without an open intent, so a token each
+    ctx = LoadContext(random.Random(args.seed), args.requests)
+    if len(ctx.member_tokens) < 2 * args.requests:
+        sys.exit(f"Only {len(ctx.member_tokens)} members to buy as, lower --requests to {len(ctx.member_tokens) // 2}.")
+
+    stub = get_stripe_client().payment_intents
+    stub.latency = args.stripe_latency
+
+    print(f"\n{args.requests} payment intents per mode, Stripe latency {args.stripe_latency * 1000:.0f} ms\n")
+    print(f"{'mode':<8}{'parallel':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'in flight':>12}{'errors':>8}")
+
+    before = snapshot()
+    try:
+        stub.max_in_flight = 0
+        results, wall = run_sync(ctx, args.requests, args.workers)
+        report('sync', args.workers, results, wall, stub)
+
+        stub.max_in_flight = 0
+        results, wall = asyncio.run(run_asgi(ctx, args.requests, args.concurrency, offset=args.requests))
+        report('asgi', args.concurrency, results, wall, stub)
+    finally:
+        clean_up(before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# benchmarks/bench_export.py
+#
+# Peak memory of a large attendance export, streamed vs loaded in one go.
+#
+#   python -m benchmarks.bench_export --rows 1000000
+#
+# Seeds the benchmark database (see benchmarks/settings.py) with --rows
+# attendance logs, then runs each export in its own child process and reports
+# that process's peak RSS, so the seeding itself doesn't skew the numbers.
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from api.models import AttendanceLog  # noqa: E402
+from benchmarks import dataset  # noqa: E402
+
+
+def run_export(mode):
+    # Runs in the child process
+    from api.exports import EXPORTS, stream_export
+    devnull = open(os.devnull, 'w')
+    started = time.perf_counter()
+
+    if mode == 'streaming':
+        for chunk in stream_export('attendance', 'csv'):
+            devnull.write(chunk)
+    else:
+        # What a naive view or the admin does: every row as a model instance in memory
+        import csv
+        writer = csv.writer(devnull)
+        columns = EXPORTS['attendance']['columns']
+        logs = list(AttendanceLog.objects.select_related('player').order_by('pk'))
+        writer.writerow(columns)
+        for log in logs:
+            writer.writerow([log.pk, log.player_id, log.player.email, log.date_of_play,
+                             log.entry_time, log.exit_time, log.daily_session_consumed])
+
+    print(f"{time.perf_counter() - started:.2f}")
+
+
+def measure(mode):
+    child = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.bench_export', '--child', mode],
+        stdout=subprocess.PIPE, text=True
+    )
+    output = child.stdout.read()
+    _, status, usage = os.wait4(child.pid, 0)
+    child.stdout.close()
+    if status != 0:
+        raise SystemExit(f"{mode} export failed")
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    peak_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return float(output.strip()), peak_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Peak memory of a large attendance export, streamed vs loaded in one go.')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--players', type=int, default=20_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--naive', action='store_true', help='Also measure the load-everything export for comparison.')
+    parser.add_argument('--child', choices=['streaming', 'naive'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_export(args.child)
+        return
+
+    dataset.seed(random.Random(args.seed), users=args.players, cards=0, logs=args.rows)
+
+    modes = ['streaming'] + (['naive'] if args.naive else [])
+    for mode in modes:
+        seconds, peak_mb = measure(mode)
+        print(f"{mode:>10}: {seconds:7.2f}s  peak RSS {peak_mb:8.1f} MB  ({args.rows / seconds:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
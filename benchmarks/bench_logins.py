@@ -0,0 +1,116 @@
+# benchmarks/bench_logins.py
+#
+# Login throughput, with the password checked on the request thread as the
+# login view used to vs on the hashing pool from the async view (see
+# api/passwords.py).
+#
+#   python -m benchmarks.bench_logins --requests 200 --workers 4
+#
+#   thread   --workers threads, each logging in one member at a time the way
+#            the old sync view did: authenticate(), user_logged_in (which
+#            saves last_login, as the async view does), then a RefreshToken.
+#   async    one event loop posting --concurrency logins at once to
+#            /api/auth/login/, hashing on PASSWORD_HASH_WORKERS threads
+#            (--hash-workers, one per CPU by default).
+#
+# Logins per second per core divides by the CPU time the process used, so
+# the two modes compare fairly however many cores each kept busy. The
+# hasher and work factor are the usual settings (PASSWORD_HASHER,
+# PASSWORD_HASH_WORK_FACTOR); set them before seeding, or the first login of
+# each member rehashes their password.
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from asgiref.sync import ThreadSensitiveContext  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import authenticate, user_logged_in  # noqa: E402
+from django.db import connections  # noqa: E402
+from django.test import AsyncClient  # noqa: E402
+from rest_framework_simplejwt.tokens import RefreshToken  # noqa: E402
+from api.passwords import reset_hashing_executor  # noqa: E402
+from api.serializers import UserSerializer  # noqa: E402
+from benchmarks import dataset  # noqa: E402
+from benchmarks.dataset import BENCH_PASSWORD  # noqa: E402
+from benchmarks.loadtest import QUICK, LoadContext, percentile  # noqa: E402
+
+URL = '/api/auth/login/'
+
+
+def run_thread(emails, requests, workers):
+    def login(i):
+        started = time.perf_counter()
+        user = authenticate(username=emails[i % len(emails)], password=BENCH_PASSWORD)
+        if user is not None:
+            user_logged_in.send(sender=user.__class__, request=None, user=user)
+            str(RefreshToken.for_user(user).access_token)
+            UserSerializer(user).data
+        return time.perf_counter() - started, 200 if user is not None else 401
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(login, range(requests)))
+        list(pool.map(lambda _: connections.close_all(), range(workers)))
+    return results
+
+
+async def run_async(emails, requests, concurrency):
+    client = AsyncClient(raise_request_exception=False)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def login(i):
+        async with limit:
+            async with ThreadSensitiveContext():
+                started = time.perf_counter()
+                response = await client.post(URL, {'email': emails[i % len(emails)], 'password': BENCH_PASSWORD},
+                                             content_type='application/json')
+                return time.perf_counter() - started, response.status_code
+
+    return await asyncio.gather(*(login(i) for i in range(requests)))
+
+
+def measure(mode, parallel, run):
+    cpu, started = time.process_time(), time.perf_counter()
+    results = run()
+    wall, cpu = time.perf_counter() - started, time.process_time() - cpu
+    latencies = sorted(r[0] for r in results)
+    errors = sum(1 for r in results if r[1] != 200)
+    print(f"{mode:<8}{parallel:>10}{len(results) / wall:>10.1f}{len(results) / cpu:>12.1f}{cpu / wall:>8.1f}"
+          f"{percentile(latencies, 50) * 1000:>10.0f}{percentile(latencies, 95) * 1000:>10.0f}{errors:>8}", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Login throughput, hashing on the request thread vs the hashing pool.')
+    parser.add_argument('--requests', type=int, default=200, help='Logins per mode.')
+    parser.add_argument('--workers', type=int, default=1, help='Threads logging in for the thread mode.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Logins in flight at once on the event loop.')
+    parser.add_argument('--hash-workers', type=int, default=0, help='Hashing pool size (0 for one per CPU).')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset.seed(random.Random(args.seed), users=QUICK['users'], cards=QUICK['cards'], logs=QUICK['logs'])
+    emails = LoadContext(random.Random(args.seed), args.requests).member_emails
+
+    settings.PASSWORD_HASH_WORKERS = args.hash_workers
+    reset_hashing_executor()
+    hash_workers = args.hash_workers or os.cpu_count()
+
+    print(f"\n{args.requests} logins per mode, {settings.PASSWORD_HASHER} "
+          f"(work factor {settings.PASSWORD_HASH_WORK_FACTOR or 'default'}), {os.cpu_count()} CPUs\n")
+    print(f"{'mode':<8}{'parallel':>10}{'req/s':>10}{'req/s/core':>12}{'cores':>8}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+
+    measure('thread', args.workers, lambda: run_thread(emails, args.requests, args.workers))
+    measure('async', f'{args.concurrency}/{hash_workers}', lambda: asyncio.run(run_async(emails, args.requests, args.concurrency)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/bench_serializers.py
+#
+# Time and memory to build and render the hottest response bodies, the way
+# DRF's ModelSerializer and JSONRenderer do it vs the compiled serializer and
+# FastJSONRenderer (see api/serializers.py and api/renderers.py).
+#
+#   python -m benchmarks.bench_serializers --iterations 20000
+#
+#   user          the member dict login, signup and the profile return,
+#                 from a model instance (and from a values() row)
+#   eligibility   the fixture eligibility body for a member who owes the fee
+#
+# Nothing touches the database: the members and the season are built in
+# memory. Time is per body; memory is the most tracemalloc saw allocated at
+# once while one body was built and rendered, the median over a few hundred.
+
+import argparse
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+from api import renderers  # noqa: E402
+from api.eligibility import fixture_eligibility_payload  # noqa: E402
+from api.models import Season, User  # noqa: E402
+from api.serializers import UserSerializer, user_payload  # noqa: E402
+
+MEMORY_SAMPLES = 300
+
+
+def make_users(rng, count):
+    users = []
+    for i in range(count):
+        annual = rng.random() < 0.2
+        users.append(User(
+            pk=i + 1, first_name=f'First{i}', last_name=f'Last{i}', email=f'member{i}@example.com',
+            phone=f'04{rng.randrange(10 ** 8):08d}',
+            dob=date(1950, 1, 1) + timedelta(days=rng.randrange(20000)) if rng.random() < 0.8 else None,
+            membership_type=rng.choice(User.MembershipType.values),
+            is_active_annual_member=annual,
+            annual_membership_expiry_date=date.today() + timedelta(days=rng.randrange(365)) if annual else None,
+        ))
+    return users
+
+
+def cases(users):
+    drf, fast = JSONRenderer(), renderers.FastJSONRenderer()
+    rows = [{field: getattr(user, field) for field in user_payload.fields} for user in users]
+    season = Season(pk=1, name='Winter', start_date=date.today(), end_date=date.today() + timedelta(days=90),
+                    fixture_fee_amount=Decimal('40.00'), fixture_fee_due_date=date.today())
+
+    yield 'user', 'ModelSerializer + JSONRenderer', users, lambda user: drf.render(UserSerializer(user).data)
+    yield 'user', 'compiled + JSONRenderer', users, lambda user: drf.render(user_payload(user))
+    yield 'user', 'compiled + FastJSONRenderer', users, lambda user: fast.render(user_payload(user))
+    yield 'user row', 'compiled + FastJSONRenderer', rows, lambda row: fast.render(user_payload(row))
+    yield 'eligibility', 'JSONRenderer', users, lambda user: drf.render(
+        fixture_eligibility_payload(User.MembershipType.GENERIC_USER, False, season))
+    yield 'eligibility', 'FastJSONRenderer', users, lambda user: fast.render(
+        fixture_eligibility_payload(User.MembershipType.GENERIC_USER, False, season))
+
+
+def per_body_seconds(build, items, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        build(items[i % len(items)])
+    return (time.perf_counter() - started) / iterations
+
+
+def per_body_peak(build, items):
+    peaks = []
+    tracemalloc.start()
+    for i in range(MEMORY_SAMPLES):
+        item = items[i % len(items)]
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        body = build(item)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        del body
+    tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serialization time and memory, DRF vs the compiled fast path.')
+    parser.add_argument('--iterations', type=int, default=20_000, help='Bodies built per case for the timing.')
+    parser.add_argument('--users', type=int, default=1_000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    users = make_users(random.Random(args.seed), args.users)
+    engine = 'orjson' if renderers.orjson is not None else 'json (orjson not installed)'
+    print(f"\n{args.iterations} bodies per case, FastJSONRenderer encoding with {engine}\n")
+    print(f"{'body':<14}{'path':<34}{'us/body':>10}{'bodies/s':>12}{'peak bytes':>12}")
+
+    baseline = {}
+    for body, path, items, build in cases(users):
+        build(items[0])  # warm up
+        seconds = per_body_seconds(build, items, args.iterations)
+        peak = per_body_peak(build, items)
+        speedup = baseline.setdefault(body.split()[0], seconds) / seconds
+        print(f"{body:<14}{path:<34}{seconds * 1e6:>10.1f}{1 / seconds:>12,.0f}{peak:>12,.0f}  x{speedup:.1f}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
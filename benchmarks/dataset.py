@@ -0,0 +1,148 @@
+# benchmarks/dataset.py
+#
+# Seeds the benchmark database with a realistic, reproducible club: members of
+# every membership type, social cards, season fees and years of attendance.
+# Everything comes from one seeded random.Random, so the same arguments always
+# produce the same data.
+
+import io
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.db import connection
+
+from api.models import AttendanceLog, PlayerSeasonFee, Season, SocialCard, User
+
+BATCH_SIZE = 10000
+BENCH_PASSWORD = 'bench-password-123'
+BENCH_EMAIL_DOMAIN = 'bench.example'
+
+MEMBERSHIP_WEIGHTS = [
+    (User.MembershipType.GENERIC_USER, 45),
+    (User.MembershipType.SOCIAL_CARD_HOLDER, 30),
+    (User.MembershipType.SILVER_ANNUAL, 15),
+    (User.MembershipType.GOLD_ANNUAL, 10),
+]
+
+
+def bench_email(i):
+    return f'player{i}@{BENCH_EMAIL_DOMAIN}'
+
+
+def _bulk(model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed(rng, users=20000, cards=8000, logs=2000000, years=3, verbose=True):
+    """
+    Migrates the benchmark database and fills it. Does nothing if it already
+    holds a dataset of this size. Returns a dict describing the dataset.
+    """
+    call_command('migrate', verbosity=0)
+    today = date.today()
+    description = {'users': users, 'cards': cards, 'logs': logs, 'years': years}
+
+    if (User.objects.filter(email__endswith='@' + BENCH_EMAIL_DOMAIN, is_staff=False).count() == users
+            and AttendanceLog.objects.count() == logs):
+        return description
+
+    def say(message):
+        if verbose:
+            print(message, flush=True)
+
+    say("Clearing old benchmark data...")
+    for model in (AttendanceLog, SocialCard, PlayerSeasonFee):
+        model.objects.all().delete()
+    User.objects.all().delete()
+    Season.objects.all().delete()
+
+    say("Seeding seasons...")
+    seasons = []
+    for year in range(today.year - years, today.year + 1):
+        start = date(year, 1, 1)
+        seasons.append(Season.objects.create(
+            name=f'Season {year}',
+            start_date=start,
+            end_date=date(year, 12, 31),
+            fixture_fee_amount=Decimal('85.00'),
+            fixture_fee_due_date=start + timedelta(days=30),
+        ))
+
+    say(f"Seeding {users:,} users...")
+    # One hash shared by every member, so seeding doesn't spend hours in PBKDF2
+    password = make_password(BENCH_PASSWORD)
+    types = [t for t, _ in MEMBERSHIP_WEIGHTS]
+    weights = [w for _, w in MEMBERSHIP_WEIGHTS]
+    _bulk(User, (
+        User(
+            email=bench_email(i),
+            first_name='Bench',
+            last_name=f'Player{i}',
+            phone=f'04{rng.randrange(10 ** 8):08d}',
+            dob=date(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55)),
+            membership_type=membership_type,
+            is_active_annual_member=membership_type in (User.MembershipType.GOLD_ANNUAL, User.MembershipType.SILVER_ANNUAL),
+            annual_membership_expiry_date=today + timedelta(days=rng.randrange(-60, 365)) if membership_type in (User.MembershipType.GOLD_ANNUAL, User.MembershipType.SILVER_ANNUAL) else None,
+            password=password,
+        )
+        for i, membership_type in enumerate(rng.choices(types, weights, k=users))
+    ))
+    User.objects.create_superuser(f'desk@{BENCH_EMAIL_DOMAIN}', 'Bench', 'Desk', BENCH_PASSWORD)
+    player_ids = list(User.objects.filter(is_staff=False).order_by('pk').values_list('pk', flat=True))
+
+    say(f"Seeding {cards:,} social cards...")
+    _bulk(SocialCard, (
+        SocialCard(
+            player_id=rng.choice(player_ids),
+            sessions_total=10,
+            sessions_remaining=remaining,
+            status=SocialCard.Status.ACTIVE if remaining else SocialCard.Status.USED_UP,
+        )
+        for remaining in (rng.randrange(0, 11) for _ in range(cards))
+    ))
+
+    say("Seeding season fees...")
+    _bulk(PlayerSeasonFee, (
+        PlayerSeasonFee(
+            player_id=player_id,
+            season=season,
+            payment_status=rng.choice([PlayerSeasonFee.PaymentStatus.PAID, PlayerSeasonFee.PaymentStatus.PENDING]),
+        )
+        for season in seasons
+        for player_id in rng.sample(player_ids, len(player_ids) // 2)
+    ))
+
+    say(f"Seeding {logs:,} attendance logs...")
+    first_day = today - timedelta(days=365 * years)
+    span = (today - first_day).days
+
+    def attendance():
+        for _ in range(logs):
+            day = first_day + timedelta(days=rng.randrange(span))
+            entry = datetime(day.year, day.month, day.day, rng.randrange(8, 21), rng.randrange(60), tzinfo=dt_timezone.utc)
+            yield AttendanceLog(
+                player_id=rng.choice(player_ids),
+                date_of_play=day,
+                entry_time=entry,
+                exit_time=entry + timedelta(minutes=rng.randrange(30, 240)),
+                daily_session_consumed=rng.random() < 0.3,
+            )
+    _bulk(AttendanceLog, attendance())
+
+    say("Building attendance rollups...")
+    call_command('refresh_attendance_rollups', stdout=io.StringIO())
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    say("Seeding done.")
+    return description
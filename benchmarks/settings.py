@@ -0,0 +1,31 @@
+# benchmarks/settings.py
+
+# Settings for the local benchmarks. Same as the real project, but pointed at
+# a throwaway database (BENCH_DATABASE_URL, a SQLite file by default) and the
+# offline Stripe stub, so nothing here can touch real data or real payments.
+
+import os
+import tempfile
+
+import dj_database_url
+
+from gctta_project.settings import *  # noqa: F401,F403
+
+DEBUG = False
+ALLOWED_HOSTS = ['*']
+
+BENCH_DATABASE_URL = os.environ.get(
+    'BENCH_DATABASE_URL',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'gctta-bench.sqlite3')
+)
+DATABASES = {
+    'default': dj_database_url.parse(BENCH_DATABASE_URL, conn_max_age=600),
+}
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # The load test writes from several threads at once. IMMEDIATE takes the
+    # write lock when a transaction starts, so writers queue up for it (for up
+    # to `timeout` seconds) instead of failing with "database is locked".
+    DATABASES['default']['OPTIONS'] = {'timeout': 30, 'transaction_mode': 'IMMEDIATE'}
+
+STRIPE_CLIENT = 'stub'
+STRIPE_WEBHOOK_SECRET = 'whsec_bench'
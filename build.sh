@@ -5,4 +5,7 @@ set -o errexit
 pip install -r requirements.txt
 
 python3 manage.py collectstatic --no-input
-python3 manage.py migrate
\ No newline at end of file
+python3 manage.py migrate
+
+# The shared cache table, for CACHE_URL=db:// (does nothing for other backends)
+python3 manage.py createcachetable
@@ -5,6 +5,14 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+The payment intent and Stripe webhook views are async, so serve the project
+from here with uvicorn, rather than from wsgi.py with sync gunicorn workers:
+
+    uvicorn gctta_project.asgi:application --host 0.0.0.0 --port $PORT --workers 4
+
+The occupancy stream (attendance/occupancy/stream/) only streams under ASGI;
+served from wsgi.py it sends one event per request and the display polls.
 """
 
 import os
@@ -1,8 +1,13 @@
 # gctta_project/settings.py
 
 from pathlib import Path
+import importlib.util
+import json
 import os
+import sys
 import dj_database_url
+from django.conf import global_settings
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -32,8 +37,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
+    'api.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +84,52 @@ else:
         }
     }
 
+# An optional read-only replica for reports, exports and other read-only
+# endpoints (see api/replica.py). Without one, everything uses 'default'.
+# To try it locally, point DATABASE_REPLICA_URL at a copy of the database,
+# e.g. sqlite:///replica.sqlite3. Tests read the replica through the
+# default test database (TEST MIRROR).
+if 'DATABASE_REPLICA_URL' in os.environ:
+    replica_url = os.environ['DATABASE_REPLICA_URL']
+    DATABASES['replica'] = dj_database_url.parse(replica_url, conn_max_age=600, ssl_require=not replica_url.startswith('sqlite'))
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+
+DATABASE_ROUTERS = ['api.replica.ReplicaRouter']
+# How long a user's reads stay on the primary after they write
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', '5'))
+
+# The cache every worker process and management command shares. The version
+# tokens behind the auth cache, ETags and cached bodies (api/authentication.py,
+# api/conditional.py), the season index (api/seasons.py) and the replica pins
+# (api/replica.py) are only invalidated everywhere if they live here, so it
+# must not be a per-process cache in production, and outside DEBUG it has to
+# be set explicitly. CACHE_URL is one of:
+#
+#   redis://host:6379/0   Redis, what production should use
+#   db://                 a table in the default database, created by
+#                         `manage.py createcachetable`. Every version lookup
+#                         is then a query, so the ETags cost more queries
+#                         than they save; only for small setups
+#   locmem://             per process, only for DEBUG and tests
+TESTING = sys.argv[1:2] == ['test']
+CACHE_URL = os.environ.get('CACHE_URL', 'locmem://' if DEBUG or TESTING else '')
+if not CACHE_URL:
+    raise ImproperlyConfigured("Set CACHE_URL (e.g. redis://host:6379/0) when DEBUG is off.")
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL == 'db://':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'api_cache'}}
+elif CACHE_URL == 'locmem://':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+else:
+    raise ImproperlyConfigured(f"Unsupported CACHE_URL {CACHE_URL!r}.")
+
+if CACHE_URL == 'locmem://' and not (DEBUG or TESTING):
+    raise ImproperlyConfigured(
+        "CACHE_URL=locmem:// keeps a separate cache in every process, so workers would serve stale "
+        "data. Use redis:// or db:// outside DEBUG."
+    )
+
 
 AUTH_USER_MODEL = 'api.User'
 
@@ -87,8 +140,45 @@ AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',},
 ]
 
+# How passwords are hashed (see api/passwords.py). PASSWORD_HASHER is the
+# algorithm new hashes use and PASSWORD_HASH_WORK_FACTOR its cost: PBKDF2
+# iterations, Argon2 time cost, bcrypt rounds or the scrypt N (0 keeps
+# Django's default). Stored hashes made any other way still check, and are
+# redone with these settings on the member's next login. Logins and sign-ups
+# hash on PASSWORD_HASH_WORKERS threads per worker process (0 for one per CPU).
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2_sha256')
+PASSWORD_HASH_WORK_FACTOR = int(os.environ.get('PASSWORD_HASH_WORK_FACTOR', '0'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '0'))
+_PASSWORD_HASHERS = {
+    'pbkdf2_sha256': 'api.passwords.PBKDF2PasswordHasher',
+    'pbkdf2_sha1': 'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'argon2': 'api.passwords.Argon2PasswordHasher',
+    'bcrypt_sha256': 'api.passwords.BCryptSHA256PasswordHasher',
+    'scrypt': 'api.passwords.ScryptPasswordHasher',
+}
+if PASSWORD_HASHER not in _PASSWORD_HASHERS:
+    raise ImproperlyConfigured(f"PASSWORD_HASHER must be one of {', '.join(_PASSWORD_HASHERS)}.")
+# argon2 and bcrypt_sha256 need a library requirements.txt doesn't install
+_PASSWORD_HASHER_PACKAGES = {'argon2': ('argon2', 'argon2-cffi'), 'bcrypt_sha256': ('bcrypt', 'bcrypt')}
+if PASSWORD_HASHER in _PASSWORD_HASHER_PACKAGES:
+    module, package = _PASSWORD_HASHER_PACKAGES[PASSWORD_HASHER]
+    if importlib.util.find_spec(module) is None:
+        raise ImproperlyConfigured(f"PASSWORD_HASHER={PASSWORD_HASHER} needs the {package} package installed.")
+if PASSWORD_HASHER == 'scrypt' and PASSWORD_HASH_WORK_FACTOR:
+    if PASSWORD_HASH_WORK_FACTOR < 2 or PASSWORD_HASH_WORK_FACTOR & (PASSWORD_HASH_WORK_FACTOR - 1):
+        raise ImproperlyConfigured("PASSWORD_HASH_WORK_FACTOR is scrypt's N, so it must be a power of two.")
+# The first is the one new hashes use
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+]
+# ModelBackend, with the password checked on the hashing pool when logging in
+# from an async view
+AUTHENTICATION_BACKENDS = ['api.passwords.HashingPoolModelBackend']
+
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'Australia/Brisbane'
+# The time zone the club's days are counted in, e.g. when closing off a day's visits
+CLUB_TIME_ZONE = os.environ.get('CLUB_TIME_ZONE', TIME_ZONE)
 USE_I18N = True
 USE_TZ = True
 
@@ -102,9 +192,72 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
-    'DEFAULT_AUTHENTICATION_CLASSES': ('rest_framework_simplejwt.authentication.JWTAuthentication',)
+    'DEFAULT_AUTHENTICATION_CLASSES': ('api.authentication.CachedJWTAuthentication',),
+    # Encodes with orjson when it's installed (see api/renderers.py)
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
 }
 
+# The JWT authentication keeps recently seen users in memory (see api/authentication.py)
+AUTH_USER_CACHE_SIZE = int(os.environ.get('AUTH_USER_CACHE_SIZE', '2000'))
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', '60'))
+
 # Stripe API Keys from Environment Variables
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
-STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+
+# How we talk to Stripe. Set STRIPE_CLIENT to 'stub' to use the offline
+# in-memory client from api/stripe_stub.py (tests and local benchmarks).
+STRIPE_CLIENT = os.environ.get('STRIPE_CLIENT', 'live')
+STRIPE_TIMEOUT = float(os.environ.get('STRIPE_TIMEOUT', '10'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', '2'))
+STRIPE_HTTP_POOL_SIZE = int(os.environ.get('STRIPE_HTTP_POOL_SIZE', '10'))
+# Stripe calls from async views in flight at once per worker, and how long
+# another may wait for a turn before the request gives up with a 503
+STRIPE_ASYNC_CONCURRENCY = int(os.environ.get('STRIPE_ASYNC_CONCURRENCY', '50'))
+STRIPE_QUEUE_TIMEOUT = float(os.environ.get('STRIPE_QUEUE_TIMEOUT', '5'))
+
+# Per-request metrics (api/middleware.py), served at /metrics. Under gunicorn,
+# point METRICS_MULTIPROC_DIR at a directory all workers share (and empty it
+# before the server starts) so /metrics reports for every worker, not just the
+# one that answered the scrape. Set METRICS_AUTH_TOKEN to require
+# "Authorization: Bearer <token>" on /metrics.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '1'))
+METRICS_AUTH_TOKEN = os.environ.get('METRICS_AUTH_TOKEN')
+
+# The live occupancy count (api/occupancy.py): how often it's recounted from
+# the database, how often each worker checks it for SSE streams, and how long
+# one stream stays open before the display reconnects
+OCCUPANCY_RECONCILE_SECONDS = int(os.environ.get('OCCUPANCY_RECONCILE_SECONDS', '300'))
+OCCUPANCY_STREAM_INTERVAL = float(os.environ.get('OCCUPANCY_STREAM_INTERVAL', '1'))
+OCCUPANCY_STREAM_SECONDS = int(os.environ.get('OCCUPANCY_STREAM_SECONDS', '300'))
+
+# Where archive_attendance keeps closed attendance logs it has moved out of the
+# database (see api/archive.py), and how old a log must be before it's moved.
+# The segments are the only copy of those rows, so they're written through a
+# Django storage backend (STORAGES['attendance_archive']) that should be
+# durable, e.g. S3 with django-storages:
+#
+#   ATTENDANCE_ARCHIVE_STORAGE=storages.backends.s3.S3Storage
+#   ATTENDANCE_ARCHIVE_STORAGE_OPTIONS='{"bucket_name": "gctta-attendance-archive"}'
+#
+# Local files under ATTENDANCE_ARCHIVE_DIR are the default only for DEBUG and
+# tests. Outside them archive_attendance refuses to run until it's set (a
+# FileSystemStorage on a backed-up volume is an explicit choice too).
+ATTENDANCE_ARCHIVE_DIR = os.environ.get('ATTENDANCE_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive', 'attendance'))
+ATTENDANCE_ARCHIVE_STORAGE = os.environ.get(
+    'ATTENDANCE_ARCHIVE_STORAGE', 'django.core.files.storage.FileSystemStorage' if DEBUG or TESTING else ''
+)
+STORAGES = dict(global_settings.STORAGES)
+if ATTENDANCE_ARCHIVE_STORAGE:
+    STORAGES['attendance_archive'] = {
+        'BACKEND': ATTENDANCE_ARCHIVE_STORAGE,
+        'OPTIONS': json.loads(os.environ.get('ATTENDANCE_ARCHIVE_STORAGE_OPTIONS') or '{}'),
+    }
+    if ATTENDANCE_ARCHIVE_STORAGE == 'django.core.files.storage.FileSystemStorage':
+        STORAGES['attendance_archive']['OPTIONS'].setdefault('location', ATTENDANCE_ARCHIVE_DIR)
+ATTENDANCE_ARCHIVE_AFTER_DAYS = int(os.environ.get('ATTENDANCE_ARCHIVE_AFTER_DAYS', '400'))
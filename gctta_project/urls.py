@@ -2,10 +2,13 @@
 
 from django.contrib import admin
 from django.urls import path, include
+from api.views import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     # This line tells the project to look at our api/urls.py file
     # for any address that starts with 'api/'
     path('api/', include('api.urls')),
+    # Prometheus scrapes request metrics from here
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file